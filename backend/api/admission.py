@@ -0,0 +1,260 @@
+import asyncio
+import contextlib
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+from errors import TooManyRequests
+
+_queue_timeout = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2))  # seconds a request may wait for a slot
+_queue_limit = int(os.environ.get('ADMISSION_QUEUE_LIMIT', 64))  # requests waiting per kind, beyond that 429 at once
+_prune_above = 1024  # idle users kept before their state is dropped
+
+
+@dataclass(frozen=True)
+class Limits:
+    """
+    Admission limits for one kind of work; 0 disables a limit.
+
+    :ivar user_concurrency: Requests of this kind one user may have running.
+    :ivar global_concurrency: Requests of this kind the process runs at once.
+    :ivar rate: Requests per second one user may start, on average.
+    :ivar burst: Requests one user may start back to back before `rate` applies.
+    """
+    user_concurrency: int
+    global_concurrency: int
+    rate: float
+    burst: int
+
+    @classmethod
+    def from_env(cls, kind: str, user_concurrency: int, global_concurrency: int, rate: float, burst: int) -> 'Limits':
+        prefix = f'ADMISSION_{kind.upper()}'
+        return cls(
+            user_concurrency=int(os.environ.get(f'{prefix}_USER_CONCURRENCY', user_concurrency)),
+            global_concurrency=int(os.environ.get(f'{prefix}_GLOBAL_CONCURRENCY', global_concurrency)),
+            rate=float(os.environ.get(f'{prefix}_RATE', rate)),
+            burst=int(os.environ.get(f'{prefix}_BURST', burst)),
+        )
+
+
+limits: dict[str, Limits] = {
+    'llm': Limits.from_env('llm', user_concurrency=2, global_concurrency=32, rate=.5, burst=5),
+    'db': Limits.from_env('db', user_concurrency=4, global_concurrency=32, rate=5, burst=20),
+}
+
+
+class _Slots:
+    """
+    A counting semaphore that knows how many are running and waiting.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.limit <= 0:
+            self.active += 1
+            return True
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:  # cancelled while waiting, e.g. the client went away
+            if waiter.done():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                waiter.cancel()
+            raise
+        if waiter.done():  # handed over by `release`, possibly just as the wait timed out
+            return True
+        self._waiters.remove(waiter)
+        waiter.cancel()
+        return False
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)  # the slot passes on, `active` stays the same
+                return
+        self.active -= 1
+
+
+@dataclass
+class _Bucket:
+    rate: float
+    burst: int
+    tokens: float = None
+    updated: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.tokens = self.burst if self.tokens is None else self.tokens
+
+    def refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def delay(self) -> float:
+        """
+        :return: Seconds until a token is available; 0 if one is now.
+        """
+        return max(1 - self.refill(), 0) / self.rate
+
+
+@dataclass
+class _User:
+    slots: _Slots
+    bucket: _Bucket | None
+
+
+@dataclass
+class _Stats:
+    admitted: int = 0
+    rejected: int = 0
+    waits: deque[float] = field(default_factory=lambda: deque(maxlen=1000))  # seconds, latest admissions
+
+
+class Controller:
+    """
+    Admits one kind of work per user and for the whole process. A request first takes a token
+    from its user's bucket, then a slot among its user's requests, then a slot in the process.
+    Each step may wait, for `queue_timeout` seconds in total; a request that would wait longer,
+    or that finds `queue_limit` requests already waiting, is refused with a 429.
+
+    The state lives on the event loop, so it is per process, like circuits and health checks.
+    """
+
+    def __init__(self, kind: str, limits: Limits, queue_timeout: float = _queue_timeout, queue_limit: int = _queue_limit):
+        self.kind = kind
+        self.limits = limits
+        self.queue_timeout = queue_timeout
+        self.queue_limit = queue_limit
+        self._global = _Slots(limits.global_concurrency)
+        self._users: dict[str, _User] = {}
+        self._stats = _Stats()
+        self._pacing = 0  # requests waiting for a token
+
+    def _user(self, user_id: str) -> _User:
+        if (user := self._users.get(user_id)) is None:
+            if len(self._users) >= _prune_above:
+                self._prune()
+            bucket = _Bucket(self.limits.rate, self.limits.burst) if self.limits.rate > 0 else None
+            user = self._users[user_id] = _User(_Slots(self.limits.user_concurrency), bucket)
+        return user
+
+    def _prune(self) -> None:
+        for user_id, user in list(self._users.items()):
+            idle = not user.slots.active and not user.slots.waiting
+            if idle and (user.bucket is None or user.bucket.refill() >= user.bucket.burst):
+                del self._users[user_id]
+
+    @property
+    def waiting(self) -> int:
+        return self._pacing + self._global.waiting + sum(each.slots.waiting for each in self._users.values())
+
+    def _refuse(self, reason: str, retry_after: float) -> TooManyRequests:
+        self._stats.rejected += 1
+        return TooManyRequests(f'Too many {self.kind} requests: {reason}', round(max(retry_after, 1), 1))
+
+    @contextlib.asynccontextmanager
+    async def admit(self, user_id: str) -> AsyncIterator[None]:
+        """
+        Holds a user and a global slot for the duration of the block.
+
+        :raises TooManyRequests: If the request cannot be admitted within the queue timeout.
+        """
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        user = self._user(user_id)
+        if self.waiting >= self.queue_limit:
+            raise self._refuse('queue is full', self.queue_timeout)
+
+        if user.bucket is not None:
+            delay = user.bucket.delay()
+            if delay > self.queue_timeout:
+                raise self._refuse('rate limit', delay)
+            user.bucket.tokens -= 1  # reserved now, so that later requests wait behind this one
+            if delay:
+                self._pacing += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._pacing -= 1
+
+        if not await user.slots.acquire(deadline - time.monotonic()):
+            raise self._refuse('per-user concurrency', self.queue_timeout)
+        try:
+            if not await self._global.acquire(deadline - time.monotonic()):
+                raise self._refuse('server is busy', self.queue_timeout)
+            try:
+                self._stats.admitted += 1
+                self._stats.waits.append(time.monotonic() - started)
+                yield
+            finally:
+                self._global.release()
+        finally:
+            user.slots.release()
+
+    def metrics(self) -> dict:
+        waits = sorted(self._stats.waits)
+
+        def percentile(p: float) -> float | None:
+            return round(waits[min(int(len(waits) * p), len(waits) - 1)] * 1000, 1) if waits else None
+
+        return {
+            'active': self._global.active,
+            'queued': self.waiting,
+            'users': len(self._users),
+            'admitted': self._stats.admitted,
+            'rejected': self._stats.rejected,
+            'waitMs': {'p50': percentile(.5), 'p95': percentile(.95), 'p99': percentile(.99), 'max': percentile(1)},
+            'limits': {
+                'userConcurrency': self.limits.user_concurrency,
+                'globalConcurrency': self.limits.global_concurrency,
+                'rate': self.limits.rate,
+                'burst': self.limits.burst,
+                'queueTimeout': self.queue_timeout,
+                'queueLimit': self.queue_limit,
+            },
+        }
+
+
+controllers: dict[str, Controller] = {kind: Controller(kind, each) for kind, each in limits.items()}
+
+
+@contextlib.asynccontextmanager
+async def admit(user_id: str, kind: str, *, resuming: bool = False) -> AsyncIterator[None]:
+    """
+    Admits a request for `kind` of work ('llm' or 'db') on behalf of a user.
+    Reconnections to a running stream start no new work and are let through.
+
+    :raises TooManyRequests: If the request cannot be admitted within `ADMISSION_QUEUE_TIMEOUT`.
+    """
+    if resuming:
+        yield
+        return
+    async with controllers[kind].admit(user_id):
+        yield
+
+
+def metrics() -> dict:
+    """
+    Running and queued requests, admissions, refusals and recent queueing times, per kind of work.
+    """
+    return {kind: each.metrics() for kind, each in controllers.items()}
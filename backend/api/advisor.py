@@ -0,0 +1,385 @@
+import json
+import os
+import re
+from contextlib import closing
+from dataclasses import dataclass, field, asdict
+from typing import Any
+
+import q as queries
+from cache import TTLCache
+from db import run, connect
+from framework import run_blocking
+from models import Connector
+from streams import Generation
+from utils import snake_to_camel
+
+_advice: TTLCache[tuple[str, int], dict] = TTLCache(ttl=float(os.environ.get('ADVISOR_CACHE_TTL', 900)))
+
+top = 20  # statements looked at, by total execution time
+_small_table = 10_000  # rows under which a sequential scan is about as good as an index
+_width = 3  # columns per candidate index
+_useless = .2  # estimated share of rows matched above which an index is not proposed
+_range_selectivity = 1 / 3  # what Postgres assumes for an inequality without statistics
+_generic_plan = 160_000  # first server version with EXPLAIN (GENERIC_PLAN)
+
+_name = r'"?\w+"?'
+_relations = re.compile(rf'\b(?:FROM|JOIN|UPDATE)\s+((?:{_name}\.)?{_name})(?:\s+(?:AS\s+)?({_name}))?', re.I)
+_predicates = re.compile(
+    rf'\b(?:WHERE|ON|AND|OR|NOT)\s+\(?\s*(?:({_name})\.)?({_name})\s*'
+    rf'(=|<>|!=|<=|>=|<|>|IN\b|LIKE\b|ILIKE\b|BETWEEN\b|IS\s+NULL\b)'
+    rf'(?:\s*({_name})\.({_name}))?',
+    re.I,
+)
+_ordering = re.compile(rf'\bORDER\s+BY\s+(?:({_name})\.)?({_name})', re.I)
+_keywords = {
+    'on', 'where', 'join', 'inner', 'left', 'right', 'full', 'cross', 'natural', 'using',
+    'group', 'order', 'limit', 'offset', 'having', 'window', 'union', 'except', 'intersect', 'set',
+}
+_equalities = {'=', 'in', 'is null'}
+_strength = {'order': 0, 'range': 1, 'eq': 2}  # how a column used several ways is classified
+
+
+@dataclass
+class Table:
+    name: str
+    rows: float
+    distinct: dict[str, float]  # column -> estimated distinct values
+    indexes: dict[str, list[str]]  # index name -> columns
+
+
+@dataclass
+class Statement:
+    query_id: str
+    query: str
+    calls: int
+    total_ms: float
+    mean_ms: float
+    rows: int
+
+    def to_dict(self) -> dict[str, Any]:
+        return {snake_to_camel(k): v for k, v in asdict(self).items()}
+
+
+@dataclass
+class Candidate:
+    """
+    An index that would serve some of the top statements.
+
+    :ivar statements: Ids of the statements filtering or sorting on the columns, with their
+        execution time since statistics were reset.
+    :ivar selectivity: Estimated share of the table's rows the index lets them read.
+    :ivar replaces: Existing indexes that are a prefix of this one and would become redundant.
+    :ivar costs: Planner cost per statement before and after, if validated with hypopg.
+    """
+    table: str
+    columns: tuple[str, ...]
+    rows: float
+    selectivity: float
+    statements: dict[str, float] = field(default_factory=dict)
+    replaces: list[str] = field(default_factory=list)
+    costs: dict[str, tuple[float, float]] | None = None
+
+    @property
+    def definition(self) -> str:
+        return f'CREATE INDEX ON {self.table} ({", ".join(self.columns)})'
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.statements.values())
+
+    @property
+    def benefit_ms(self) -> float:
+        """
+        Execution time the index could have saved: the statements' time scaled by the
+        planner's cost reduction if validated, otherwise by the rows it lets them skip.
+        """
+        if self.costs is None:
+            return self.total_ms * (1 - self.selectivity)
+        return sum(
+            self.statements[query_id] * (1 - after / before)
+            for query_id, (before, after) in self.costs.items() if before > 0
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'table': self.table,
+            'columns': list(self.columns),
+            'definition': self.definition,
+            'estimatedRows': self.rows,
+            'selectivity': round(self.selectivity, 6),
+            'statements': list(self.statements),
+            'statementsMs': round(self.total_ms, 3),
+            'estimatedBenefitMs': round(self.benefit_ms, 3),
+            'replaces': self.replaces,
+            'validated': self.costs is not None,
+            **({'costs': {
+                query_id: {'before': before, 'after': after}
+                for query_id, (before, after) in self.costs.items()
+            }} if self.costs is not None else {}),
+        }
+
+
+def tables_of(inspection: dict | None, database: str = None) -> dict[str, Table]:
+    """
+    Tables from a `q.inspect` document, keyed both by 'schema.table' and by the bare table name,
+    since statements usually leave the schema out.
+
+    :param database: Only take the tables of this database; an inspection may cover several,
+        and a same-named table in another one would otherwise take the place of the right one.
+    """
+    tables = {}
+    match inspection:
+        case {'databases': list() as databases}:
+            for each_database in databases:
+                if database is not None and each_database['databaseName'] != database:
+                    continue
+                for schema in each_database.get('schemata') or []:
+                    for each in schema.get('tables') or []:
+                        table = Table(
+                            name=f'{each["schema"]}.{each["tableName"]}',
+                            rows=each.get('estimatedRows') or 0,
+                            distinct={
+                                column['columnName']: column.get('distinctValues') or 0
+                                for column in each.get('columns') or []
+                            },
+                            indexes={
+                                index['indexName']: index.get('columns') or []
+                                for index in each.get('indexes') or []
+                            },
+                        )
+                        tables[table.name] = table
+                        tables.setdefault(each['tableName'], table)
+    return tables
+
+
+def _unquote(name: str | None) -> str | None:
+    return name.strip('"') if name else name
+
+
+def _references(sql: str, tables: dict[str, Table]) -> dict[str, Table]:
+    """
+    Tables a statement reads, keyed by every name it refers to them with (table name and alias).
+    """
+    aliases = {}
+    for relation, alias in _relations.findall(sql):
+        if (table := tables.get(_unquote(relation))) is None:
+            continue
+        aliases[_unquote(relation).rpartition('.')[2]] = table
+        if alias and alias.lower() not in _keywords:
+            aliases[_unquote(alias)] = table
+    return aliases
+
+
+def _resolve(qualifier: str | None, column: str, aliases: dict[str, Table]) -> Table | None:
+    if qualifier:
+        table = aliases.get(_unquote(qualifier))
+        return table if table is not None and column in table.distinct else None
+    owners = {id(table): table for table in aliases.values() if column in table.distinct}
+    return next(iter(owners.values())) if len(owners) == 1 else None
+
+
+def _filters(sql: str, tables: dict[str, Table]) -> dict[str, tuple[Table, dict[str, str]]]:
+    """
+    Columns a statement filters, joins or sorts on, per table.
+
+    :return: Table name -> the table and its columns, each marked 'eq', 'range' or 'order'.
+    """
+    aliases = _references(sql, tables)
+    found: dict[str, tuple[Table, dict[str, str]]] = {}
+
+    def note(table: Table | None, column: str, kind: str) -> None:
+        if table is None:
+            return
+        _, columns = found.setdefault(table.name, (table, {}))
+        if _strength[kind] > _strength.get(columns.get(column), -1):
+            columns[column] = kind
+
+    for qualifier, column, operator, other_qualifier, other in _predicates.findall(sql):
+        kind = 'eq' if _whitespace(operator.lower()) in _equalities else 'range'
+        note(_resolve(qualifier, _unquote(column), aliases), _unquote(column), kind)
+        if other and kind == 'eq':  # the other side of a join
+            note(_resolve(other_qualifier, _unquote(other), aliases), _unquote(other), 'eq')
+    for qualifier, column in _ordering.findall(sql):
+        note(_resolve(qualifier, _unquote(column), aliases), _unquote(column), 'order')
+    return found
+
+
+def _whitespace(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def candidates(statements: list[Statement], tables: dict[str, Table]) -> list[Candidate]:
+    """
+    Proposes indexes for the statements' filters on large tables: equality columns first,
+    most selective first, then one range or sort column. Indexes that already exist,
+    or that would match too large a share of the table to be used, are left out.
+
+    :return: Candidates, most promising first.
+    """
+    proposed: dict[tuple[str, tuple[str, ...]], Candidate] = {}
+    for statement in statements:
+        for table, columns in _filters(statement.query, tables).values():
+            if table.rows < _small_table:
+                continue
+            equal = sorted(
+                (column for column, kind in columns.items() if kind == 'eq'),
+                key=lambda column: -table.distinct.get(column, 0),
+            )
+            ranged = [column for column, kind in columns.items() if kind == 'range']
+            ordered = [column for column, kind in columns.items() if kind == 'order']
+            chosen = tuple((equal + (ranged or ordered)[:1])[:_width])
+            if not chosen:
+                continue
+            if any(existing[:len(chosen)] == list(chosen) for existing in table.indexes.values()):
+                continue
+
+            selectivity = 1.0
+            for column in chosen:
+                if column in equal:
+                    selectivity /= max(table.distinct.get(column) or 1, 1)
+                elif column in ranged:
+                    selectivity *= _range_selectivity
+            if selectivity > _useless and not ordered:
+                continue
+
+            candidate = proposed.setdefault((table.name, chosen), Candidate(
+                table=table.name,
+                columns=chosen,
+                rows=table.rows,
+                selectivity=selectivity,
+                replaces=[
+                    name for name, existing in table.indexes.items()
+                    if existing and list(chosen[:len(existing)]) == existing
+                ],
+            ))
+            candidate.statements[statement.query_id] = statement.total_ms
+    return sorted(_merged(list(proposed.values())), key=lambda each: each.benefit_ms, reverse=True)
+
+
+def _merged(proposed: list[Candidate]) -> list[Candidate]:
+    """
+    Folds each candidate into a wider one on the same table that starts with the same columns,
+    since the wider index serves both sets of statements.
+    """
+    kept = []
+    for candidate in sorted(proposed, key=lambda each: -len(each.columns)):
+        wider = next((
+            each for each in kept
+            if each.table == candidate.table and each.columns[:len(candidate.columns)] == candidate.columns
+        ), None)
+        if wider is None:
+            kept.append(candidate)
+            continue
+        wider.statements |= candidate.statements
+    return kept
+
+
+def _cost(connection, query: str) -> float | None:
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (GENERIC_PLAN, FORMAT JSON) {query}')
+            [[plan]] = cursor.fetchone()
+        return plan['Plan']['Total Cost']
+    except Exception as e:  # truncated or otherwise unplannable statement text
+        print(f'Advisor could not plan a statement: {type(e).__name__}: {e}')
+        connection.rollback()
+        return None
+
+
+def validate(connection, candidate: Candidate, statements: dict[str, Statement], baseline: dict[str, float]) -> None:
+    """
+    Plans the candidate's statements with and without it as a hypothetical index (hypopg),
+    so nothing is built. Statements that cannot be planned are skipped.
+
+    :param baseline: Costs without the index per statement, filled in as needed.
+    """
+    costs = {}
+    for query_id in candidate.statements:
+        query = statements[query_id].query
+        if query_id not in baseline:
+            baseline[query_id] = _cost(connection, query)
+        if baseline[query_id] is None:
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexrelid FROM hypopg_create_index(%s)', (candidate.definition,))
+        try:
+            after = _cost(connection, query)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT hypopg_reset()')
+        if after is not None:
+            costs[query_id] = baseline[query_id], after
+    connection.rollback()
+    candidate.costs = costs if costs else None
+
+
+def _statements(connection, server_version: int, limit: int) -> list[Statement]:
+    timings = ('total_exec_time', 'mean_exec_time') if server_version >= 130_000 else ('total_time', 'mean_time')
+    q = queries.statements.format(total=timings[0], mean=timings[1])
+    return [Statement(**row) for row in run(connection, q, {'limit': limit})]
+
+
+def _inspection(connector: Connector, connection) -> dict:
+    if connector.load_stored('inspection').inspection:
+        return json.loads(connector.inspection)
+    return list(run(connection, queries.inspect, {'schemata': None}))[0]
+
+
+def setup(connector: Connector) -> tuple[int, set[str]]:
+    """
+    :return: Server version number and the extensions installed in the connector's database.
+    """
+    with closing(connect(connector)) as connection:
+        [row] = run(connection, queries.extensions)
+        return row['server_version'], set(row['extensions'])
+
+
+async def advise(
+        connector: Connector,
+        generation: Generation,
+        *,
+        server_version: int,
+        extensions: set[str],
+        limit: int = top,
+        refresh: bool = False,
+) -> None:
+    """
+    Publishes index advice for the connector's top statements: a `statements` event,
+    then a `candidate` event per proposed index, validated with hypopg on PostgreSQL 16
+    or later when the extension is installed. Advice is cached per connector.
+
+    :param connector: Connector whose database is advised on; needs pg_stat_statements.
+    :param generation: Generation to publish to.
+    :param server_version: As returned by `setup`.
+    :param extensions: As returned by `setup`.
+    :param limit: Number of statements looked at.
+    :param refresh: Whether to ignore cached advice.
+    """
+    key = f'{connector.id}', limit
+    if not refresh and (cached := _advice.get(key)) is not None:
+        await generation.publish('statements', {'statements': cached['statements'], 'cached': True})
+        for each in cached['candidates']:
+            await generation.publish('candidate', each)
+        return
+
+    with closing(await run_blocking(lambda: connect(connector))) as connection:
+        statements = await run_blocking(lambda: _statements(connection, server_version, limit))
+        await generation.publish('statements', {'statements': [each.to_dict() for each in statements]})
+
+        tables = tables_of(await run_blocking(lambda: _inspection(connector, connection)), connector.database)
+        proposed = candidates(statements, tables)
+        validating = 'hypopg' in extensions and server_version >= _generic_plan
+        by_id = {each.query_id: each for each in statements}
+        baseline = {}
+
+        published = []
+        for candidate in proposed:
+            if validating:
+                await run_blocking(lambda: validate(connection, candidate, by_id, baseline))
+            published.append(candidate.to_dict())
+            await generation.publish('candidate', published[-1])
+
+    _advice.put(key, {
+        'statements': [each.to_dict() for each in statements],
+        'candidates': sorted(published, key=lambda each: each['estimatedBenefitMs'], reverse=True),
+    })
@@ -1,13 +1,26 @@
 import json
+import os
+from math import ceil
 
+import admission
 import chats
+import columnar
 import connectors
+import cpu
+import persistence
+import usage
 from signatures import Scope, Send, Receive
 from framework import parse_qs
 
-from errors import EmptyResponse, IncorrectSignature, NotFound, Unauthorized
+from errors import (
+    EmptyResponse, IncorrectSignature, NotFound, Unauthorized, NotModified, NotAcceptable, ExcessiveQuery, Unavailable,
+    TooManyRequests, Interrupted, Forbidden,
+)
 from utils import camel_to_snake, custom_serializer
-from framework import respond, json_body, stream
+from framework import respond, json_body, stream, header_of, revalidated
+
+# user ids allowed to read process-wide metrics, comma-separated
+_operators = frozenset(filter(None, (each.strip() for each in os.environ.get('OPERATORS', '').split(','))))
 
 _cors = {
     "Access-Control-Allow-Origin": "*",
@@ -68,7 +81,23 @@ def user_of(event: dict) -> str:
         raise
 
 
-async def router(event: dict[str, object], send: Send, receive: Receive) -> dict | tuple[dict | None, int] | None:
+def tier_of(event: dict) -> str | None:
+    """
+    The user's tier, from the same trusted source as the user: the API Gateway authorizer's user claims,
+    or the `x-user-tier` header the edge authorizer sets from the token's claims, dropping any the client sent.
+    """
+    match event:
+        case {'requestContext': {'authorizer': {'user': raw}}}:  # API Gateway
+            return json.loads(raw).get('tier')
+        case _:
+            return header_of(event, 'x-user-tier')
+
+
+async def router(
+        event: dict[str, object],
+        send: Send,
+        receive: Receive,
+) -> dict | tuple[dict | None, int] | tuple[dict, int, dict] | None:
     match event:
         case {  # uvicorn event
                  'path': path,
@@ -90,30 +119,68 @@ async def router(event: dict[str, object], send: Send, receive: Receive) -> dict
             payload = await request(event, receive)
 
             user = user_of(event)
+            if_none_match = header_of(event, 'if-none-match')
+            last_event_id = header_of(event, 'last-event-id')
+            idempotency_key = header_of(event, 'idempotency-key')
+            tier = tier_of(event)
             match path.split('/'), f'{verb}'.upper():
                 case ['', 'connectors'], 'GET':
-                    return connectors.get(user)
+                    return connectors.get(user, if_none_match=if_none_match)
                 case ['', 'connectors'], 'POST':
                     return connectors.make(payload, user)
                 case ['', 'connectors', connector_id], 'PUT':
                     return connectors.edit(connector_id, user, payload)
                 case ['', 'connectors', connector_id], 'DELETE':
-                    return connectors.delete(connector_id, user)
+                    return await connectors.delete(connector_id, user, send, accept=header_of(event, 'accept'))
+                case ['', 'connectors', connector_id, 'health'], 'GET':
+                    return await connectors.health(connector_id, user, payload)
                 case ['', 'connectors', connector_id, 'inspect'], 'GET':
-                    return connectors.inspect(connector_id, user, payload)
+                    return await connectors.inspect(connector_id, user, payload, if_none_match=if_none_match)
                 case ['', 'connectors', connector_id, 'query'], 'POST':
-                    return connectors.query(connector_id, user, payload)
+                    async with admission.admit(user, 'db'):
+                        if media_type := columnar.negotiate(header_of(event, 'accept')):
+                            return await connectors.query_columnar(connector_id, user, send, payload, media_type)
+                        return await connectors.query(connector_id, user, payload)
+                case ['', 'connectors', connector_id, 'export'], 'POST':
+                    async with admission.admit(user, 'db'):
+                        return await connectors.export(connector_id, user, send, receive, payload)
+                case ['', 'connectors', connector_id, 'profile'], 'POST':
+                    async with admission.admit(user, 'db', resuming=last_event_id is not None):
+                        return await connectors.profile(connector_id, user, send, payload, last_event_id=last_event_id)
+                case ['', 'connectors', connector_id, 'advise'], 'GET':
+                    async with admission.admit(user, 'db', resuming=last_event_id is not None):
+                        return await connectors.advise(connector_id, user, send, payload, last_event_id=last_event_id)
                 case ['', 'connectors', connector_id, 'explain'], 'POST':
-                    return await connectors.explain(connector_id, user, send)
+                    async with admission.admit(user, 'llm', resuming=last_event_id is not None):
+                        return await connectors.explain(
+                            connector_id, user, send, payload,
+                            last_event_id=last_event_id, idempotency_key=idempotency_key,
+                        )
 
                 case ['', 'connectors', connector_id, 'chats'], 'POST':
-                    return await chats.start_chat(connector_id, user, send, payload, stream=True)
+                    async with admission.admit(user, 'llm', resuming=last_event_id is not None):
+                        return await chats.start_chat(
+                            connector_id, user, send, payload, stream=True,
+                            last_event_id=last_event_id, idempotency_key=idempotency_key, tier=tier,
+                        )
                 case ['', 'chats', chat_id, 'messages'], 'POST':
-                    return await chats.add_message(chat_id, user, send, payload, stream=True)
+                    async with admission.admit(user, 'llm', resuming=last_event_id is not None):
+                        return await chats.add_message(
+                            chat_id, user, send, payload, stream=True,
+                            last_event_id=last_event_id, idempotency_key=idempotency_key, tier=tier,
+                        )
                 case ['', 'chats'], 'GET':
-                    return chats.list_chats(user)
+                    return chats.list_chats(user, if_none_match=if_none_match)
                 case ['', 'chats', chat_id], 'DELETE':
                     return chats.delete_chat(chat_id, user)
+                case ['', 'chats', 'delete'], 'POST':
+                    return await chats.delete_chats(user, send, payload, accept=header_of(event, 'accept'))
+                case ['', 'usage'], 'GET':
+                    return usage.summary(user, payload)
+                case ['', 'metrics'], 'GET':
+                    if user not in _operators:
+                        raise Forbidden(path)
+                    return {'admission': admission.metrics()}
                 case _:
                     raise NotFound(path)
 
@@ -133,8 +200,24 @@ async def sse(send, agen):
     await send({"type": "http.response.body", "body": b"", "more_body": False})
 
 
+async def lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        match message['type']:
+            case 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            case 'lifespan.shutdown':
+                await persistence.drain()
+                cpu.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
 async def app(scope: Scope, receive: Receive, send: Send) -> None:
     print(scope)
+    if scope.get('type') == 'lifespan':
+        return await lifespan(receive, send)
+    send = persistence.flushing(send)
     try:
         r = await router(scope, send, receive)
         match r:
@@ -144,16 +227,32 @@ async def app(scope: Scope, receive: Receive, send: Send) -> None:
                 return await stream(send, agen)
             case body, code if isinstance(code, int) and isinstance(body, dict):
                 await respond(send, body=body, status=code)
+            case body, code, headers if isinstance(code, int) and isinstance(headers, dict):
+                await respond(send, body=body, status=code, headers=headers)
             case dict():
                 await respond(send, body=r, status=200)
     except EmptyResponse:
         await respond(send, status=204)
+    except NotModified as e:
+        await respond(send, status=304, headers=revalidated(e.etag))
     except IncorrectSignature as e:
         await respond(send, status=400, body=e.to_dict())
     except NotFound as e:
         await respond(send, status=404, body={'error': f'{e}'})
+    except ExcessiveQuery as e:
+        await respond(send, status=409 if e.confirmable else 422, body=e.to_dict())
+    except NotAcceptable as e:
+        await respond(send, status=406, body=e.to_dict())
+    except Unavailable as e:
+        await respond(send, status=503, body=e.to_dict(), headers={'retry-after': f'{ceil(e.retry_after or 1)}'})
+    except TooManyRequests as e:
+        await respond(send, status=429, body=e.to_dict(), headers={'retry-after': f'{ceil(e.retry_after or 1)}'})
     except Unauthorized as e:
         await respond(send, status=401, body={'error': f'{e}'})
+    except Forbidden as e:
+        await respond(send, status=403, body={'error': f'{e}'})
+    except Interrupted:
+        raise  # the server aborts the connection
     except Exception as e:
         print(f'{type(e).__name__}: {e}')
         from traceback import print_exc
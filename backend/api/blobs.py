@@ -0,0 +1,174 @@
+import hashlib
+import os
+import random
+import time
+import zlib
+from typing import Final
+
+from dynamo import db
+
+from deletes import write_batch
+from errors import Unavailable
+
+_table = os.environ['TABLE_NAME']
+_chunk = 350_000  # bytes of data per item, under DynamoDB's 400 KB item limit with room for the key
+_write_batch = 25  # BatchWriteItem's limit
+_get_batch = 100  # BatchGetItem's limit
+_retries = 5  # for keys DynamoDB leaves unprocessed
+_backoff = .1  # seconds, doubled on every retry
+
+blob_type: Final[str] = 'BLOB'
+
+
+def version_of(value: str) -> str:
+    """
+    Identifies a value's contents, to tell whether a stored blob is the same without reading it.
+    """
+    return hashlib.sha1(value.encode()).hexdigest()[:16]  # to tell versions apart, not to sign
+
+
+def save(owner: dict, name: str, value: str) -> str:
+    """
+    Stores a value too large for its owner's item beside it: compressed with zlib and split into chunks
+    of at most 350 KB, each an item of the owner's partition. Chunks are keyed by the value's version,
+    so saving never overwrites those of another one: the value the owner references stays readable
+    until the owner is switched to the new reference. The old chunks are then dropped with `discard`.
+
+    :param owner: Key of the item the value belongs to.
+    :param name: Name of the value, unique per owner.
+    :raises Unavailable: If some chunks could not be written.
+    :return: Reference to keep on the owner's item, for `load`.
+    """
+    version = version_of(value)
+    data = zlib.compress(value.encode())
+    chunks = [data[at:at + _chunk] for at in range(0, len(data), _chunk)] or [b'']
+    _write([
+        {'PutRequest': {'Item': _key(owner, name, version, index) | {'data': {'B': chunk}}}}
+        for index, chunk in enumerate(chunks)
+    ])
+    return f'{version}:{len(chunks)}'
+
+
+def discard(owner: dict, name: str, ref: str | None) -> None:
+    """
+    Deletes the chunks of a value no longer referenced, e.g. the one a `save` replaced.
+
+    :param ref: The reference `save` returned for it.
+    :raises Unavailable: If some chunks could not be deleted.
+    """
+    if ref:
+        version, count = _parse(ref)
+        _write([{'DeleteRequest': {'Key': _key(owner, name, version, index)}} for index in range(count)])
+
+
+def load(owner: dict, name: str, ref: str | None) -> str | None:
+    """
+    Reads a value stored with `save`.
+
+    :param ref: The reference `save` returned.
+    :return: The value, or None if there is none, or its chunks are missing.
+    """
+    return load_all([(owner, name, ref)])[0]
+
+
+def load_all(wanted: list[tuple[dict, str, str | None]]) -> list[str | None]:
+    """
+    Reads several values stored with `save` with as few strongly consistent `BatchGetItem` calls as they take.
+
+    :param wanted: Owner's key, name and reference of each value.
+    :return: The values in the same order, see `load`.
+    """
+    keys = [
+        _key(owner, name, version, index)
+        for owner, name, ref in wanted if ref
+        for version, count in [_parse(ref)]
+        for index in range(count)
+    ]
+    chunks: dict[tuple[str, str], dict] = {}
+    for at in range(0, len(keys), _get_batch):
+        for item in _get(keys[at:at + _get_batch]):
+            chunks[item['PK']['S'], item['SK']['S']] = item
+
+    values = []
+    for owner, name, ref in wanted:
+        if not ref:
+            values.append(None)
+            continue
+        version, count = _parse(ref)
+        parts = [
+            chunks.get((key['PK']['S'], key['SK']['S']))
+            for key in (_key(owner, name, version, index) for index in range(count))
+        ]
+        if any(part is None for part in parts):
+            values.append(None)
+            continue
+        values.append(zlib.decompress(b''.join(part['data']['B'] for part in parts)).decode())
+    return values
+
+
+def discard_all(owner: dict) -> None:
+    """
+    Deletes every value stored for an owner, e.g. once the owner's item was replaced without its references.
+
+    :raises Unavailable: If some chunks could not be deleted.
+    """
+    _write([{'DeleteRequest': {'Key': key}} for key in keys_of(owner)])
+
+
+def keys_of(owner: dict) -> list[dict]:
+    """
+    Keys of every chunk stored for an owner, to delete them along with it.
+    """
+    keys, start = [], None
+    while True:
+        response = db().query(
+            TableName=_table,
+            KeyConditionExpression='#PK = :PK AND begins_with(#SK, :prefix)',
+            ProjectionExpression='#PK, #SK',
+            ExpressionAttributeNames={
+                '#PK': 'PK',
+                '#SK': 'SK',
+            },
+            ExpressionAttributeValues={
+                ':PK': owner['PK'],
+                ':prefix': {'S': f'{blob_type}#{owner["SK"]["S"]}#'},
+            },
+            **({'ExclusiveStartKey': start} if start else {}),
+        )
+        keys += [{'PK': item['PK'], 'SK': item['SK']} for item in response.get('Items') or []]
+        if not (start := response.get('LastEvaluatedKey')):
+            return keys
+
+
+def _key(owner: dict, name: str, version: str, index: int) -> dict:
+    return {
+        'PK': owner['PK'],
+        'SK': {'S': f'{blob_type}#{owner["SK"]["S"]}#{name}#{version}#{index:03}'},
+    }
+
+
+def _parse(ref: str) -> tuple[str, int]:
+    version, _, count = ref.partition(':')
+    return version, int(count)
+
+
+def _write(requests: list[dict]) -> None:
+    for at in range(0, len(requests), _write_batch):
+        if left := write_batch(requests[at:at + _write_batch]):
+            raise Unavailable(f'{len(left)} chunks could not be written', _backoff * 2 ** _retries)
+
+
+def _get(keys: list[dict]) -> list[dict]:
+    """
+    Reads one batch, then asks again for whatever DynamoDB left unprocessed, with jittered exponential backoff.
+    """
+    items, pending = [], {_table: {'Keys': keys, 'ConsistentRead': True}}
+    for attempt in range(_retries + 1):
+        response = db().batch_get_item(RequestItems=pending)
+        items += response.get('Responses', {}).get(_table) or []
+        if not (pending := response.get('UnprocessedKeys') or {}):
+            return items
+        if attempt < _retries:
+            delay = _backoff * 2 ** attempt
+            time.sleep(delay + random.uniform(0, delay))
+    raise Unavailable(f'{len(pending[_table]["Keys"])} chunks could not be read', _backoff * 2 ** _retries)
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Hashable
+
+from errors import Unavailable
+
+_failures = int(os.environ.get('CIRCUIT_FAILURES', 2))  # consecutive failures that open the circuit
+_cooldown = float(os.environ.get('CIRCUIT_COOLDOWN', 30))  # seconds an open circuit fails fast
+
+
+@dataclass
+class Circuit:
+    """
+    Connection outcomes for one target.
+
+    :ivar failures: Consecutive failed attempts.
+    :ivar opened_at: When the circuit last opened, if it is open.
+    :ivar error: Last failure, reported while failing fast.
+    :ivar trial: Whether an attempt is under way after the cooldown (half-open).
+    """
+    failures: int = 0
+    opened_at: float = None
+    error: str = None
+    trial: bool = False
+
+
+class Breaker:
+    """
+    Remembers which targets recently failed to connect, so that further attempts fail right away
+    instead of each waiting for its own connect timeout. After `cooldown` seconds, a single
+    attempt is let through; if it succeeds, the circuit closes again.
+
+    Connections are opened from worker threads, hence the lock.
+    """
+
+    def __init__(self, failures: int = _failures, cooldown: float = _cooldown):
+        self._failures = failures
+        self._cooldown = cooldown
+        self._circuits: dict[Hashable, Circuit] = {}
+        self._lock = threading.Lock()
+
+    def before(self, target: Hashable, name: str) -> None:
+        """
+        :param target: What is being connected to.
+        :param name: How to call it in the error.
+        :raises Unavailable: If the circuit is open, or another attempt is already probing it.
+        """
+        with self._lock:
+            circuit = self._circuits.get(target)
+            if circuit is None or circuit.opened_at is None:
+                return
+            waited = time.monotonic() - circuit.opened_at
+            if waited < self._cooldown or circuit.trial:
+                raise Unavailable(f'{name} is unreachable: {circuit.error}', round(max(self._cooldown - waited, 1), 1))
+            circuit.trial = True
+
+    def succeeded(self, target: Hashable) -> None:
+        with self._lock:
+            self._circuits.pop(target, None)
+
+    def failed(self, target: Hashable, error: Exception) -> None:
+        with self._lock:
+            circuit = self._circuits.setdefault(target, Circuit())
+            circuit.failures += 1
+            circuit.error = next(iter(f'{error}'.strip().splitlines()), type(error).__name__)
+            if circuit.trial or circuit.failures >= self._failures:
+                circuit.opened_at = time.monotonic()
+            circuit.trial = False
+
+    def abandoned(self, target: Hashable) -> None:
+        """
+        Ends an attempt that failed for reasons other than the target, without counting it as a failure.
+        A trial attempt lets the next one through.
+        """
+        with self._lock:
+            if circuit := self._circuits.get(target):
+                circuit.trial = False
+
+    def status(self, target: Hashable) -> dict[str, Any]:
+        """
+        :return: State ('closed', 'open' or 'half-open'), consecutive failures, and while open,
+            the last error and seconds until the next attempt is let through.
+        """
+        with self._lock:
+            circuit = self._circuits.get(target)
+            if circuit is None:
+                return {'state': 'closed', 'failures': 0}
+            if circuit.opened_at is None:
+                return {'state': 'closed', 'failures': circuit.failures, 'error': circuit.error}
+            remaining = self._cooldown - (time.monotonic() - circuit.opened_at)
+            return {
+                'state': 'open' if remaining > 0 and not circuit.trial else 'half-open',
+                'failures': circuit.failures,
+                'error': circuit.error,
+                'retryAfter': round(max(remaining, 0), 1),
+            }
+
+
+breaker = Breaker()
@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class TTLCache(Generic[K, V]):
+    """
+    Small in-process cache whose entries expire `ttl` seconds after they are put.
+    When full, the least recently used entry is dropped.
+
+    Every worker process keeps its own copy, so this only suits values that are
+    cheap to recompute and harmless to serve slightly stale. Within a process it is
+    shared by the threads of the pool, hence the lock.
+    """
+
+    def __init__(self, ttl: float, size: int = 1024):
+        self._ttl = ttl
+        self._size = size
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            match self._entries.get(key):
+                case expires, value if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return value
+                case None:
+                    return None
+            del self._entries[key]
+            return None
+
+    def put(self, key: K, value: V) -> V:
+        with self._lock:
+            self._entries[key] = time.monotonic() + self._ttl, value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+            return value
+
+    def pop(self, key: K) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
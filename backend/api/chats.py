@@ -1,24 +1,45 @@
+import asyncio
 import json
 import os
 import random
 import string
 import time
-from typing import AsyncIterator
+from contextlib import closing
+from dataclasses import asdict
+from typing import AsyncIterator, Awaitable, TypeVar
 
-from dynamo import db
+from dynamo import db, Ksuid
 
+import cpu
+import deletes
 import llm
-import prompts
-from utils import custom_serializer, run_query  # noqa
+import persistence
+import preflight
+import profiling
+import routing
+import streams
+import usage
+from utils import custom_serializer, run_query, is_true  # noqa
 
 from sse import send_event, finish_stream, start_stream
 from signatures import Send
-from framework import run_blocking
-from errors import EmptyResponse
+from framework import run_blocking, etag_of, etag_matches, revalidated
+from errors import EmptyResponse, NotModified, IncorrectSignature
 from models import Chat, Connector, Message, with_connector, with_chat, chat_type
+from providers import CachedContext, Usage
 from db import connect
+from persistence import Job
+from streams import Generation
 
 _table = os.environ['TABLE_NAME']
+_heartbeat = float(os.environ.get('STREAM_HEARTBEAT', 2))  # seconds between progress events
+_context_ttl = float(os.environ.get('LLM_CONTEXT_CACHE_TTL', 3600))  # seconds the provider keeps a chat's data
+_context_min_chars = int(os.environ.get('LLM_CONTEXT_CACHE_MIN_CHARS', 8000))  # shorter data is resent instead
+_profiling = is_true(os.environ.get('CHAT_PROFILE', 'false'))  # whether chats profile their data unless told otherwise
+_pending_wait = float(os.environ.get('CHAT_PENDING_WAIT', 3))  # seconds a follow-up waits for earlier turns
+_pending_poll = .1  # seconds between reads of a chat with turns pending elsewhere
+
+T = TypeVar('T')
 
 
 @with_connector
@@ -27,56 +48,75 @@ async def start_chat(
         send: Send,
         params: dict,
         stream: bool,
+        last_event_id: str = None,
+        idempotency_key: str = None,
+        tier: str = None,
 ) -> tuple[str, AsyncIterator[str] | None] | dict:
-    await start_stream(send)
-
-    chat = Chat.from_dict(params, connector.user_id, f'{connector.id}')
-    await send_event(send, event="stored", data={"chat_id": f'{chat.id}'})
-
-    connection = connect(connector)
-    results = run_query(connection, chat.limited_query())
-
-    chat.query_results = results
-
-    prompt = prompts.initial_prompt.format(
-        prompt=chat.initial_prompt,
-        data=json.dumps(results, indent=2, default=custom_serializer)
-    )
-
-    parts: list[str] = []
-
-    try:
-        if stream:
-            def s():
-                return llm.stream(
-                    prompt=prompt,
-                    history=chat.to_history(),
+    """
+    :param connector: Connector the chat's query runs against.
+    :param send: Callable function to send real-time updates to the client.
+    :param params: Request body, with an optional `model` to generate with instead of the routed ones,
+        and an optional `profile` flag to analyse a profile of the whole result, see `profiling.profile`.
+    :param stream: Whether to stream the response or not
+    :param last_event_id: `Last-Event-ID` of a client reconnecting to a stream it lost;
+        the buffered events are replayed instead of starting the chat again.
+    :param idempotency_key: `Idempotency-Key` request header. Requests repeating one share a single chat;
+        without it, concurrent requests with the same query and prompt do.
+    :param tier: The user's tier, for `routing.choose`.
+    :raises IncorrectSignature: If the model is not one the tier may ask for, see `routing.check`.
+    :raises ExcessiveQuery: If the chat's query is over the connector's limits, see `preflight.check`.
+    :return: Either a nullable iterator of strings or None, if `stream` is True and all messages were sent.
+        Otherwise, a regular Chat JSON object is returned.
+    """
+    routing.check(params.get('model'), tier)
+    profiled = is_true(params.get('profile', _profiling))
+    if stream:
+        match streams.resume(last_event_id, scope=f'{connector.id}'):
+            case generation, after:
+                pass
+            case _:
+                chat = Chat.from_dict(params, connector.user_id, f'{connector.id}')
+                if preflight.wanted(connector):
+                    await run_blocking(lambda: _preflight(connector, chat, is_true(params.get('confirm'))))
+                turn = Ksuid()
+                model = params.get('model')
+                generation = streams.single_flight(
+                    streams.flight_key(
+                        f'{connector.id}',
+                        f'{chat.initial_query}\0{chat.initial_prompt}\0{model or ""}\0{tier or ""}\0{profiled}',
+                        idempotency_key,
+                    ),
+                    f'{connector.id}.{turn}',
+                    lambda g: _open(connector, chat, turn, model, tier, profiled, g),
+                    idempotent=idempotency_key is not None,
                 )
+                after = 0
 
-            async def on_complete(text: str) -> None:
-                m = Message(message=chat.initial_prompt, response=text)
-                chat.add(m)
-                await run_blocking(lambda: chat.save_as_full_item_if_not_exists(table=_table))
-
-            for chunk in s():
-                parts.append(chunk)
-                await send_event(send, event="token", data={"t": chunk})
-
-            await on_complete("".join(parts))
-
-            return 'sse', None
-    except Exception as e:
-        await send_event(send, event="error", data={"message": str(e)})
-    finally:
-        await finish_stream(send)
+        await start_stream(send)
+        try:
+            await streams.relay(send, generation, after)
+        except Exception as e:
+            await send_event(send, event="error", data={"message": str(e)})
+        finally:
+            await finish_stream(send)
+        return 'sse', None
 
-    response = llm.call(prompt=prompt)
+    chat = Chat.from_dict(params, connector.user_id, f'{connector.id}')
+    await _query(connector, chat, profiled)
+    prompt = await _initial_prompt(chat)
+    choice = routing.choose('chat', prompt=prompt, tier=tier, model=params.get('model'))
+    tokens, started = Usage(), time.monotonic()
+    response = routing.call(choice, prompt, usage=tokens)
     first_message = Message(
         message=chat.initial_prompt,
         response=response,
+        model=choice.model,
+        duration_ms=_elapsed_ms(started),
+        **asdict(tokens),
     )
     chat.add(first_message)
     chat.save_as_full_item_if_not_exists(table=_table)
+    usage.record(chat.user_id, chat.connector_id, first_message)
     return chat.to_dict()
 
 
@@ -86,53 +126,360 @@ async def add_message(
         send: Send,
         params: dict,
         stream: bool,
+        last_event_id: str = None,
+        idempotency_key: str = None,
+        tier: str = None,
 ) -> tuple[str, AsyncIterator[str] | None] | dict:
     """
-    :param chat: Chat we're sending a message to.
+    :param chat: Chat we're sending a message to; turns still pending on it are waited for, see `_settled`.
     :param send: Callable function to send real-time updates to the client.
-    :param params: Request body
+    :param params: Request body, with an optional `model` to generate with instead of the routed ones.
     :param stream: Whether to stream the response or not
+    :param last_event_id: `Last-Event-ID` of a client reconnecting to a stream it lost;
+        the buffered events are replayed instead of generating the reply again.
+    :param idempotency_key: `Idempotency-Key` request header. Requests repeating one share a single reply;
+        without it, concurrent requests with the same message do.
+    :param tier: The user's tier, for `routing.choose`.
     :return: Either a nullable iterator of strings or None, if `stream` is True and all messages were sent.
         Otherwise, a regular Message JSON object is returned.
     """
-    follow_up = params['message']
-    await start_stream(send)
-
-    parts: list[str] = []
-
     if stream:
-        try:
-            def s():
-                return llm.stream(
-                    prompt=follow_up,
-                    history=chat.to_history(),
+        match streams.resume(last_event_id, scope=f'{chat.id}'):
+            case generation, after:
+                pass
+            case _:
+                chat = await _settled(chat)
+                follow_up = params['message']
+                turn = Ksuid()
+                choice = routing.choose(
+                    'message', prompt=follow_up, history=chat.messages, tier=tier, model=params.get('model'),
                 )
+                generation = streams.single_flight(
+                    streams.flight_key(f'{chat.id}', f'{follow_up}\0{choice.key}', idempotency_key),
+                    f'{chat.id}.{turn}',
+                    lambda g: _reply(chat, follow_up, turn, choice, g),
+                    idempotent=idempotency_key is not None,
+                )
+                after = 0
 
-            async def on_complete(text: str) -> None:
-                m = Message(message=follow_up, response=text)
-                chat.add(m)
-                await run_blocking(lambda: _append_message(chat, m))
-
-            for chunk in s():
-                parts.append(chunk)
-                await send_event(send, event="token", data={"t": chunk})
-
-            await on_complete("".join(parts))
-
-            return "sse", None
+        await start_stream(send)
+        try:
+            await streams.relay(send, generation, after)
         except Exception as e:
             await send_event(send, event="error", data={"message": str(e)})
         finally:
             await finish_stream(send)
+        return "sse", None
 
-    full_text = "".join(llm.stream(prompt=follow_up, history=chat.to_history()))
-    message = Message(message=follow_up, response=full_text)
+    chat = await _settled(chat)
+    follow_up = params['message']
+    choice = routing.choose('message', prompt=follow_up, history=chat.messages, tier=tier, model=params.get('model'))
+    history = await _history(chat)
+    context = await _context(chat, history, choice.models[0])
+    tokens, started = Usage(), time.monotonic()
+    full_text = routing.call(choice, follow_up, history=history, context=context, usage=tokens)
+    _forget_if_lost(chat, context)
+    message = Message(
+        message=follow_up,
+        response=full_text,
+        model=choice.model,
+        duration_ms=_elapsed_ms(started),
+        **asdict(tokens),
+    )
     chat.add(message)
     _append_message(chat, message)
+    usage.record(chat.user_id, chat.connector_id, message)
     return message.to_dict()
 
 
-def list_chats(user_id: str) -> dict:
+async def _open(
+        connector: Connector,
+        chat: Chat,
+        turn: Ksuid,
+        model: str | None,
+        tier: str | None,
+        profiled: bool,
+        generation: Generation,
+) -> None:
+    """
+    Produces the first turn of a new chat, with models routed once the data is in the prompt.
+    Stages overlap where they can:
+
+    - the chat item is written in the background right after `stored`, while the query runs;
+    - the query runs on a worker thread while the stream gets `progress` heartbeats,
+      and so does its profile, if asked for, on another;
+    - the analysis is appended to the item with an update after the stream has closed.
+
+    If the query or the generation fails, the chat is deleted again, as it would never get its first turn.
+    """
+    await generation.publish("stored", {"chat_id": f'{chat.id}'})
+    persistence.submit(
+        Job(
+            description=f'insert chat {chat.id}',
+            write=lambda: _insert_chat(chat, turn),
+            record={'op': 'put', 'item': chat.to_item()},
+            key=f'{chat.id}',
+        )
+    )
+
+    try:
+        await _with_heartbeat(generation, 'query', _query(connector, chat, profiled))
+        prompt = await _initial_prompt(chat)
+        choice = routing.choose('chat', prompt=prompt, tier=tier, model=model)
+        message = await _generate(
+            generation, chat.initial_prompt, turn, prompt=prompt, history=chat.to_history(), choice=choice,
+        )
+    except Exception:
+        # queued behind the insert, so it runs after it whichever finishes first
+        persistence.submit(
+            Job(
+                description=f'delete failed chat {chat.id}',
+                write=lambda: _delete_chat(chat),
+                record={'op': 'delete', 'key': chat.primary_key},
+                key=f'{chat.id}',
+            )
+        )
+        raise
+
+    chat.add(message)
+    persistence.submit(
+        Job(
+            description=f'complete chat {chat.id}',
+            write=lambda: _complete_chat(chat, message),
+            record={'op': 'complete', 'key': chat.primary_key, 'message': message.to_item()},
+            key=f'{chat.id}',
+        )
+    )
+    usage.record(chat.user_id, chat.connector_id, message)
+
+
+async def _with_heartbeat(generation: Generation, stage: str, work: Awaitable[T]) -> T:
+    """
+    Awaits `work`, publishing a `progress` event every `_heartbeat` seconds until it is done.
+    """
+    task = asyncio.ensure_future(work)
+    started = time.monotonic()
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=_heartbeat)
+        if done:
+            return task.result()
+        await generation.publish("progress", {"stage": stage, "elapsed": round(time.monotonic() - started, 1)})
+
+
+async def _settled(chat: Chat) -> Chat:
+    """
+    The chat once the turns pending on it are written, so that a follow-up sent right after `done`
+    has the previous turn in its history. Writes queued in this process are awaited; those of other
+    instances are polled for with consistent reads. A turn still generating may outlast the
+    `CHAT_PENDING_WAIT` seconds this waits at most, and the follow-up then goes on without it.
+    """
+    if not chat.pending_turns:
+        return chat
+    deadline = time.monotonic() + _pending_wait
+    await persistence.flush(f'{chat.id}', timeout=_pending_wait)
+    while True:
+        chat = await run_blocking(lambda: _read(chat)) or chat
+        if not chat.pending_turns or time.monotonic() >= deadline:
+            return chat
+        await asyncio.sleep(_pending_poll)
+
+
+def _preflight(connector: Connector, chat: Chat, confirmed: bool) -> dict:
+    with closing(connect(connector)) as connection:
+        return preflight.check(connector, connection, chat.limited_query(), confirmed=confirmed)
+
+
+async def _query(connector: Connector, chat: Chat, profiled: bool) -> None:
+    """
+    Sets the chat's query results and, if `profiled`, its data profile, gathered side by side
+    over two connections.
+    """
+    results = run_blocking(lambda: _run_limited(connector, chat))
+    if profiled:
+        chat.query_results, chat.data_profile = await asyncio.gather(
+            results, run_blocking(lambda: _profile(connector, chat)),
+        )
+    else:
+        chat.query_results = await results
+
+
+def _run_limited(connector: Connector, chat: Chat) -> tuple[list, list]:
+    with closing(connect(connector)) as connection:
+        return run_query(connection, chat.limited_query())
+
+
+def _profile(connector: Connector, chat: Chat) -> dict | None:
+    """
+    The chat's data profile; without one, e.g. if it timed out, the chat analyses its first rows instead.
+    """
+    try:
+        with closing(connect(connector)) as connection:
+            return profiling.profile(connector, connection, chat.initial_query)
+    except Exception as e:
+        print(f'Profiling the data of chat {chat.id} failed: {type(e).__name__}: {e}')
+        return None
+
+
+async def _reply(chat: Chat, follow_up: str, turn: Ksuid, choice: routing.Choice, generation: Generation) -> None:
+    """
+    Produces a reply to a follow-up message. The turn is marked as pending on
+    the chat while it generates and is appended after the stream has closed;
+    if generating it fails, the mark is cleared again.
+    """
+    persistence.submit(
+        Job(
+            description=f'mark turn {turn} of chat {chat.id} as pending',
+            write=lambda: _mark_pending(chat, turn),
+            record={'op': 'mark_pending', 'key': chat.primary_key, 'turn': f'{turn}'},
+            key=f'{chat.id}',
+        )
+    )
+    try:
+        history = await _history(chat)
+        context = await _context(chat, history, choice.models[0])
+        message = await _generate(
+            generation, follow_up, turn, prompt=follow_up, history=history, choice=choice, context=context,
+        )
+    except Exception:
+        persistence.submit(
+            Job(
+                description=f'clear failed turn {turn} of chat {chat.id}',
+                write=lambda: _clear_pending(chat, turn),
+                record={'op': 'clear_pending', 'key': chat.primary_key, 'turn': f'{turn}'},
+                key=f'{chat.id}',
+            )
+        )
+        raise
+    _forget_if_lost(chat, context)
+
+    chat.add(message)
+    persistence.submit(
+        Job(
+            description=f'append turn {turn} to chat {chat.id}',
+            write=lambda: _append_message(chat, message),
+            record={'op': 'append', 'key': chat.primary_key, 'message': message.to_item()},
+            key=f'{chat.id}',
+        )
+    )
+    usage.record(chat.user_id, chat.connector_id, message)
+
+
+async def _generate(
+        generation: Generation,
+        message: str,
+        turn: Ksuid,
+        *,
+        prompt: str,
+        history: list[dict],
+        choice: routing.Choice,
+        context: CachedContext = None,
+) -> Message:
+    """
+    Publishes LLM chunks as `token` events as they arrive.
+
+    :param message: The user's message, as stored; `prompt` is what the model gets.
+    :return: The turn, with the model that wrote the response, the tokens it took and how long it took.
+    """
+    parts: list[str] = []
+    tokens = Usage()
+    started = time.monotonic()
+    ttft_ms = None
+    async for chunk in routing.astream(choice, prompt, history=history, context=context, usage=tokens):
+        if ttft_ms is None:
+            ttft_ms = _elapsed_ms(started)
+        parts.append(chunk)
+        await generation.publish("token", {"t": chunk})
+    return Message(
+        message=message,
+        response="".join(parts),
+        _id=turn,
+        model=choice.model,
+        ttft_ms=ttft_ms,
+        duration_ms=_elapsed_ms(started),
+        **asdict(tokens),
+    )
+
+
+def _elapsed_ms(started: float) -> int:
+    return round((time.monotonic() - started) * 1000)
+
+
+async def _initial_prompt(chat: Chat) -> str:
+    """
+    Built in the process pool for large results, see `cpu.run`. A profiled chat's prompt
+    carries its profile instead of its results.
+    """
+    if chat.data_profile is not None:
+        return cpu.initial_prompt(chat.initial_prompt, None, chat.data_profile)
+    columns, rows = chat.query_results or ((), ())
+    return await cpu.run(
+        cpu.initial_prompt, chat.initial_prompt, chat.query_results, size=len(columns) * len(rows),
+    )
+
+
+async def _history(chat: Chat) -> list[dict]:
+    """
+    The chat's turns as the model saw them: the first one with the instructions and data.
+    """
+    history = chat.to_history()
+    if history:
+        history[0] = {'role': 'user', 'parts': [{'text': await _initial_prompt(chat)}]}
+    return history
+
+
+async def _context(chat: Chat, history: list[dict], model: str) -> CachedContext | None:
+    """
+    The chat's first turn, instructions and data, as context cached with the provider for `model`,
+    so that follow-ups do not send it again: the chat's own while it lasts, otherwise a new one,
+    saved on the chat.
+
+    :return: None if the data is too short to be worth caching, or the provider does not cache.
+    """
+    if chat.context is not None and chat.context.usable(model):
+        return chat.context
+    prefix = history[:1]
+    if not prefix or len(prefix[0]['parts'][0]['text']) < _context_min_chars:
+        return None
+    try:
+        context = await run_blocking(lambda: llm.cache(model, prefix, _context_ttl))
+    except Exception as e:
+        print(f'Caching the context of chat {chat.id} failed: {type(e).__name__}: {e}')
+        return None
+    if context is not None:
+        chat.context = context
+        _save_context(chat)
+    return context
+
+
+def _forget_if_lost(chat: Chat, context: CachedContext | None) -> None:
+    """
+    Drops the chat's cached context if the provider turned out not to have it anymore.
+    """
+    if context is not None and context.lost and chat.context is context:
+        chat.context = None
+        _save_context(chat)
+
+
+def _save_context(chat: Chat) -> None:
+    value = chat.context_json() if chat.context else None
+    persistence.submit(
+        Job(
+            description=f'{"save" if value else "remove"} the cached context of chat {chat.id}',
+            write=lambda: _set_context(chat, value),
+            record={'op': 'set_context', 'key': chat.primary_key, 'context': value},
+        )
+    )
+
+
+def list_chats(user_id: str, if_none_match: str = None) -> tuple[dict, int, dict]:
+    """
+    Lists the user's chats, tagged with an ETag over the raw items.
+
+    :param user_id: The unique identifier for the user.
+    :param if_none_match: Value of the `If-None-Match` request header, if any.
+    :raises NotModified: If the client's copy is current, before any chat is decoded.
+    :return: Chats along with the status code and cache headers.
+    """
     response = db().query(
         TableName=_table,
         KeyConditionExpression=f'#PK = :PK AND begins_with(#SK, :prefix)',
@@ -146,12 +493,18 @@ def list_chats(user_id: str) -> dict:
         }
     )
 
-    match response:
-        case {'Items': items}:
-            chats = [Chat.from_item(item).to_dict() for item in items]
-            return {'chats': chats}
+    items = response.get('Items')
+    etag = etag_of(items)
+    if etag_matches(etag, if_none_match):
+        raise NotModified(etag)
+
+    match items:
+        case list():
+            body = {'chats': [Chat.from_item(item).to_dict() for item in items]}
+        case _:
+            body = {'chats': None}
 
-    return {'chats': None}
+    return body, 200, revalidated(etag)
 
 
 def delete_chat(chat_id: str, user_id: str):
@@ -162,16 +515,187 @@ def delete_chat(chat_id: str, user_id: str):
     raise EmptyResponse
 
 
+async def delete_chats(user_id: str, send: Send, params: dict, accept: str = None) -> tuple[str, None] | dict:
+    """
+    Deletes a list of the user's chats in batches, see `deletes.respond`.
+
+    :param params: Request body: `ids`, the chats to delete.
+    :param accept: The request's `Accept` header; with `text/event-stream`, large deletions report progress.
+    :return: How many chats were deleted, or the marker of a finished stream.
+    """
+    match params.get('ids'):
+        case list(ids) if all(isinstance(each, str) for each in ids):
+            return await deletes.respond(send, [Chat.key(user_id, each) for each in ids], accept=accept)
+    raise IncorrectSignature(['ids'])
+
+
+def chat_keys(user_id: str, connector_id: str) -> list[dict]:
+    """
+    Keys of the user's chats on a connector, read page by page with only the keys projected.
+    """
+    keys, start = [], None
+    while True:
+        response = db().query(
+            TableName=_table,
+            KeyConditionExpression='#PK = :PK AND begins_with(#SK, :prefix)',
+            FilterExpression='#connector = :connector',
+            ProjectionExpression='#PK, #SK',
+            ExpressionAttributeNames={
+                '#PK': 'PK',
+                '#SK': 'SK',
+                '#connector': 'connector_id',
+            },
+            ExpressionAttributeValues={
+                **Chat.query_pk(user_id),
+                ':prefix': {'S': chat_type},
+                ':connector': {'S': connector_id},
+            },
+            **({'ExclusiveStartKey': start} if start else {}),
+        )
+        keys += [{'PK': item['PK'], 'SK': item['SK']} for item in response.get('Items') or []]
+        if not (start := response.get('LastEvaluatedKey')):
+            return keys
+
+
 def _append_message(chat: Chat, message: Message) -> dict:
+    """
+    Appends a turn to the chat, clearing its pending mark, if any.
+    """
+    return db().update_item(
+        TableName=_table,
+        Key=chat.primary_key,
+        UpdateExpression='SET #messages = list_append(if_not_exists(#messages, :empty), :message) '
+                         'DELETE #pending :turn',
+        ExpressionAttributeNames={
+            '#messages': 'messages',
+            '#pending': 'pending_turns',
+        },
+        ExpressionAttributeValues={
+            ':message': {'L': [{'M': message.to_item()}]},
+            ':empty': {'L': []},
+            ':turn': {'SS': [f'{message.id}']},
+        }
+    )
+
+
+def _insert_chat(chat: Chat, turn: Ksuid) -> dict:
+    """
+    Writes a new chat without its first turn, which is marked as pending.
+    """
+    return db().put_item(
+        TableName=_table,
+        Item=chat.to_item() | {'pending_turns': {'SS': [f'{turn}']}},
+        ConditionExpression='attribute_not_exists(PK)',
+    )
+
+
+def _delete_chat(chat: Chat) -> dict:
+    """
+    Deletes a chat written by `_insert_chat` whose first turn failed.
+    """
+    return db().delete_item(
+        TableName=_table,
+        Key=chat.primary_key,
+    )
+
+
+def _complete_chat(chat: Chat, message: Message) -> dict:
+    """
+    Adds the query results, the data profile if any, and the first turn to a chat written by `_insert_chat`.
+    """
+    profiled = chat.data_profile is not None
     return db().update_item(
         TableName=_table,
         Key=chat.primary_key,
-        UpdateExpression='SET #messages = list_append(if_not_exists(#messages, :empty), :message)',
+        UpdateExpression='SET #results = :results, '
+                         + ('#profile = :profile, ' if profiled else '')
+                         + '#messages = list_append(if_not_exists(#messages, :empty), :message) '
+                         'DELETE #pending :turn',
+        ConditionExpression='attribute_exists(PK)',
         ExpressionAttributeNames={
+            '#results': 'query_results',
             '#messages': 'messages',
+            '#pending': 'pending_turns',
+            **({'#profile': 'data_profile'} if profiled else {}),
         },
         ExpressionAttributeValues={
+            ':results': {'S': json.dumps(chat.query_results, default=custom_serializer)},
             ':message': {'L': [{'M': message.to_item()}]},
             ':empty': {'L': []},
+            ':turn': {'SS': [f'{message.id}']},
+            **({':profile': {'S': json.dumps(chat.data_profile)}} if profiled else {}),
         }
     )
+
+
+def _set_context(chat: Chat, value: str | None) -> dict:
+    """
+    Saves or, given None, removes the handle of the chat's cached context.
+    """
+    if value is None:
+        return db().update_item(
+            TableName=_table,
+            Key=chat.primary_key,
+            UpdateExpression='REMOVE #context',
+            ConditionExpression='attribute_exists(PK)',
+            ExpressionAttributeNames={'#context': 'context_cache'},
+        )
+    return db().update_item(
+        TableName=_table,
+        Key=chat.primary_key,
+        UpdateExpression='SET #context = :context',
+        ConditionExpression='attribute_exists(PK)',
+        ExpressionAttributeNames={'#context': 'context_cache'},
+        ExpressionAttributeValues={':context': {'S': value}},
+    )
+
+
+def _mark_pending(chat: Chat, turn: Ksuid) -> dict:
+    """
+    Records on the chat that a turn is being generated and not yet persisted.
+    """
+    return db().update_item(
+        TableName=_table,
+        Key=chat.primary_key,
+        UpdateExpression='ADD #pending :turn',
+        ConditionExpression='attribute_exists(PK)',
+        ExpressionAttributeNames={
+            '#pending': 'pending_turns',
+        },
+        ExpressionAttributeValues={
+            ':turn': {'SS': [f'{turn}']},
+        }
+    )
+
+
+def _clear_pending(chat: Chat, turn: Ksuid) -> dict:
+    """
+    Removes the pending mark of a turn that failed to generate.
+    """
+    return db().update_item(
+        TableName=_table,
+        Key=chat.primary_key,
+        UpdateExpression='DELETE #pending :turn',
+        ConditionExpression='attribute_exists(PK)',
+        ExpressionAttributeNames={
+            '#pending': 'pending_turns',
+        },
+        ExpressionAttributeValues={
+            ':turn': {'SS': [f'{turn}']},
+        }
+    )
+
+
+def _read(chat: Chat) -> Chat | None:
+    """
+    The chat as last written, with a consistent read.
+    """
+    response = db().get_item(
+        TableName=_table,
+        Key=chat.primary_key,
+        ConsistentRead=True,
+    )
+    match response:
+        case {'Item': item}:
+            return Chat.from_item(item)
+    return None
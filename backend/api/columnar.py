@@ -0,0 +1,219 @@
+import json
+from contextlib import closing
+from typing import Any, Callable, Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from errors import NotAcceptable
+from framework import run_blocking
+from signatures import Send, cors_headers
+from utils import custom_serializer
+
+arrow_stream: str = 'application/vnd.apache.arrow.stream'
+parquet: str = 'application/vnd.apache.parquet'
+_json = 'application/json'
+
+_batch = 10_000  # rows fetched and encoded at a time
+
+# Postgres type OIDs -> Arrow type factories; anything else is sent as text
+_types: dict[int, Callable[[], Any]] = {
+    16: lambda: pa.bool_(),
+    17: lambda: pa.binary(),
+    20: lambda: pa.int64(),
+    21: lambda: pa.int16(),
+    23: lambda: pa.int32(),
+    26: lambda: pa.uint32(),
+    700: lambda: pa.float32(),
+    701: lambda: pa.float64(),
+    1082: lambda: pa.date32(),
+    1083: lambda: pa.time64('us'),
+    1114: lambda: pa.timestamp('us'),
+    1184: lambda: pa.timestamp('us', tz='UTC'),
+    1186: lambda: pa.duration('us'),
+}
+_numeric = 1700
+
+
+def negotiate(accept: str | None) -> str | None:
+    """
+    Picks the result format from an Accept header.
+
+    :param accept: Value of the `Accept` request header, if any.
+    :raises NotAcceptable: If the client only lists columnar formats, all refused with q=0.
+    :return: Columnar media type to respond with, or None for the default JSON.
+    """
+    ranked = sorted(_ranges(accept or ''), key=lambda each: -each[1])
+    for media_type, q in ranked:
+        if q <= 0:
+            continue
+        match media_type:
+            case 'application/vnd.apache.arrow.stream' | 'application/vnd.apache.parquet':
+                return media_type
+            case 'application/json' | 'application/*' | '*/*':
+                return None
+    if ranked and all(each in (arrow_stream, parquet) for each, _ in ranked):
+        raise NotAcceptable([_json])
+    return None
+
+
+def _ranges(accept: str) -> Iterator[tuple[str, float]]:
+    for each in accept.split(','):
+        media_type, *params = [part.strip() for part in each.split(';')]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if media_type:
+            yield media_type.lower(), q
+
+
+def schema_of(description) -> 'pa.Schema':
+    """
+    Maps a psycopg2 cursor description to an Arrow schema.
+
+    Numeric columns with a declared precision become decimals of that precision and scale.
+    Unconstrained numerics can hold any scale, and a later batch could need more than the first,
+    so they are sent as text, like numerics too wide for Arrow's decimals.
+    """
+    fields = []
+    for column in description:
+        match column.type_code:
+            case code if code == _numeric:
+                kind = _decimal(column)
+            case code if code in _types:
+                kind = _types[code]()
+            case _:
+                kind = pa.string()
+        fields.append(pa.field(column.name, kind))
+    return pa.schema(fields)
+
+
+def _decimal(column) -> 'pa.DataType':
+    match column.precision:
+        case int(precision) if 0 < precision <= 38:
+            return pa.decimal128(precision, column.scale or 0)
+        case int(precision) if 0 < precision <= 76:
+            return pa.decimal256(precision, column.scale or 0)
+    return pa.string()
+
+
+def record_batch(schema: 'pa.Schema', rows: list[tuple]) -> 'pa.RecordBatch':
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    return pa.record_batch(
+        [
+            pa.array(_cells(field, values), type=field.type)
+            for field, values in zip(schema, columns)
+        ],
+        schema=schema,
+    )
+
+
+def _cells(field: 'pa.Field', values: tuple) -> list | tuple:
+    if pa.types.is_string(field.type):
+        return [
+            None if value is None
+            else value if isinstance(value, str)
+            else json.dumps(value, default=custom_serializer) if isinstance(value, (dict, list))
+            else str(value)
+            for value in values
+        ]
+    if pa.types.is_decimal(field.type):  # NaN fits in a numeric column, not in an Arrow decimal
+        return [value if value is None or value.is_finite() else None for value in values]
+    return values
+
+
+class _Sink:
+    """
+    Write-only file object for Arrow writers; whatever they write is picked up with `take`.
+    """
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+def encode(description, batches: Iterator[list[tuple]], media_type: str) -> Iterator[bytes]:
+    """
+    Encodes row batches incrementally, yielding the bytes written for each batch.
+    Parquet gets one row group per batch, followed by the footer.
+
+    :param description: psycopg2 cursor description.
+    :param batches: Lists of row tuples.
+    :param media_type: `arrow_stream` or `parquet`.
+    """
+    sink = _Sink()
+    schema = schema_of(description)
+    target = pa.PythonFile(sink, mode='w')
+    writer = pa.ipc.new_stream(target, schema) if media_type == arrow_stream else pq.ParquetWriter(target, schema)
+
+    with writer:
+        yield sink.take()
+        for rows in batches:
+            writer.write_batch(record_batch(schema, rows))
+            yield sink.take()
+    yield sink.take()
+
+
+async def respond(send: Send, connect: Callable[[], Any], query: str, media_type: str) -> None:
+    """
+    Runs a query and streams its result in a columnar format, one batch of rows at a time.
+    The rows are read through a server-side cursor, so only one batch is held in memory;
+    fetching and encoding happen on the thread pool.
+
+    The first batch is fetched before the response starts, so that an error in the query
+    still gets a regular error response.
+
+    :param send: ASGI send function.
+    :param connect: Opens a new database connection.
+    :param query: Query to run; a server-side cursor only takes a SELECT or VALUES statement.
+    :param media_type: `arrow_stream` or `parquet`.
+    """
+    with closing(await run_blocking(connect)) as connection:
+        with connection.cursor(name=f'columnar_{id(connection):x}') as cursor:
+            await run_blocking(lambda: cursor.execute(query))
+            first = await run_blocking(lambda: cursor.fetchmany(_batch))
+
+            def batches() -> Iterator[list[tuple]]:
+                rows = first
+                while rows:
+                    yield rows
+                    rows = cursor.fetchmany(_batch)
+
+            # a named cursor only describes its columns once something has been fetched
+            chunks = encode(cursor.description, batches(), media_type)
+            head = await run_blocking(lambda: next(chunks))
+
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', media_type.encode()),
+                    (b'cache-control', b'no-store'),
+                    *cors_headers,
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': head, 'more_body': True})
+            sentinel = object()
+            while (chunk := await run_blocking(lambda: next(chunks, sentinel))) is not sentinel:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        connection.rollback()
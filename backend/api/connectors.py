@@ -1,24 +1,43 @@
 import json
 import os
+from contextlib import closing
 from datetime import datetime
 from textwrap import dedent
 
-from dynamo import db
-from utils import custom_serializer, run_query
+from dynamo import db, Ksuid
+from utils import custom_serializer, run_query, is_true
 
-import llm
+import admission
+import advisor
+import blobs
+import chats
+import columnar
+import cpu
+import deletes
+import export as exports
+import health as healthcheck
+import inspector
+import plans
+import preflight
 import q as queries
-from db import run, connect
-from errors import EmptyResponse, IncorrectSignature
+import relevance
+import routing
+import streams
+from db import run, connect, QueryCanceled
+from errors import IncorrectSignature, NotModified, ExcessiveQuery, NotFound
+from framework import etag_of, etag_matches, revalidated, run_blocking
 from models import user_type, connector_type, Connector, with_connector
-from prompts import explain_db_prompt_template
-from signatures import Send
-from sse import send_token, streaming, send_error
+from prompts import explain_db_prompt_template, profile_prompt_template
+from signatures import Receive, Send
+from sse import streaming, send_error
+from streams import Generation
 
 _table = os.environ['TABLE_NAME']
+_profile_timeout = int(os.environ.get('PROFILE_TIMEOUT_MS', 10_000))
+_max_profile_timeout = int(os.environ.get('PROFILE_MAX_TIMEOUT_MS', 30_000))
 
 
-def get(user_id: str) -> dict:
+def get(user_id: str, if_none_match: str = None) -> tuple[dict, int, dict]:
     """
     Fetches connectors for a given user from the database.
 
@@ -26,8 +45,18 @@ def get(user_id: str) -> dict:
     the results based on the user ID and the connector type. If matching connector items are found, they
     are parsed and returned. Otherwise, it returns a dictionary with a `None` value for connectors.
 
+    Connectors checked recently carry their cached `health`, see `health.check`; listing never
+    opens a database connection. Their inspections, stored beside their items, are read with
+    one batch for all of them, see `blobs.load_all`.
+
+    The response carries a strong ETag computed over the raw items and health checks, so a client
+    polling the list with `If-None-Match` gets a 304 before any connector is parsed or serialized.
+
     :param user_id: The unique identifier for the user.
-    :return: A dictionary containing a list of connectors if found, otherwise `None`.
+    :param if_none_match: Value of the `If-None-Match` request header, if any.
+    :raises NotModified: If the client's copy is current.
+    :return: A dictionary containing a list of connectors if found, otherwise `None`,
+        along with the status code and cache headers.
     """
     response = db().query(
         TableName=_table,
@@ -42,16 +71,32 @@ def get(user_id: str) -> dict:
         }
     )
 
-    match response:
-        case {'Items': items}:
+    items = response.get('Items')
+    healths = {
+        each['SK']['S'].split('#')[1]: checked
+        for each in items or []
+        if (checked := healthcheck.cached(each['SK']['S'].split('#')[1])) is not None
+    }
+    etag = etag_of([items, healths])
+    if etag_matches(etag, if_none_match):
+        raise NotModified(etag)
+
+    match items:
+        case list():
             connectors = [Connector.from_item(item) for item in items]
-            return {
+            stored = blobs.load_all([(each.primary_key, 'inspection', each.inspection_ref) for each in connectors])
+            for each, inspection in zip(connectors, stored):
+                each.inspection = inspection if inspection is not None else each.inspection
+            body = {
                 'connectors': [
-                    each.public() for each in connectors
+                    each.public() | ({'health': healths[f'{each.id}']} if f'{each.id}' in healths else {})
+                    for each in connectors
                 ],
             }
+        case _:
+            body = {'connectors': None}
 
-    return {'connectors': None}
+    return body, 200, revalidated(etag)
 
 
 def make(request: dict, user_id: str) -> dict:
@@ -66,59 +111,418 @@ def make(request: dict, user_id: str) -> dict:
 
 
 def edit(connector_id: str, user_id: str, params: dict) -> dict:
+    """
+    Replaces a connector. Its stored inspection, which may be of another server now, is deleted;
+    the next explain or inspection takes a fresh one.
+    """
     try:
         connector = Connector.from_dict(params, user_id)
         connector.id = connector_id
         connector.save_as_full_item(table=_table, condition='attribute_exists(PK) AND attribute_exists(SK)')
-        return {'connector': connector.to_dict()}
     except KeyError:
         raise IncorrectSignature(
             ['host', 'port', 'database', 'user', 'password'],
         )
+    try:
+        blobs.discard_all(connector.primary_key)
+    except Exception as e:
+        # chunks left behind are only wasted space, deleted along with the connector
+        print(f'Deleting the inspection of connector {connector_id} failed: {type(e).__name__}: {e}')
+    return {'connector': connector.to_dict()}
 
 
-def delete(connector_id: str, user_id: str) -> dict:
-    _ = db().delete_item(
-        TableName=_table,
-        Key=Connector.key(user_id, connector_id)
-    )
-    raise EmptyResponse
+async def delete(connector_id: str, user_id: str, send: Send, accept: str = None) -> tuple[str, None] | dict:
+    """
+    Deletes a connector along with all of its chats and its stored inspection, the chats first,
+    in batches, see `deletes.respond`.
+    If some chats cannot be deleted, the connector is kept, so that the request can be repeated.
+
+    :param accept: The request's `Accept` header; with `text/event-stream`, large deletions report progress.
+    :return: How many items were deleted, the connector included, or the marker of a finished stream.
+    """
+    key = Connector.key(user_id, connector_id)
+    keys = await run_blocking(lambda: chats.chat_keys(user_id, connector_id))
+    stored = await run_blocking(lambda: blobs.keys_of(key))
+    return await deletes.respond(send, keys, stored, [key], accept=accept)
+
+
+@with_connector
+async def health(connector: Connector, params: dict) -> dict:
+    """
+    Reports whether the connector's database is reachable and how fast it answers.
+    A recent check is reused unless the request sets `refresh`; a new one is admitted as database work,
+    see `admission.admit`.
+
+    :param connector: Connector to check.
+    :param params: Optional `refresh`.
+    :return: Reachability, latency or error, check time and circuit state.
+    """
+    if not is_true(params.get('refresh')) and (checked := healthcheck.cached(f'{connector.id}')) is not None:
+        return checked | {'cached': True}
+    async with admission.admit(connector.user_id, 'db'):
+        return await run_blocking(lambda: healthcheck.check(connector))
 
 
 @with_connector
-def inspect(connector: Connector, params: dict) -> dict:
-    connection = connect(connector)
+async def inspect(connector: Connector, params: dict, if_none_match: str = None) -> tuple[dict | bytes, int, dict]:
+    """
+    Inspects the connector's database, or a single trigger or routine of it.
+    Either runs off the event loop, so that a slow server holds up no other request.
+
+    A full inspection covers every database on the server, inspected in parallel, see
+    `inspector.inspect`. It is persisted beside the connector only when it is complete and differs
+    from the stored one. Either way, the result is tagged with an ETag so that an unchanged
+    schema is answered with a 304 instead of the full body. A full inspection is sent as serialized
+    for the ETag, without being encoded again. Saving it also updates the
+    connector's relevance index, see `relevance.Index`.
+
+    :param connector: Connector to inspect.
+    :param params: Request parameters, optionally selecting a trigger or a routine,
+        or restricting a full inspection to some `databases` and `schemata` (comma-separated).
+    :param if_none_match: Value of the `If-None-Match` request header, if any.
+    :raises NotModified: If the client's copy is current.
+    :return: Inspection result along with the status code and cache headers.
+    """
     match params:
         case {'type': 'trigger', 'schema': _, 'table': _, 'trigger': _} as args:
-            row = _query(connection, 'trigger', dict(args))
+            row = await run_blocking(lambda: _query(connector, 'trigger', dict(args)))
             inspection = _make_trigger(row)
+            etag = etag_of(inspection)
         case {'type': 'routine', 'schema': _, 'routine': _} as args:
-            inspection = _query(connection, 'routine', dict(args))
+            inspection = await run_blocking(lambda: _query(connector, 'routine', dict(args)))
+            etag = etag_of(inspection)
         case _:
-            inspection = _query(connection, 'inspect', {'schemata': None})
-            connector.inspection = json.dumps(inspection)
-            connector.save_attributes(table=_table, attrs=['inspection'])
+            databases, schemata = _names(params.get('databases')), _names(params.get('schemata'))
+            inspection = await run_blocking(
+                lambda: inspector.inspect(connector, databases=databases, schemata=schemata),
+            )
+            serialized = json.dumps(inspection)
+            etag = etag_of(serialized.encode())
+            complete = 'errors' not in inspection and not databases and not schemata
+            if complete and not _stored(connector, serialized):
+                await run_blocking(
+                    lambda: _store_inspection(connector.load_stored('schema_index'), inspection, serialized, etag),
+                )
+            inspection = serialized.encode()
+
+    if etag_matches(etag, if_none_match):
+        raise NotModified(etag)
 
-    return inspection
+    return inspection, 200, revalidated(etag)
 
 
 @with_connector
-def query(connector: Connector, params: dict) -> dict:
+async def query(connector: Connector, params: dict) -> tuple[bytes, int, dict]:
+    """
+    Runs a query. If the connector has cost limits, or the request sets `preflight`,
+    the query is planned first, see `preflight.check`; the estimate is returned along with the rows.
+    A query over the limits is only run if the request sets `confirm` (and the connector allows it).
+
+    The query runs on a worker thread; a large result is encoded in the process pool, see `cpu.run`.
+    """
     q = params['query']
-    connection = connect(connector)
-    columns, rows = run_query(connection, q)
-    return {
+
+    def execute() -> tuple[dict | None, list, list]:
+        with closing(connect(connector)) as connection:
+            estimate = preflight.check(
+                connector,
+                connection,
+                q,
+                requested=is_true(params.get('preflight')),
+                confirmed=is_true(params.get('confirm')),
+            )
+            return estimate, *run_query(connection, q)
+
+    estimate, columns, rows = await run_blocking(execute)
+    return await cpu.run(cpu.query_result, q, columns, rows, estimate, size=len(columns) * len(rows)), 200, {}
+
+
+@with_connector
+async def export(connector: Connector, send: Send, receive: Receive, params: dict) -> None:
+    """
+    Streams the full result of a query as a file, see `export.stream`.
+
+    :param connector: Connector to run the query against.
+    :param send: ASGI send function.
+    :param receive: ASGI receive function, to stop when the client goes away.
+    :param params: Request body: `query`, optional `format` ('csv', 'binary' or 'ndjson')
+        and `gzip`.
+    """
+    try:
+        q = params['query']
+    except KeyError:
+        raise IncorrectSignature(['query'])
+    await exports.stream(
+        send,
+        receive,
+        lambda: connect(connector),
+        q,
+        fmt=params.get('format', 'csv'),
+        gzip=is_true(params.get('gzip')),
+    )
+
+
+@with_connector
+async def query_columnar(connector: Connector, send: Send, params: dict, media_type: str) -> None:
+    """
+    Same as `query`, but streams the result as Arrow IPC or Parquet, see `columnar.respond`.
+    The same preflight runs first, on the connection the query then runs on; as the body is
+    the result itself, the estimate is not returned.
+    """
+    try:
+        q = params['query']
+    except KeyError:
+        raise IncorrectSignature(['query'])
+
+    def checked():
+        connection = connect(connector)
+        try:
+            preflight.check(connector, connection, q, confirmed=is_true(params.get('confirm')))
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    await columnar.respond(send, checked, q, media_type)
+
+
+@with_connector
+async def profile(
+        connector: Connector,
+        send: Send,
+        params: dict,
+        last_event_id: str = None,
+) -> dict | None:
+    """
+    Profiles a query with EXPLAIN (ANALYZE, BUFFERS) and summarizes the plan's hotspots,
+    see `plans.hotspots`. The query does run, but inside a transaction that is rolled back
+    and under a statement timeout.
+
+    :param connector: Connector to run the query against.
+    :param send: ASGI send function.
+    :param params: Request body: `query`, optional `timeout_ms` and `explain`. With `explain`,
+        the profile is streamed as a `profile` event, followed by an LLM explanation of it.
+    :param last_event_id: `Last-Event-ID` of a client reconnecting to an explanation stream.
+    :raises ExcessiveQuery: If the query does not finish within the timeout.
+    :return: The plan and its hotspots, unless streamed.
+    """
+    match streams.resume(last_event_id, scope=f'{connector.id}'):
+        case generation, after:
+            async with streaming(send):
+                await streams.relay(send, generation, after)
+            return None
+
+    try:
+        q = params['query']
+    except KeyError:
+        raise IncorrectSignature(['query'])
+    timeout = min(int(params.get('timeout_ms') or _profile_timeout), _max_profile_timeout)
+
+    try:
+        explained = await run_blocking(lambda: _analyze(connector, q, timeout))
+    except QueryCanceled:
+        raise ExcessiveQuery(reasons=[f'query did not finish within {timeout} ms'], confirmable=False)
+
+    await run_blocking(lambda: connector.load_stored('inspection'))
+    inspection = json.loads(connector.inspection) if connector.inspection else None
+    result = {
         'query': q,
-        'columns': columns,
-        'rows': [
-            dict(zip(columns, row)) for row in rows
-        ]
+        'plan': explained,
+        'hotspots': plans.hotspots(explained, table_rows=plans.table_rows_of(inspection, connector.database)),
     }
+    if not is_true(params.get('explain')):
+        return result
+
+    generation = streams.launch(f'{connector.id}.{Ksuid()}', lambda g: _explain_profile(connector, result, g))
+    async with streaming(send):
+        try:
+            await streams.relay(send, generation)
+        except Exception as e:
+            await send_error(send, event=e)
+    return None
 
 
-def _query(connection, name: str, params: dict = None) -> dict:
+def _analyze(connector: Connector, q: str, timeout_ms: int) -> dict:
+    with closing(connect(connector)) as connection:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %s', (timeout_ms,))
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {preflight.statement(q)}')
+                [[explained]] = cursor.fetchone()
+                return explained
+        finally:
+            connection.rollback()
+
+
+async def _explain_profile(connector: Connector, result: dict, generation: Generation) -> None:
+    await generation.publish('profile', result)
+    prompt = profile_prompt_template.format(
+        database_name=connector.database,
+        query=result['query'],
+        hotspots_json=json.dumps(result['hotspots']),
+        plan_json=json.dumps(result['plan']),
+    )
+    async for chunk in routing.astream(routing.choose('profile', prompt=prompt), prompt):
+        await generation.publish('token', {'t': chunk})
+
+
+@with_connector
+async def advise(
+        connector: Connector,
+        send: Send,
+        params: dict,
+        last_event_id: str = None,
+) -> None:
+    """
+    Streams index advice for the connector's most expensive statements, see `advisor.advise`.
+    Concurrent requests share one run.
+
+    :param connector: Connector to advise on; its database needs the pg_stat_statements extension.
+    :param send: ASGI send function.
+    :param params: Optional `limit` (statements looked at) and `refresh` (ignore cached advice).
+    :param last_event_id: `Last-Event-ID` of a client reconnecting to the stream.
+    :raises NotFound: If pg_stat_statements is not installed.
+    """
+    match streams.resume(last_event_id, scope=f'{connector.id}'):
+        case generation, after:
+            pass
+        case _:
+            server_version, extensions = await run_blocking(lambda: advisor.setup(connector))
+            if 'pg_stat_statements' not in extensions:
+                raise NotFound('pg_stat_statements extension')
+            limit = int(params.get('limit') or advisor.top)
+            refresh = is_true(params.get('refresh'))
+            generation = streams.single_flight(
+                streams.flight_key(f'{connector.id}', f'advise/{limit}/{refresh}'),
+                f'{connector.id}.{Ksuid()}',
+                lambda g: advisor.advise(
+                    connector, g, server_version=server_version, extensions=extensions, limit=limit, refresh=refresh,
+                ),
+            )
+            after = 0
+
+    async with streaming(send):
+        try:
+            await streams.relay(send, generation, after)
+        except Exception as e:
+            await send_error(send, event=e)
+
+
+def _names(value: str | list[str] | None) -> list[str] | None:
+    match value:
+        case str():
+            return [each.strip() for each in value.split(',') if each.strip()] or None
+        case list():
+            return value or None
+    return None
+
+
+def _stored(connector: Connector, serialized: str) -> bool:
+    """
+    Whether this is the inspection stored for the connector, known without reading it.
+    """
+    return _refers(connector.inspection_ref, serialized)
+
+
+def _refers(ref: str | None, value: str) -> bool:
+    return bool(ref) and ref.startswith(f'{blobs.version_of(value)}:')
+
+
+def _store_inspection(connector: Connector, inspection: dict, serialized: str, etag: str) -> relevance.Index:
+    """
+    Saves a complete inspection beside the connector, along with its relevance index updated for the
+    tables that changed, see `blobs.save`; the connector's item only references them. Even a large
+    server's inspection fits, where the item alone would be over DynamoDB's 400 KB limit.
+
+    The item is switched to the new references only if it still holds the ones read with it, so that
+    concurrent saves do not lose each other's chunks; the chunks of the replaced values are deleted after.
+    A failure to save is logged, not raised: the inspection and the index are still good to use,
+    and the stored ones stay as they were.
+
+    :param connector: Connector with its current `schema_index` read, if any, see `Connector.load_stored`.
+    :return: The updated index.
+    """
+    index = relevance.Index.from_json(connector.schema_index)
+    index.update(inspection, etag)
+    schema_index = index.to_json()
+    key = connector.primary_key
+    values = {'inspection': serialized, 'schema_index': schema_index}
+    previous = {'inspection': connector.inspection_ref, 'schema_index': connector.schema_index_ref}
+    refs = dict(previous)
+    try:
+        for name, value in values.items():
+            if not _refers(previous[name], value):
+                refs[name] = blobs.save(key, name, value)
+        db().update_item(
+            TableName=_table,
+            Key=key,
+            # inspections stored in the item by earlier versions are dropped
+            UpdateExpression=(
+                'SET #inspection_ref = :inspection_ref, #schema_index_ref = :schema_index_ref '
+                'REMOVE #inspection, #schema_index'
+            ),
+            ConditionExpression=' AND '.join(
+                ['attribute_exists(PK)'] + [
+                    f'#{name}_ref = :previous_{name}_ref' if ref else f'attribute_not_exists(#{name}_ref)'
+                    for name, ref in previous.items()
+                ]
+            ),
+            ExpressionAttributeNames={f'#{name}': name for name in values} | {
+                f'#{name}_ref': f'{name}_ref' for name in values
+            },
+            ExpressionAttributeValues={f':{name}_ref': {'S': ref} for name, ref in refs.items()} | {
+                f':previous_{name}_ref': {'S': ref} for name, ref in previous.items() if ref
+            },
+        )
+    except Exception as e:
+        print(f'Saving the inspection of connector {connector.id} failed: {type(e).__name__}: {e}')
+        _discard(key, {name: ref for name, ref in refs.items() if ref != previous[name]})
+    else:
+        connector.inspection_ref, connector.schema_index_ref = refs['inspection'], refs['schema_index']
+        _discard(key, {name: ref for name, ref in previous.items() if ref != refs[name]})
+    connector.inspection, connector.schema_index = serialized, schema_index
+    return index
+
+
+def _discard(key: dict, refs: dict[str, str | None]) -> None:
+    """
+    Deletes stored values no longer referenced. Chunks left behind by a failure are only
+    wasted space, deleted along with the connector, so the failure is logged, not raised.
+    """
+    for name, ref in refs.items():
+        try:
+            blobs.discard(key, name, ref)
+        except Exception as e:
+            print(f'Deleting {name} {ref} failed: {type(e).__name__}: {e}')
+
+
+def _inspection(connector: Connector, refresh: bool) -> tuple[dict, relevance.Index]:
+    """
+    The connector's stored inspection and its relevance index. The server is inspected if there is
+    no stored inspection or `refresh` is set; a complete result is saved. An index that is missing
+    or behind its inspection is brought up to date and saved too. If saving fails, the index is
+    used all the same.
+    """
+    connector.load_stored()
+    if connector.inspection and not refresh:
+        serialized = connector.inspection
+        inspection = json.loads(serialized)
+    else:
+        inspection = inspector.inspect(connector)
+        serialized = json.dumps(inspection)
+    etag = etag_of(serialized.encode())
+    index = relevance.Index.from_json(connector.schema_index)
+    if 'errors' in inspection:
+        index.update(inspection, etag)  # a partial inspection is used, but not saved
+    elif not _stored(connector, serialized) or index.inspection != etag:
+        index = _store_inspection(connector, inspection, serialized, etag)
+    return inspection, index
+
+
+def _query(connector: Connector, name: str, params: dict = None) -> dict:
     q = getattr(queries, name)
-    return list(run(connection, q, params))[0]
+    with closing(connect(connector)) as connection:
+        return list(run(connection, q, params))[0]
 
 
 def _make_trigger(row: dict) -> dict:
@@ -151,20 +555,76 @@ def _make_trigger(row: dict) -> dict:
 
 
 @with_connector
-async def explain(connector: Connector, send: Send) -> None:
-    connection = connect(connector)
-    inspection = _query(connection, 'inspect', {'schemata': None})
-    prompt = explain_db_prompt_template.format(
-        database_name=connector.database,
-        schema_json=json.dumps(inspection),
-        date=datetime.now().strftime('%A, %B %d, %Y')
-    )
+async def explain(
+        connector: Connector,
+        send: Send,
+        params: dict,
+        last_event_id: str = None,
+        idempotency_key: str = None,
+) -> None:
+    """
+    Streams an LLM explanation of the connector's database, from its stored inspection.
+
+    A schema too large for `EXPLAIN_TOKEN_BUDGET` is cut down to the tables most relevant to the
+    request's `question`, or the most connected ones without a question, and to their foreign-key
+    neighbours, see `relevance.scope`.
+
+    :param connector: Connector to explain.
+    :param send: ASGI send function.
+    :param params: Request body, with an optional `question` and `refresh`, to inspect the server again.
+    :param last_event_id: `Last-Event-ID` of a client reconnecting to a stream it lost;
+        the buffered events are replayed instead of generating the explanation again.
+    :param idempotency_key: `Idempotency-Key` request header. Requests repeating one share a single
+        explanation; without it, concurrent requests over the same schema do.
+    """
+    match streams.resume(last_event_id, scope=f'{connector.id}'):
+        case generation, after:
+            pass
+        case _:
+            question = params.get('question') or None
+            inspection, index = await run_blocking(lambda: _inspection(connector, is_true(params.get('refresh'))))
+            schema, kept, total = relevance.scope(inspection, index, connector.database, question)
+            schema_json = json.dumps(schema)
+            generation = streams.single_flight(
+                streams.flight_key(f'{connector.id}', f'{schema_json}\0{question or ""}', idempotency_key),
+                f'{connector.id}.{Ksuid()}',
+                lambda g: _explain(connector, schema_json, _scope(question, kept, total), g),
+                idempotent=idempotency_key is not None,
+            )
+            after = 0
 
     async with streaming(send):
         try:
-            for chunk in llm.stream(prompt=prompt):
-                await send_token(send, event=chunk)
+            await streams.relay(send, generation, after)
         except Exception as e:
             import traceback
             traceback.print_exc()
             await send_error(send, event=e)
+
+
+def _scope(question: str | None, kept: int, total: int) -> str:
+    """
+    What the explain prompt says of the question and of the tables left out of its schema.
+    """
+    parts = []
+    if kept < total:
+        parts.append(
+            f'The database has {total} tables. To keep this prompt short, the schema above only lists {kept} of them: '
+            f'the most relevant{" to the question below" if question else ""} and the tables they are linked to '
+            f'by foreign keys. The other tables exist, but are not shown.'
+        )
+    if question:
+        parts.append(f'The user asks: "{question}". Tailor the summary, key tables and sample queries to it.')
+    return '\n\n'.join(parts)
+
+
+async def _explain(connector: Connector, schema_json: str, scope: str, generation: Generation) -> None:
+    prompt = explain_db_prompt_template.format(
+        database_name=connector.database,
+        schema_json=schema_json,
+        scope=scope,
+        date=datetime.now().strftime('%A, %B %d, %Y')
+    )
+
+    async for chunk in routing.astream(routing.choose('explain', prompt=prompt), prompt):
+        await generation.publish('token', {'t': chunk})
@@ -0,0 +1,86 @@
+"""
+CPU-heavy steps that can run in a pool of processes, so that encoding one large result does
+not hold the GIL over every other request of the worker. The functions take and return plain
+data (rows, strings, bytes) and import nothing but the standard library, `utils` and `prompts`,
+which keeps the pool's processes small and their inputs shared-nothing.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, TypeVar
+
+import prompts
+from utils import custom_serializer
+
+_workers = int(os.environ.get('CPU_WORKERS', 0))  # processes; 0 runs the steps inline
+_offload_above = int(os.environ.get('CPU_OFFLOAD_ABOVE', 10_000))  # cells; below that, pickling costs more than it saves
+
+T = TypeVar('T')
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawned, not forked: the parent has an event loop and threads that a fork would copy mid-flight
+        _pool = ProcessPoolExecutor(max_workers=_workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+async def run(fn: Callable[..., T], *args: Any, size: int) -> T:
+    """
+    Runs `fn(*args)` in the process pool if there is one and the work is large enough, inline otherwise.
+
+    :param fn: A module-level function of this module.
+    :param size: Cells (rows times columns) the work covers, compared with `CPU_OFFLOAD_ABOVE`.
+    """
+    if _workers <= 0 or size < _offload_above:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(_executor(), fn, *args)
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def query_result(q: str, columns: list[str], rows: list[tuple], estimate: dict | None) -> bytes:
+    """
+    The body of `connectors.query`, encoded.
+    """
+    return json.dumps(
+        {
+            'query': q,
+            'columns': columns,
+            'rows': [
+                dict(zip(columns, row)) for row in rows
+            ],
+            **({'estimate': estimate} if estimate else {}),
+        },
+        default=custom_serializer,
+    ).encode()
+
+
+def initial_prompt(prompt: str, query_results: tuple[list, list] | None, data_profile: dict = None) -> str:
+    """
+    A chat's first prompt: the instructions, the user's question and the data, or the data's profile if it has one.
+    """
+    if data_profile is not None:
+        sample = data_profile['sample']
+        return prompts.profiled_initial_prompt.format(
+            prompt=prompt,
+            rows=data_profile['rows'],
+            profile='[\n' + ',\n'.join(json.dumps(column) for column in data_profile['columns']) + '\n]',
+            sampled=len(sample['rows']),
+            columns=json.dumps(sample['columns']),
+            sample='\n'.join(json.dumps(row) for row in sample['rows']),
+        )
+    return prompts.initial_prompt.format(
+        prompt=prompt,
+        data=json.dumps(query_results, indent=2, default=custom_serializer)
+    )
@@ -1,19 +1,57 @@
 import hashlib
-from typing import Iterator
+import os
+from typing import Any, Iterator
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from breaker import breaker
 from models import Connector
 
 ForeignKeyViolation = psycopg2.errors.lookup('23503')
 UniqueViolation = psycopg2.errors.lookup('23505')
 NotNullViolation = psycopg2.errors.lookup('23502')
 DatabaseCustomException = psycopg2.errors.lookup('P0001')
+QueryCanceled = psycopg2.errors.lookup('57014')
 
+_connect_timeout = int(os.environ.get('CONNECT_TIMEOUT', 5))  # seconds, unless the connector sets its own
 
-def connect(config: Connector):
-    return psycopg2.connect(**config.to_connection())
+
+def connect(config: Connector, database: str = None):
+    """
+    Connects within the connector's connect timeout. Servers that keep failing to accept
+    connections are not tried again until a cooldown has passed, see `breaker.Breaker`.
+
+    :param config: Connector to connect with.
+    :param database: Database to connect to instead of the connector's own, on the same server.
+    :raises Unavailable: If recent attempts to connect failed.
+    """
+    params = config.to_connection() | ({'database': database} if database else {})
+    target = _target(params)
+    breaker.before(target, f'{params["host"]}:{params["port"]}/{params["database"]}')
+    try:
+        connection = psycopg2.connect(**params, connect_timeout=config.connect_timeout or _connect_timeout)
+    except psycopg2.OperationalError as e:
+        breaker.failed(target, e)
+        raise
+    except BaseException:
+        # not the server's fault, e.g. a malformed parameter, but a trial attempt is over all the same
+        breaker.abandoned(target)
+        raise
+    breaker.succeeded(target)
+    return connection
+
+
+def circuit_of(config: Connector) -> dict[str, Any]:
+    """
+    :return: State of the connector's circuit, see `breaker.Breaker.status`.
+    """
+    return breaker.status(_target(config.to_connection()))
+
+
+def _target(params: dict) -> tuple:
+    # credentials are part of it, so fixing a password does not wait out the cooldown
+    return tuple(sorted((key, f'{value}') for key, value in params.items()))
 
 
 def _empty() -> Iterator:
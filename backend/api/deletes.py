@@ -0,0 +1,100 @@
+import asyncio
+import os
+import random
+import time
+from typing import Awaitable, Callable
+
+from dynamo import db
+
+from errors import Unavailable
+from framework import run_blocking
+from signatures import Send
+from sse import streaming, send_event, send_error
+
+_table = os.environ['TABLE_NAME']
+_batch = 25  # BatchWriteItem's limit
+_retries = int(os.environ.get('DELETE_RETRIES', 5))  # for items DynamoDB leaves unprocessed
+_backoff = float(os.environ.get('DELETE_BACKOFF', .1))  # seconds, doubled on every retry
+_concurrency = int(os.environ.get('DELETE_CONCURRENCY', 4))  # batches in flight per request
+_stream_above = int(os.environ.get('DELETE_STREAM_ABOVE', 100))  # items; fewer are deleted without progress events
+
+Progress = Callable[[int, int], Awaitable[None]]
+
+
+def write_batch(requests: list[dict]) -> list[dict]:
+    """
+    Sends one batch, then resends whatever DynamoDB left unprocessed, with jittered exponential backoff.
+
+    :return: Requests still unprocessed after the retries.
+    """
+    pending = requests
+    for attempt in range(_retries + 1):
+        response = db().batch_write_item(RequestItems={_table: pending})
+        pending = response.get('UnprocessedItems', {}).get(_table) or []
+        if not pending or attempt == _retries:
+            break
+        delay = _backoff * 2 ** attempt
+        time.sleep(delay + random.uniform(0, delay))
+    return pending
+
+
+def _unique(keys: list[dict]) -> list[dict]:
+    # a batch may not name the same item twice
+    return list({(key['PK']['S'], key['SK']['S']): key for key in keys}.values())
+
+
+async def delete(*groups: list[dict], progress: Progress = None) -> int:
+    """
+    Deletes items by key with `BatchWriteItem`, in batches of 25 sent from the thread pool,
+    `DELETE_CONCURRENCY` at a time. Groups are deleted one after the other, so that e.g. a connector
+    goes only once its chats have; a group that cannot be deleted in full stops the ones after it.
+
+    :param groups: Lists of item keys.
+    :param progress: Awaited with the items deleted so far and the total after every batch.
+    :raises Unavailable: If some items are still unprocessed after `DELETE_RETRIES` retries.
+    :return: The number of items deleted.
+    """
+    groups = tuple(_unique(each) for each in groups)
+    total = sum(len(each) for each in groups)
+    deleted = 0
+    limit = asyncio.Semaphore(max(_concurrency, 1))
+
+    async def send(batch: list[dict]) -> tuple[int, int]:
+        async with limit:
+            left = await run_blocking(lambda: write_batch([{'DeleteRequest': {'Key': key}} for key in batch]))
+        return len(batch) - len(left), len(left)
+
+    for keys in groups:
+        unprocessed = 0
+        for done in asyncio.as_completed([send(keys[at:at + _batch]) for at in range(0, len(keys), _batch)]):
+            went, left = await done
+            deleted, unprocessed = deleted + went, unprocessed + left
+            if progress is not None:
+                await progress(deleted, total)
+        if unprocessed:
+            raise Unavailable(f'{unprocessed} of {total} items could not be deleted', _backoff * 2 ** _retries)
+    return deleted
+
+
+async def respond(send: Send, *groups: list[dict], accept: str = None) -> tuple[str, None] | dict:
+    """
+    Deletes the groups of items, see `delete`. Clients that accept `text/event-stream` get
+    large deletions as SSE: `progress` events with `deleted` and `total`, then `deleted`.
+
+    :param accept: The request's `Accept` header.
+    :return: The number of items deleted, or the marker of a finished stream.
+    """
+    total = sum(len(each) for each in groups)
+    if 'text/event-stream' not in (accept or '') or total <= _stream_above:
+        return {'deleted': await delete(*groups)}
+
+    async def progress(deleted: int, of: int) -> None:
+        await send_event(send, event='progress', data={'deleted': deleted, 'total': of})
+
+    async with streaming(send):
+        try:
+            deleted = await delete(*groups, progress=progress)
+            await send_event(send, event='deleted', data={'deleted': deleted})
+        except Exception as e:
+            await send_error(send, event=e)
+    return 'sse', None
@@ -6,6 +6,11 @@ class EmptyResponse(Exception):
     pass
 
 
+@dataclass
+class NotModified(Exception):
+    etag: str
+
+
 @dataclass
 class IncorrectSignature(Exception):
     required: list[str] = None
@@ -16,11 +21,88 @@ class IncorrectSignature(Exception):
         }
 
 
+@dataclass
+class NotAcceptable(Exception):
+    available: list[str] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'available': self.available,
+        }
+
+
+@dataclass
+class ExcessiveQuery(Exception):
+    estimate: dict[str, Any] = None
+    reasons: list[str] = None
+    confirmable: bool = True
+
+    def __str__(self):
+        return '; '.join(self.reasons or [])
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'error': f'{self}',
+            'estimate': self.estimate,
+            'requiresConfirmation': self.confirmable,
+        }
+
+
+@dataclass
+class Unavailable(Exception):
+    reason: str = None
+    retry_after: float = None
+
+    def __str__(self):
+        return self.reason or 'Unavailable'
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'error': f'{self}',
+            'retryAfter': self.retry_after,
+        }
+
+
+@dataclass
+class TooManyRequests(Exception):
+    reason: str = None
+    retry_after: float = None
+
+    def __str__(self):
+        return self.reason or 'Too many requests'
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'error': f'{self}',
+            'retryAfter': self.retry_after,
+        }
+
+
+@dataclass
+class Interrupted(Exception):
+    """
+    A response that failed after it had started; the connection is to be aborted,
+    as ending the body would pass off what was sent as complete.
+    """
+    reason: str = None
+
+    def __str__(self):
+        return self.reason or 'Interrupted'
+
+
 class Unauthorized(Exception):
     def __str__(self):
         return 'Unauthorized'
 
 
+@dataclass
+class Forbidden(Exception):
+    path: str = None
+
+    def __str__(self):
+        return f'Forbidden: {self.path}'
+
+
 @dataclass
 class NotFound(Exception):
     path: str = None
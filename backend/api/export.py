@@ -0,0 +1,187 @@
+import asyncio
+import zlib
+from contextlib import closing
+from typing import Any
+
+from errors import IncorrectSignature, Interrupted
+from signatures import Receive, Send, cors_headers
+
+_chunk = 64 * 1024  # bytes handed to ASGI at a time
+_depth = 8  # chunks buffered between the COPY thread and the response
+
+# format -> content type, file extension, COPY statement
+_formats: dict[str, tuple[str, str, str]] = {
+    'csv': (
+        'text/csv',
+        'csv',
+        'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)',
+    ),
+    'binary': (
+        'application/octet-stream',
+        'bin',
+        'COPY ({query}) TO STDOUT WITH (FORMAT binary)',
+    ),
+    # CSV with delimiter and quote characters JSON never contains unescaped
+    # passes row_to_json output through untouched, unlike the text format
+    'ndjson': (
+        'application/x-ndjson',
+        'ndjson',
+        "COPY (SELECT row_to_json(q) FROM ({query}) q) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')",
+    ),
+}
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _Pipe:
+    """
+    File-like object `copy_expert` writes into from a worker thread. Output is coalesced
+    into chunks, optionally gzipped, and handed to the event loop through a bounded queue,
+    so a slow client slows down the COPY instead of growing memory.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue, gzip: bool):
+        self._loop = loop
+        self._queue = queue
+        self._buffer = bytearray()
+        self._compressor = zlib.compressobj(wbits=31) if gzip else None
+        self.connection = None  # the COPY's, once open, to cancel it
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """
+        Stops the COPY: the next write fails, and a query still running on the server is cancelled.
+        """
+        self.cancelled = True
+        if (connection := self.connection) is not None:
+            try:
+                connection.cancel()
+            except Exception:
+                pass  # closed meanwhile, nothing left to cancel
+
+    def write(self, data: bytes | str) -> int:
+        if self.cancelled:
+            raise _Cancelled
+        data = data.encode() if isinstance(data, str) else data
+        self._buffer += self._compressor.compress(data) if self._compressor else data
+        if len(self._buffer) >= _chunk:
+            self._push()
+        return len(data)
+
+    def close(self) -> None:
+        if self._compressor:
+            self._buffer += self._compressor.flush()
+        self._push()
+
+    def _push(self) -> None:
+        if self._buffer:
+            chunk, self._buffer = bytes(self._buffer), bytearray()
+            asyncio.run_coroutine_threadsafe(self._queue.put(chunk), self._loop).result()
+
+
+def _copy(connect, statement: str, pipe: _Pipe) -> None:
+    with closing(connect()) as connection:
+        pipe.connection = connection
+        try:
+            if pipe.cancelled:
+                raise _Cancelled
+            with connection.cursor() as cursor:
+                cursor.copy_expert(statement, pipe, size=_chunk)
+            connection.rollback()
+        finally:
+            pipe.connection = None
+    pipe.close()
+
+
+async def stream(send: Send, receive: Receive, connect, query: str, fmt: str = 'csv', gzip: bool = False) -> None:
+    """
+    Streams the result of `query` as a file download, straight from Postgres COPY
+    to the client, keeping only a few chunks in memory regardless of the result size.
+
+    Errors raised before the first chunk propagate, so the client gets a regular
+    error response. Later ones can only cut the download short: the body is left
+    unterminated, so that the client sees an incomplete transfer rather than a whole file.
+    A client going away, or the request being cancelled, stops the COPY.
+
+    :param send: ASGI send function.
+    :param receive: ASGI receive function, watched for the client disconnecting.
+    :param connect: Opens a new database connection; called on the worker thread.
+    :param query: Query whose result is exported.
+    :param fmt: One of 'csv', 'binary' or 'ndjson'.
+    :param gzip: Whether to compress the output on the fly.
+    :raises Interrupted: If the COPY failed once the download had started.
+    """
+    try:
+        content_type, extension, template = _formats[fmt]
+    except KeyError:
+        raise IncorrectSignature([f'format: one of {", ".join(_formats)}'])
+
+    statement = template.format(query=query.strip().rstrip(';'))
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=_depth)
+    pipe = _Pipe(loop, queue, gzip)
+
+    copying = loop.run_in_executor(None, _copy, connect, statement, pipe)
+
+    def finished(future: asyncio.Future) -> None:
+        future.exception()  # retrieved here, so a cancelled export does not log it again
+        asyncio.ensure_future(queue.put(None))  # end of data
+
+    copying.add_done_callback(finished)
+    watching = asyncio.create_task(_watch(receive, pipe, queue))
+
+    try:
+        first = await queue.get()
+        if pipe.cancelled:
+            print('Export cancelled before it started: the client went away')
+            return
+        if first is None:
+            copying.result()  # raises the error, if any
+
+        filename = f'export.{extension}' + ('.gz' if gzip else '')
+        headers = [
+            (b'content-type', b'application/gzip' if gzip else content_type.encode()),
+            (b'content-disposition', f'attachment; filename="{filename}"'.encode()),
+            (b'cache-control', b'no-store'),
+            *cors_headers,
+        ]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+        chunk = first
+        while chunk is not None and not pipe.cancelled:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await queue.get()
+    except (Exception, asyncio.CancelledError):
+        # a COPY thread blocked on a full queue would otherwise wait forever
+        pipe.cancel()
+        _discard(queue)
+        raise
+    finally:
+        watching.cancel()
+
+    if pipe.cancelled:
+        print('Export cancelled: the client went away')
+        return
+    if error := copying.exception():
+        print(f'Export interrupted: {type(error).__name__}: {error}')
+        raise Interrupted(f'{error}') from error
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def _watch(receive: Receive, pipe: _Pipe, queue: asyncio.Queue[Any]) -> None:
+    """
+    Cancels the COPY once the client disconnects; ASGI servers may drop what is sent to a gone client
+    without raising.
+    """
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+    pipe.cancel()
+    _discard(queue)
+
+
+def _discard(queue: asyncio.Queue[Any]) -> None:
+    # unblocks the COPY thread, so it can notice the cancellation
+    while not queue.empty():
+        queue.get_nowait()
@@ -1,6 +1,7 @@
 import asyncio
+import hashlib
 import json
-from typing import Callable, Mapping, AsyncIterable, Any
+from typing import Callable, Mapping, AsyncIterable, AsyncIterator, Any, Iterable, TypeVar
 from urllib.parse import parse_qs as _parse_qs
 
 from utils import custom_serializer  # noqa
@@ -9,8 +10,10 @@ from signatures import Send, stream_headers, Receive, cors_headers
 
 all_headers = [*stream_headers, *cors_headers]
 
+T = TypeVar('T')
 
-async def respond(send: Send, status: int = 200, body: Mapping = None, headers: Mapping = None) -> None:
+
+async def respond(send: Send, status: int = 200, body: Mapping | bytes = None, headers: Mapping = None) -> None:
     """
     Send an HTTP response with a JSON payload. The HTTP response can include a custom
     status code, headers, and a JSON object as the response body. By default, it sets
@@ -19,20 +22,27 @@ async def respond(send: Send, status: int = 200, body: Mapping = None, headers:
 
     :param send: An ASGI send function used for sending HTTP response events.
     :param status: HTTP status code for the response. Defaults to 200.
-    :param body: A dictionary or mapping to serialize into a JSON payload. Defaults to an
-        empty dictionary.
+    :param body: A dictionary or mapping to serialize into a JSON payload, or a JSON payload
+        already encoded. Defaults to an empty dictionary.
     :param headers: A dictionary or mapping of additional headers to include in the response.
         The headers' keys and values will be encoded as bytes.
     :return: None
     """
-    payload = json.dumps(body or {}, default=custom_serializer).encode()
+    if status == 304:
+        payload = b''
+    elif isinstance(body, bytes):  # encoded already, e.g. in `cpu`'s process pool
+        payload = body
+    else:
+        payload = json.dumps(body or {}, default=custom_serializer).encode()
     if headers is None:
         headers = {}
+    cache = [] if 'cache-control' in headers else [(b'cache-control', b'no-store')]
     base = [
         (b'content-type', b'application/json'),
-        (b'cache-control', b'no-store'),
+        *cache,
         (b'access-control-allow-origin', b'*'),
-        (b'access-control-allow-headers', b'authorization,content-type'),
+        (b'access-control-allow-headers',
+         b'authorization,content-type,if-none-match,last-event-id,idempotency-key'),
         (b'access-control-allow-methods', b'GET,POST,PUT,DELETE,OPTIONS'),
         *((k.encode(), v.encode()) for k, v in headers.items()),
     ]
@@ -61,6 +71,68 @@ async def stream(send: Send, events: AsyncIterable[str]) -> None:
     await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
 
 
+def header_of(event: dict, name: str) -> str | None:
+    """
+    Looks up a request header regardless of the invocation signature:
+    ASGI scopes carry a list of byte pairs, proxy events a plain mapping.
+
+    :param event: ASGI scope or a proxy event
+    :param name: Lower-case header name
+    :return: Header value or None if absent
+    """
+    match event:
+        case {'headers': list() | tuple() as headers}:
+            key = name.encode()
+            for k, v in headers:
+                if k.lower() == key:
+                    return v.decode()
+        case {'headers': dict() as headers}:
+            for k, v in headers.items():
+                if k.lower() == name:
+                    return v
+    return None
+
+
+def etag_of(payload: Any) -> str:
+    """
+    Strong entity tag over a JSON-compatible payload, e.g. raw DynamoDB items.
+    Keys are sorted, so equal content always yields the same tag.
+    """
+    raw = payload if isinstance(payload, bytes) else json.dumps(
+        payload,
+        sort_keys=True,
+        separators=(',', ':'),
+        default=custom_serializer,
+    ).encode()
+    return f'"{hashlib.blake2b(raw, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(etag: str, if_none_match: str | None) -> bool:
+    """
+    Weak comparison as required for If-None-Match (RFC 9110, 13.1.2).
+    """
+    if not if_none_match:
+        return False
+    candidates = [each.strip() for each in if_none_match.split(',')]
+    return any(
+        each == '*' or each.removeprefix('W/') == etag
+        for each in candidates
+    )
+
+
+def revalidated(etag: str) -> dict[str, str]:
+    """
+    Headers for a response that clients may keep but must revalidate before reuse.
+    `private` keeps shared caches from serving one user's lists to another.
+    """
+    return {
+        'etag': etag,
+        'cache-control': 'private, no-cache',
+        'vary': 'x-user-uid, authorization',
+        'access-control-expose-headers': 'etag',
+    }
+
+
 def parse_qs(raw: bytes) -> dict[str, str | list[str]]:
     """
     Parse query string bytes into a dict.
@@ -114,3 +186,18 @@ async def run_blocking(fn: Callable[[], Any]) -> Any:
     """
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(None, fn)
+
+
+async def iterate_blocking(items: Iterable[T]) -> AsyncIterator[T]:
+    """
+    Consumes a blocking iterator (e.g. a streaming LLM response) on the thread pool,
+    so that waiting for the next item does not stall the event loop.
+
+    :param items: Iterable whose `next` may block
+    :return: Async iterator over the same items
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(items)
+    sentinel = object()
+    while (item := await loop.run_in_executor(None, next, iterator, sentinel)) is not sentinel:
+        yield item
@@ -0,0 +1,51 @@
+import os
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Any
+
+import psycopg2
+
+from cache import TTLCache
+from db import connect, circuit_of
+from errors import Unavailable
+from models import Connector
+
+_checks: TTLCache[str, dict] = TTLCache(ttl=float(os.environ.get('HEALTH_CACHE_TTL', 30)))
+
+
+def check(connector: Connector) -> dict[str, Any]:
+    """
+    Connects and runs `SELECT 1`, timing the round trip. Fails fast while the connector's
+    circuit is open. The outcome is cached, see `cached`.
+
+    :return: Whether the database is reachable, the latency or error, and the circuit state.
+    """
+    started = time.perf_counter()
+    try:
+        with closing(connect(connector)) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            connection.rollback()
+        outcome = {'reachable': True, 'latencyMs': round((time.perf_counter() - started) * 1000, 1)}
+    except Unavailable as e:
+        outcome = {'reachable': False, 'error': f'{e}'}
+    except psycopg2.Error as e:
+        outcome = {
+            'reachable': False,
+            'latencyMs': round((time.perf_counter() - started) * 1000, 1),
+            'error': next(iter(f'{e}'.strip().splitlines()), type(e).__name__),
+        }
+
+    return _checks.put(f'{connector.id}', outcome | {
+        'checkedAt': datetime.now(timezone.utc).isoformat(),
+        'circuit': circuit_of(connector),
+    })
+
+
+def cached(connector_id: str) -> dict[str, Any] | None:
+    """
+    :return: The latest check of a connector, if it is recent enough.
+    """
+    return _checks.get(f'{connector_id}')
@@ -0,0 +1,133 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from contextlib import closing
+from math import ceil
+from typing import Any
+
+import q as queries
+from db import run, connect
+from models import Connector
+
+_concurrency = int(os.environ.get('INSPECT_CONCURRENCY', 4))  # connections open at once per inspection
+_timeout_ms = int(os.environ.get('INSPECT_TIMEOUT_MS', 15_000))  # per database, or per schema chunk
+_chunk = int(os.environ.get('INSPECT_SCHEMA_CHUNK', 0))  # schemata per query; 0 inspects a database at once
+
+
+def inspect(
+        connector: Connector,
+        *,
+        databases: list[str] = None,
+        schemata: list[str] = None,
+        concurrency: int = _concurrency,
+        timeout_ms: int = _timeout_ms,
+        chunk: int = _chunk,
+) -> dict[str, Any]:
+    """
+    Inspects every database on the connector's server the user may connect to, each over
+    its own connection, a few at a time. With `chunk`, large databases are further split
+    into groups of schemata inspected side by side.
+
+    A database (or chunk) that fails or runs out of time does not fail the inspection:
+    it is left without schemata and listed under `errors`.
+
+    :param connector: Connector whose server is inspected.
+    :param databases: Only inspect these databases.
+    :param schemata: Only inspect these schemata.
+    :param concurrency: Most connections open at once.
+    :param timeout_ms: Statement timeout of each query.
+    :param chunk: Schemata per query, or 0 for a single query per database.
+    :return: A `q.inspect` document over all databases, plus `errors` if the result is partial.
+    """
+    with closing(connect(connector)) as connection:
+        names = [row['database_name'] for row in run(connection, queries.databases)]
+    if databases:
+        names = [name for name in names if name in databases]
+
+    errors = []
+    pool = ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix='inspect')
+    try:
+        if chunk > 0:
+            listed = _gather({
+                (name, None): pool.submit(_schemata, connector, name, schemata, timeout_ms)
+                for name in names
+            }, timeout_ms, concurrency, errors)
+            tasks = [
+                (name, tuple(group[i:i + chunk]))
+                for (name, _), group in listed.items()
+                for i in range(0, len(group), chunk)
+            ]
+        else:
+            tasks = [(name, tuple(schemata) if schemata else None) for name in names]
+
+        results = _gather({
+            task: pool.submit(_inspect, connector, *task, timeout_ms)
+            for task in tasks
+        }, timeout_ms, concurrency, errors)
+    finally:
+        # stragglers are stopped by their statement timeout; nobody waits for them
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    merged = {name: {'databaseName': name, 'schemata': None} for name in names}
+    for found in results.values():
+        for database in found:
+            entry = merged[database['databaseName']]
+            entry['schemata'] = (entry['schemata'] or []) + (database.get('schemata') or [])
+    for entry in merged.values():
+        if entry['schemata']:
+            entry['schemata'].sort(key=lambda schema: schema['schemaName'])
+
+    return {
+        'databases': list(merged.values()),
+        **({'errors': errors} if errors else {}),
+    }
+
+
+def _gather(
+        futures: dict[tuple[str, tuple[str, ...] | None], Future],
+        timeout_ms: int,
+        concurrency: int,
+        errors: list[dict],
+) -> dict[tuple[str, tuple[str, ...] | None], Any]:
+    """
+    Waits for the tasks, long enough for every wave of `concurrency` of them to use up its timeout,
+    and collects their results. Failures and stragglers are appended to `errors`.
+    """
+    waves = ceil(len(futures) / max(concurrency, 1))
+    wait(futures.values(), timeout=timeout_ms / 1000 * waves + 1)
+
+    results = {}
+    for (database, schemata), future in futures.items():
+        if not future.done():
+            future.cancel()
+            error = f'timed out after {timeout_ms} ms'
+        elif (e := future.exception()) is not None:
+            error = f'{type(e).__name__}: {e}'.strip()
+        else:
+            results[database, schemata] = future.result()
+            continue
+        errors.append({
+            'database': database,
+            **({'schemata': list(schemata)} if schemata else {}),
+            'error': error,
+        })
+    return results
+
+
+def _connect(connector: Connector, database: str, timeout_ms: int):
+    connection = connect(connector, database)
+    with connection.cursor() as cursor:
+        cursor.execute('SET statement_timeout = %s', (timeout_ms,))
+    connection.commit()
+    return connection
+
+
+def _schemata(connector: Connector, database: str, only: list[str] | None, timeout_ms: int) -> list[str]:
+    with closing(_connect(connector, database, timeout_ms)) as connection:
+        names = [row['schema_name'] for row in run(connection, queries.schemata)]
+    return [name for name in names if name in only] if only else names
+
+
+def _inspect(connector: Connector, database: str, schemata: tuple[str, ...] | None, timeout_ms: int) -> list[dict]:
+    with closing(_connect(connector, database, timeout_ms)) as connection:
+        [row] = run(connection, queries.inspect, {'schemata': list(schemata) if schemata else None})
+    return row['databases'] or []
@@ -1,35 +1,331 @@
-from typing import Any, Iterator
+import asyncio
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Iterator
 
-from google import genai
+import providers
+from providers import CachedContext, CacheExpired, Contents, Provider, Usage
 
-_ai = genai.Client()
+_provider: Provider = providers.configured()
 
-_model = "gemini-2.5-flash"
+default_model: str = os.environ.get('LLM_MODEL', 'gemini-2.5-flash')
 
+_ttft_deadline = float(os.environ.get('LLM_TTFT_DEADLINE', 10))  # seconds to the first chunk, per attempt
+_hedge_after = float(os.environ.get('LLM_HEDGE_AFTER', 2))  # seconds before a second request is sent; 0 disables
+_call_deadline = float(os.environ.get('LLM_CALL_DEADLINE', 60))  # same, for a whole non-streamed response
+_call_hedge_after = float(os.environ.get('LLM_CALL_HEDGE_AFTER', 15))
+_retries = int(os.environ.get('LLM_RETRIES', 2))
+_backoff = float(os.environ.get('LLM_BACKOFF', .5))  # seconds, doubled on every retry
 
-def call(*, prompt: str, history: list[dict[str, Any]] = None) -> str:
-    if history is None:
-        history = []
-    response = _ai.models.generate_content(
-        model=_model,
-        contents=[
-            *history,
-            {'role': 'user', 'parts': [{'text': prompt}]}
-        ],
-    )
-    return response.text
-
-
-def stream(prompt: str, *, history: list[dict[str, Any]] = None) -> Iterator[str]:
-    if history is None:
-        history = []
-    response = _ai.models.generate_content_stream(
-        model=_model,
-        contents=[
-            *history,
-            {'role': 'user', 'parts': [{'text': prompt}]}
-        ],
+_transient_codes = {408, 429, 500, 502, 503, 504}
+
+
+class _Timeout(Exception):
+    pass
+
+
+def _transient(error: Exception) -> bool:
+    return (
+        isinstance(error, (_Timeout, ConnectionError, TimeoutError))
+        or getattr(error, 'code', None) in _transient_codes
+        or type(error).__module__.split('.')[0] in ('httpx', 'httpcore')  # transport errors
     )
-    for index, chunk in enumerate(response, 1):
-        print(f"Chunk {index}: {chunk.text}")
-        yield chunk.text
+
+
+def _attempt(start: Callable[[], Iterator[str]], tag: int, events: queue.Queue, cancelled: threading.Event) -> None:
+    """
+    Runs one request on its own thread, forwarding what it yields as (tag, kind, value) events.
+    """
+    try:
+        for text in start():
+            if cancelled.is_set():
+                return
+            events.put((tag, 'chunk', text))
+        events.put((tag, 'end', None))
+    except Exception as e:
+        events.put((tag, 'error', e))
+
+
+def _first(
+        start: Callable[[], Iterator[str]],
+        events: queue.Queue,
+        deadline: float,
+        hedge_after: float,
+) -> tuple[int, str, dict[int, threading.Event]]:
+    """
+    Sends a request, and a second one if the first has not answered within `hedge_after`.
+    Whichever yields first wins; the other is cancelled.
+
+    :raises _Timeout: If neither answers within `deadline`.
+    :return: The winner's tag, its first chunk, and the cancellation flags.
+    """
+    started = time.monotonic()
+    flags: dict[int, threading.Event] = {}
+
+    def launch() -> None:
+        tag = len(flags)
+        flags[tag] = threading.Event()
+        threading.Thread(target=_attempt, args=(start, tag, events, flags[tag]), daemon=True).start()
+
+    launch()
+    failed: Exception | None = None
+    while True:
+        elapsed = time.monotonic() - started
+        hedging = 0 < hedge_after and len(flags) == 1 and failed is None
+        wake = min(hedge_after, deadline) if hedging else deadline
+        try:
+            tag, kind, value = events.get(timeout=max(wake - elapsed, 0))
+        except queue.Empty:
+            if hedging and elapsed < deadline:
+                launch()
+                continue
+            _cancel(flags)
+            raise _Timeout(f'no response within {deadline}s')
+
+        match kind:
+            case 'chunk':
+                _cancel(flags, but=tag)
+                return tag, value, flags
+            case 'end':
+                _cancel(flags, but=tag)
+                return tag, '', flags
+            case 'error':
+                failed = value
+                flags[tag].set()
+                if all(each.is_set() for each in flags.values()):
+                    raise failed
+
+
+def _cancel(flags: dict[int, threading.Event], but: int = None) -> None:
+    for tag, flag in flags.items():
+        if tag != but:
+            flag.set()
+
+
+def resilient(
+        start: Callable[[], Iterator[str]],
+        *,
+        deadline: float = _ttft_deadline,
+        hedge_after: float = _hedge_after,
+        retries: int = _retries,
+) -> Iterator[str]:
+    """
+    Streams from `start` with a deadline for the first chunk, a hedged second request when
+    the first is slow, and retries with jittered exponential backoff on transient errors.
+
+    Retries only happen before anything has been yielded; once the first chunk is out,
+    errors propagate as they are.
+
+    :param start: Sends a request and iterates its chunks; called once per attempt, on a worker thread.
+    :param deadline: Seconds an attempt may take to yield its first chunk.
+    :param hedge_after: Seconds after which a second request is sent alongside a silent first one; 0 disables.
+    :param retries: Attempts after the first one.
+    """
+    for attempt in range(retries + 1):
+        events: queue.Queue = queue.Queue()
+        try:
+            winner, first, flags = _first(start, events, deadline, hedge_after)
+            break
+        except Exception as e:
+            if not _transient(e) or attempt == retries:
+                raise
+            print(f'LLM attempt {attempt + 1} failed, retrying: {type(e).__name__}: {e}')
+            delay = _backoff * 2 ** attempt
+            time.sleep(delay + random.uniform(0, delay))
+
+    try:
+        if first:
+            yield first
+        while True:
+            tag, kind, value = events.get()
+            if tag != winner:
+                continue
+            match kind:
+                case 'chunk':
+                    yield value
+                case 'end':
+                    return
+                case 'error':
+                    raise value
+    finally:
+        _cancel(flags)
+
+
+async def _afirst(
+        start: Callable[[], AsyncIterator[str]],
+        deadline: float,
+        hedge_after: float,
+) -> tuple[AsyncIterator[str], str]:
+    """
+    Same as `_first`, with tasks instead of threads.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    pending: dict[asyncio.Task, AsyncIterator[str]] = {}
+    launched = 0
+    failed: Exception | None = None
+
+    def launch() -> None:
+        nonlocal launched
+        iterator = start()
+        pending[asyncio.ensure_future(anext(iterator, None))] = iterator
+        launched += 1
+
+    launch()
+    try:
+        while pending:
+            hedging = 0 < hedge_after and launched == 1 and failed is None
+            wake = min(hedge_after, deadline) if hedging else deadline
+            done, _ = await asyncio.wait(
+                pending, timeout=max(wake - (loop.time() - started), 0), return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                if hedging and loop.time() - started < deadline:
+                    launch()
+                    continue
+                raise _Timeout(f'no response within {deadline}s')
+            for task in done:
+                iterator = pending.pop(task)
+                if (error := task.exception()) is not None:
+                    failed = error
+                    continue
+                return iterator, task.result() or ''
+        raise failed
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def aresilient(
+        start: Callable[[], AsyncIterator[str]],
+        *,
+        deadline: float = _ttft_deadline,
+        hedge_after: float = _hedge_after,
+        retries: int = _retries,
+) -> AsyncIterator[str]:
+    """
+    Same as `resilient`, for async iterators; attempts run as tasks on the event loop.
+    """
+    for attempt in range(retries + 1):
+        try:
+            winner, first = await _afirst(start, deadline, hedge_after)
+            break
+        except Exception as e:
+            if not _transient(e) or attempt == retries:
+                raise
+            print(f'LLM attempt {attempt + 1} failed, retrying: {type(e).__name__}: {e}')
+            delay = _backoff * 2 ** attempt
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+    try:
+        if first:
+            yield first
+        async for text in winner:
+            yield text
+    finally:
+        await winner.aclose()
+
+
+def use(provider: Provider) -> Provider:
+    """
+    Replaces the provider, e.g. with a `providers.Fake` in benchmarks.
+
+    :return: The previous provider.
+    """
+    global _provider
+    previous, _provider = _provider, provider
+    return previous
+
+
+def _contents(prompt: str, history: list[dict[str, Any]] | None) -> list[dict[str, Any]]:
+    return [
+        *(history or []),
+        {'role': 'user', 'parts': [{'text': prompt}]}
+    ]
+
+
+def cache(model: str, contents: Contents, ttl: float) -> CachedContext | None:
+    """
+    Stores leading turns of a conversation with the provider, see `providers.Provider.cache`.
+
+    :return: The handle to pass as `context`, or None if the provider does not cache context.
+    """
+    return _provider.cache(model or default_model, contents, ttl)
+
+
+def _cacheable(context: CachedContext | None, model: str) -> bool:
+    return context is not None and context.usable(model)
+
+
+def call(
+        *,
+        prompt: str,
+        history: list[dict[str, Any]] = None,
+        model: str = None,
+        retries: int = _retries,
+        context: CachedContext = None,
+        usage: Usage = None,
+) -> str:
+    """
+    :param context: Cached leading turns of `history`, sent by reference if `model` can use them.
+    :param usage: Filled in with the tokens the response took, if the provider reports them.
+    """
+    model = model or default_model
+    contents = _contents(prompt, history)
+
+    def start() -> Iterator[str]:
+        if _cacheable(context, model):
+            try:
+                yield _provider.generate(model, contents[context.turns:], cached=context.name, usage=usage)
+                return
+            except CacheExpired:
+                context.lost = True
+        yield _provider.generate(model, contents, usage=usage)
+
+    return ''.join(resilient(start, deadline=_call_deadline, hedge_after=_call_hedge_after, retries=retries))
+
+
+def stream(prompt: str, *, history: list[dict[str, Any]] = None, model: str = None) -> Iterator[str]:
+    contents = _contents(prompt, history)
+
+    yield from resilient(lambda: _provider.stream(model or default_model, contents))
+
+
+async def astream(
+        prompt: str,
+        *,
+        history: list[dict[str, Any]] = None,
+        model: str = None,
+        deadline: float = _ttft_deadline,
+        retries: int = _retries,
+        context: CachedContext = None,
+        usage: Usage = None,
+) -> AsyncIterator[str]:
+    """
+    Same as `stream`, without a worker thread per request.
+
+    :param deadline: Seconds each attempt may take to yield its first chunk.
+    :param retries: Attempts after the first one.
+    :param context: Cached leading turns of `history`, sent by reference if `model` can use them.
+        If the provider no longer has them, the request is sent again in full and `context.lost` is set.
+    :param usage: Filled in with the tokens the response took, once it is complete.
+    """
+    model = model or default_model
+    contents = _contents(prompt, history)
+
+    async def start() -> AsyncIterator[str]:
+        if _cacheable(context, model):
+            try:
+                async for text in _provider.astream(model, contents[context.turns:], cached=context.name, usage=usage):
+                    yield text
+                return
+            except CacheExpired:  # raised with the response, before any text
+                context.lost = True
+        async for text in _provider.astream(model, contents, usage=usage):
+            yield text
+
+    async for text in aresilient(start, deadline=deadline, retries=retries):
+        yield text
@@ -1,18 +1,22 @@
 import json
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from functools import wraps
 from typing import Final, Any, Self, TypeVar, Callable, Dict
 
 from dynamo import TypedModelWithSortableKey, Ksuid, db, DynamoModel
 from utils import snake_to_camel, custom_serializer  # noqa
 
+import blobs
 from errors import NotFound
+from providers import CachedContext
 
 user_type: Final[str] = 'USER'
 connector_type: Final[str] = 'CONNECTOR'
 chat_type: Final[str] = 'CHAT'
+usage_type: Final[str] = 'USAGE'
 _max_rows = 250
+_legacy_model = 'gemini-2.5-flash'  # generated every message stored before the model was recorded
 
 
 @dataclass
@@ -32,8 +36,18 @@ class Connector(TypedModelWithSortableKey):
     :ivar password: The password used for database access.
     :ivar database: The name of the connected database.
     :ivar user_id: The unique identifier of the user associated with the connector.
-    :ivar inspection: Represents optional inspection-related metadata.
+    :ivar inspection: Represents optional inspection-related metadata. Too large for the item,
+        it is stored beside it, see `blobs`, and only read when asked for, see `load_stored`.
+    :ivar schema_index: The relevance index over the inspection's tables, see `relevance.Index`.
+        Stored beside the item too, and not returned to the client.
+    :ivar inspection_ref: Reference to the stored inspection, see `blobs.save`.
+    :ivar schema_index_ref: Reference to the stored relevance index.
     :ivar name: Optional name identifier for the connector.
+    :ivar max_cost: Optional planner cost above which queries are not run right away.
+    :ivar max_rows: Optional estimated row count above which queries are not run right away.
+    :ivar preflight: What happens to a query over the limits: 'confirm' (default) runs it
+        once the client confirms, 'refuse' never runs it.
+    :ivar connect_timeout: Optional seconds to wait for a connection, instead of the default.
     """
     host: str
     port: str
@@ -42,13 +56,42 @@ class Connector(TypedModelWithSortableKey):
     database: str
     user_id: str
     inspection: str = None
+    schema_index: str = None
+    inspection_ref: str = None
+    schema_index_ref: str = None
     name: str = None
+    max_cost: int = None
+    max_rows: int = None
+    preflight: str = None
+    connect_timeout: int = None
     _id: Ksuid = None
     _pk: str = None
     _sk: str = None
 
     def _to_item(self) -> dict[str, Any]:
-        return self.item_pk | self.item_sk | self.to_dict()
+        refs = {
+            key: value for key, value in {
+                'inspection_ref': self.inspection_ref,
+                'schema_index_ref': self.schema_index_ref,
+            }.items()
+            if value
+        }
+        return self.item_pk | self.item_sk | {k: v for k, v in self.to_dict().items() if k != 'inspection'} | refs
+
+    def load_stored(self, *names: str) -> Self:
+        """
+        Reads values stored beside the item, by default both `inspection` and `schema_index`,
+        with a single batch read, see `blobs.load_all`. Values already read are kept, and so are
+        inspections stored in the item itself, before they were moved out of it. Blocking.
+        """
+        wanted = [
+            name for name in names or ('inspection', 'schema_index')
+            if getattr(self, f'{name}_ref') and getattr(self, name) is None
+        ]
+        values = blobs.load_all([(self.primary_key, name, getattr(self, f'{name}_ref')) for name in wanted])
+        for name, value in zip(wanted, values):
+            setattr(self, name, value)
+        return self
 
     @property
     def type(self) -> str:
@@ -79,6 +122,10 @@ class Connector(TypedModelWithSortableKey):
             password=d['password'],
             database=d['database'],
             name=d.get('name'),
+            max_cost=_optional_int(d.get('max_cost')),
+            max_rows=_optional_int(d.get('max_rows')),
+            preflight=d.get('preflight'),
+            connect_timeout=_optional_int(d.get('connect_timeout')),
             _id=Ksuid(),
             user_id=user_id,
         )
@@ -97,6 +144,12 @@ class Connector(TypedModelWithSortableKey):
             database=record['database']['S'],
             name=record.get('name', {}).get('S'),
             inspection=record.get('inspection', {}).get('S'),
+            inspection_ref=record.get('inspection_ref', {}).get('S'),
+            schema_index_ref=record.get('schema_index_ref', {}).get('S'),
+            max_cost=_optional_int(record.get('max_cost', {}).get('N')),
+            max_rows=_optional_int(record.get('max_rows', {}).get('N')),
+            preflight=record.get('preflight', {}).get('S'),
+            connect_timeout=_optional_int(record.get('connect_timeout', {}).get('N')),
             _pk=record['PK']['S'],
             _sk=sk,
             _id=_id,
@@ -117,10 +170,20 @@ class Connector(TypedModelWithSortableKey):
 
     def to_dict(self) -> dict:
         inspection = {'inspection': self.inspection} if self.inspection else {}
+        limits = {
+            key: value for key, value in {
+                'max_cost': self.max_cost,
+                'max_rows': self.max_rows,
+                'preflight': self.preflight,
+                'connect_timeout': self.connect_timeout,
+            }.items()
+            if value is not None
+        }
         return {
             **self.to_connection(),
             'name': self.name,
             **inspection,
+            **limits,
         }
 
     def public(self) -> dict:
@@ -137,11 +200,22 @@ class Connector(TypedModelWithSortableKey):
         }
 
 
+def _optional_int(value: Any) -> int | None:
+    return None if value in (None, '') else int(float(value))
+
+
+def _results(value: str | None) -> tuple[list[str], list[list]] | None:
+    """
+    Decodes stored query results; chats written before their query ran have none.
+    """
+    return json.loads(value) if value else None
+
+
 F = TypeVar('F', bound=Callable[..., dict])
 _table = os.environ['TABLE_NAME']
 
 
-@dataclass
+@dataclass(slots=True)
 class Message(DynamoModel):
     """
     Represents a Message entity used within a DynamoDB model.
@@ -154,28 +228,61 @@ class Message(DynamoModel):
 
     :ivar message: The content of the message.
     :ivar response: The content of the associated response.
-    :ivar id: A unique identifier for the message, defaulting to
-        a new Ksuid instance if not provided.
+    :ivar _id: A unique identifier for the message, defaulting to
+        a new Ksuid instance if not provided. Read from an item, it stays
+        a string until `id` is first accessed.
+    :ivar model: The LLM model that generated the response.
+    :ivar prompt_tokens: Input tokens of the request, as reported by the provider.
+    :ivar completion_tokens: Tokens of the response.
+    :ivar cached_tokens: Input tokens read from cached context.
+    :ivar ttft_ms: Milliseconds from the request to the first token of the response.
+    :ivar duration_ms: Milliseconds from the request to the end of the response.
     """
     message: str
     response: str
-    id: Ksuid = None
+    _id: Ksuid | str = None
+    model: str = None
+    prompt_tokens: int = None
+    completion_tokens: int = None
+    cached_tokens: int = None
+    ttft_ms: int = None
+    duration_ms: int = None
 
     def __post_init__(self):
-        if self.id is None:
-            self.id = Ksuid()
+        if self._id is None:
+            self._id = Ksuid()
+
+    @property
+    def id(self) -> Ksuid:
+        if isinstance(self._id, str):
+            self._id = Ksuid.from_base62(self._id)
+        return self._id
 
     def _to_item(self) -> Dict[str, Any]:
         return {
             'message': self.message,
             'response': self.response,
-            'id': f'{self.id}',
+            'id': f'{self._id}',
+            **({'model': self.model} if self.model else {}),
+            **{key: value for key, value in self.usage().items() if value is not None},
+        }
+
+    def usage(self) -> dict[str, int | None]:
+        """
+        Tokens and timings of the turn; None where they were not recorded.
+        """
+        return {
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cached_tokens': self.cached_tokens,
+            'ttft_ms': self.ttft_ms,
+            'duration_ms': self.duration_ms,
         }
 
     def to_dict(self, order: int = None) -> dict:
         return self._to_item() | {
             'created': self.id.datetime.isoformat(),
-            'model': 'gemini-2.5-flash',
+            'model': self.model or _legacy_model,
             'order': order,
         }
 
@@ -184,17 +291,23 @@ class Message(DynamoModel):
         return cls(
             message=record['message']['S'],
             response=record['response']['S'],
-            id=Ksuid.from_base62(record['id']['S']),
+            _id=record['id']['S'],
+            model=record.get('model', {}).get('S'),
+            prompt_tokens=_optional_int(record.get('prompt_tokens', {}).get('N')),
+            completion_tokens=_optional_int(record.get('completion_tokens', {}).get('N')),
+            cached_tokens=_optional_int(record.get('cached_tokens', {}).get('N')),
+            ttft_ms=_optional_int(record.get('ttft_ms', {}).get('N')),
+            duration_ms=_optional_int(record.get('duration_ms', {}).get('N')),
         )
 
     def to_llm(self) -> list[dict[str, str]]:
         return [
-            {'role': 'model', 'parts': [{'text': self.response}]},
             {'role': 'user', 'parts': [{'text': self.message}]},
+            {'role': 'model', 'parts': [{'text': self.response}]},
         ]
 
 
-@dataclass
+@dataclass(slots=True)
 class Chat(TypedModelWithSortableKey):
     """
     Represents a chat session, encapsulating details about queries, prompts, user associations, and
@@ -211,33 +324,79 @@ class Chat(TypedModelWithSortableKey):
     :ivar user_id: The identifier of the user associated with the chat session.
     :ivar messages: A list of `Message` objects representing the communication history of the chat.
     :type messages: list[Message] or None
+    :ivar pending_turns: Ids of turns that have been generated, but not yet persisted.
+        Maintained with dedicated updates, so it is not a part of the full item.
+    :ivar context: The chat's leading turns as cached with the LLM provider, if they are.
+    :ivar data_profile: Statistics over the query's whole result and a random sample of its rows,
+        if the chat was created with profiling; they replace the first rows in the first prompt.
+    :ivar _raw: Attributes of the item the chat was read from that have not been decoded yet:
+        `messages` and `query_results` are decoded on first access, and their raw form dropped.
     """
     initial_query: str
     initial_prompt: str
     connector_id: str
     user_id: str
-    messages: list[Message] = None
-    query_results: tuple[list[str], list[dict]] = None  # list of column names, list of row dicts
+    _messages: list[Message] = None
+    _query_results: tuple[list[str], list[list]] = None  # list of column names, list of rows
+    pending_turns: set[str] = None
+    context: CachedContext = None
+    data_profile: dict = None
     _id: Ksuid = None
     _pk: str = None
     _sk: str = None
+    _raw: dict = field(default=None, repr=False, compare=False)
+
+    @property
+    def messages(self) -> list[Message] | None:
+        if self._raw and 'messages' in self._raw:
+            self._messages = [Message.from_item(each['M']) for each in self._raw.pop('messages').get('L', [])]
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: list[Message] | None) -> None:
+        if self._raw:
+            self._raw.pop('messages', None)
+        self._messages = messages
+
+    @property
+    def query_results(self) -> tuple[list[str], list[list]] | None:
+        if self._raw and 'query_results' in self._raw:
+            self._query_results = _results(self._raw.pop('query_results').get('S'))
+        return self._query_results
+
+    @query_results.setter
+    def query_results(self, query_results: tuple[list[str], list[list]] | None) -> None:
+        if self._raw:
+            self._raw.pop('query_results', None)
+        self._query_results = query_results
 
     def _to_item(self) -> dict[str, Any]:
+        raw = self._raw or {}
         return self.item_pk | self.item_sk | {
             'connector_id': self.connector_id,
             'user_id': self.user_id,
             'initial_query': self.initial_query,
             'initial_prompt': self.initial_prompt,
-            'messages': [
-                {'M': each.to_item()} for each in self.messages
+            'messages': raw['messages']['L'] if 'messages' in raw else [
+                {'M': each.to_item()} for each in self._messages or []
             ],
-            'query_results': json.dumps(
-                self.query_results,
+            'query_results': raw['query_results'].get('S', '') if 'query_results' in raw else json.dumps(
+                self._query_results,
                 default=custom_serializer,
             )
-            if self.query_results else '',
+            if self._query_results else '',
+            **({'context_cache': self.context_json()} if self.context else {}),
+            **({'data_profile': json.dumps(self.data_profile)} if self.data_profile else {}),
         }
 
+    def context_json(self) -> str:
+        return json.dumps({
+            'name': self.context.name,
+            'model': self.context.model,
+            'expires': self.context.expires,
+            'turns': self.context.turns,
+        })
+
     @classmethod
     def from_dict(cls, d: dict, user_id: str, connector_id: str) -> Self:
         return cls(
@@ -250,15 +409,13 @@ class Chat(TypedModelWithSortableKey):
 
     @classmethod
     def from_item(cls, record: dict) -> Self:
+        """
+        Decodes the chat's own attributes; its messages and query results are decoded when first accessed.
+        """
         sk = record['SK']['S']
         _id = Ksuid.from_base62(sk.split('#')[1])
         pk = record['PK']['S']
         user_id = pk.split('#')[1]
-        messages = record.get('messages', {}).get('L', [])
-        try:
-            query_results = json.loads(record.get('query_results', {}).get('S'))
-        except TypeError:
-            query_results = None
         return cls(
             _id=_id,
             _pk=pk,
@@ -267,10 +424,11 @@ class Chat(TypedModelWithSortableKey):
             initial_query=record['initial_query']['S'],
             initial_prompt=record['initial_prompt']['S'],
             connector_id=record['connector_id']['S'],
-            messages=[
-                Message.from_item(each['M']) for each in messages
-            ],
-            query_results=query_results,
+            _messages=[],
+            pending_turns=set(record.get('pending_turns', {}).get('SS', [])),
+            context=CachedContext(**json.loads(record['context_cache']['S'])) if 'context_cache' in record else None,
+            data_profile=json.loads(record['data_profile']['S']) if 'data_profile' in record else None,
+            _raw={key: record[key] for key in ('messages', 'query_results') if key in record},
         )
 
     def to_dict(self) -> dict:
@@ -280,12 +438,14 @@ class Chat(TypedModelWithSortableKey):
             'prompt': self.initial_prompt,
             'created': self.created.isoformat(),
             'messages': [
-                each.to_dict(index) for index, each in enumerate(self.messages)
+                each.to_dict(index) for index, each in enumerate(self.messages or [])
             ],
-            'query_results': self._query_results(),
+            'query_results': self._results_by_row(),
+            'data_profile': self.data_profile,
+            'pending': sorted(self.pending_turns or ()),
         }
 
-    def _query_results(self) -> dict | None:
+    def _results_by_row(self) -> dict | None:
         match self.query_results:
             case columns, rows:
                 return {
@@ -335,9 +495,9 @@ class Chat(TypedModelWithSortableKey):
         }
 
     def to_history(self) -> list[dict[str, str]]:
-        messages = sorted(self.messages or [], key=lambda m: m.id)
+        # messages are only ever appended, in `add` and with list_append, so they are already in order
         return [
-            part for message in messages
+            part for message in self.messages or []
             for part in message.to_llm()
         ]
 
@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import random
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from dynamo import db, Ksuid
+
+from framework import run_blocking
+from signatures import Send
+from utils import custom_serializer, is_true
+
+_table = os.environ['TABLE_NAME']
+_on_lambda = 'AWS_LAMBDA_FUNCTION_NAME' in os.environ
+
+_retries = int(os.environ.get('PERSISTENCE_RETRIES', 5))
+_backoff = float(os.environ.get('PERSISTENCE_BACKOFF', .2))  # seconds, doubled on every attempt
+# whether a response waits for the writes queued so far before it ends; a frozen Lambda sandbox flushes nothing
+_flush_before_end = is_true(os.environ.get('PERSISTENCE_FLUSH_BEFORE_END', _on_lambda))
+_flush_timeout = float(os.environ.get('PERSISTENCE_FLUSH_TIMEOUT', 10))  # seconds, enough for every retry
+# seconds to drain on shutdown; Lambda gives its runtime about half a second after SIGTERM
+_drain_timeout = float(os.environ.get('PERSISTENCE_DRAIN_TIMEOUT', .4 if _on_lambda else 20))
+
+dead_letter_type = 'DEAD_LETTER'
+
+# DynamoDB errors that will not go away by retrying
+_permanent = {
+    'AccessDeniedException',
+    'ConditionalCheckFailedException',
+    'ResourceNotFoundException',
+    'ValidationException',
+}
+
+
+@dataclass
+class Job:
+    """
+    A write to be flushed after the response has been sent.
+
+    :ivar description: Human-readable summary, used in logs.
+    :ivar write: Blocking callable doing the write, e.g. a DynamoDB update.
+    :ivar record: Everything needed to redo the write by hand; saved if the write keeps failing.
+    :ivar key: What the write is about, e.g. a chat id, to wait for its writes with `flush`.
+    """
+    description: str
+    write: Callable[[], Any]
+    record: dict
+    key: str = None
+    attempts: int = 0
+
+
+_queue: asyncio.Queue[Job] | None = None
+_worker: asyncio.Task | None = None
+_flushed: asyncio.Condition | None = None
+_submitted = 0
+_done = 0
+_unflushed: dict[str, int] = {}  # queued writes per key
+
+
+def submit(job: Job) -> None:
+    """
+    Queues a write without waiting for it. Jobs are flushed one at a time in
+    submission order, so a write may rely on the ones submitted before it.
+    """
+    global _queue, _worker, _flushed, _submitted
+    if _queue is None:
+        _queue, _flushed = asyncio.Queue(), asyncio.Condition()
+    if _worker is None or _worker.done():
+        _worker = asyncio.create_task(_work(_queue))
+    _submitted += 1
+    if job.key is not None:
+        _unflushed[job.key] = _unflushed.get(job.key, 0) + 1
+    _queue.put_nowait(job)
+
+
+async def flush(key: str = None, timeout: float = _flush_timeout) -> bool:
+    """
+    Waits for the writes submitted so far to be flushed, or given a key, for those about it.
+    Writes submitted meanwhile are not waited for, so a busy queue does not hold the caller up.
+
+    :return: Whether they were flushed within `timeout`.
+    """
+    if _flushed is None:
+        return True
+    target = _submitted
+
+    def flushed() -> bool:
+        return not _unflushed.get(key) if key is not None else _done >= target
+
+    async def wait() -> None:
+        async with _flushed:
+            await _flushed.wait_for(flushed)
+
+    try:
+        await asyncio.wait_for(wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def flushing(send: Send) -> Send:
+    """
+    Wraps an ASGI send function so that the response only ends once the writes queued
+    so far are flushed, see `flush`. Events already sent, such as `done`, are not held back.
+    Does nothing unless `PERSISTENCE_FLUSH_BEFORE_END` is set, as it is by default on Lambda,
+    where the sandbox is frozen as soon as the response is complete.
+    """
+    if not _flush_before_end:
+        return send
+
+    async def wrapper(message: dict) -> None:
+        if message['type'] == 'http.response.body' and not message.get('more_body', False):
+            await flush()
+        await send(message)
+
+    return wrapper
+
+
+async def drain(timeout: float = None) -> None:
+    """
+    Waits for queued writes to be flushed, e.g. on worker shutdown, for up to
+    `PERSISTENCE_DRAIN_TIMEOUT` seconds. Whatever is left is logged as failed,
+    as there is no time left to write it anywhere else.
+    """
+    if _queue is None:
+        return
+    try:
+        await asyncio.wait_for(_queue.join(), _drain_timeout if timeout is None else timeout)
+    except asyncio.TimeoutError:
+        while not _queue.empty():
+            job = _queue.get_nowait()
+            _log_failure(_entry(job, 'not flushed before shutdown'))
+            _queue.task_done()
+
+
+async def _work(queue: asyncio.Queue[Job]) -> None:
+    global _done
+    while True:
+        job = await queue.get()
+        try:
+            await _flush(job)
+        finally:
+            _done += 1
+            if job.key is not None and (left := _unflushed.pop(job.key, 0) - 1) > 0:
+                _unflushed[job.key] = left
+            async with _flushed:
+                _flushed.notify_all()
+            queue.task_done()
+
+
+async def _flush(job: Job) -> None:
+    while True:
+        job.attempts += 1
+        try:
+            await run_blocking(job.write)
+            return
+        except Exception as e:
+            code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code')
+            if code in _permanent or job.attempts > _retries:
+                traceback.print_exc()
+                await _record_failure(job, f'{type(e).__name__}: {e}')
+                return
+            delay = _backoff * 2 ** (job.attempts - 1)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+
+def _entry(job: Job, reason: str) -> dict:
+    return {
+        'at': time.time(),
+        'description': job.description,
+        'attempts': job.attempts,
+        'reason': reason,
+        'record': job.record,
+    }
+
+
+async def _record_failure(job: Job, reason: str) -> None:
+    """
+    Saves a write that keeps failing as a dead letter in the table, under its own partition,
+    with everything needed to replay it. If that fails too, the dead letter is logged.
+    """
+    entry = _entry(job, reason)
+    print(f'Persistence failed: {job.description}: {reason}')
+    try:
+        await run_blocking(lambda: _put_dead_letter(entry))
+    except Exception:
+        traceback.print_exc()
+        _log_failure(entry)
+
+
+def _put_dead_letter(entry: dict) -> dict:
+    return db().put_item(
+        TableName=_table,
+        Item={
+            'PK': {'S': dead_letter_type},
+            'SK': {'S': f'{dead_letter_type}#{Ksuid()}'},
+            'description': {'S': entry['description']},
+            'attempts': {'N': f'{entry["attempts"]}'},
+            'reason': {'S': entry['reason']},
+            'record': {'S': json.dumps(entry['record'], default=custom_serializer)},
+        },
+    )
+
+
+def _log_failure(entry: dict) -> None:
+    """
+    The last resort for a dead letter: one JSON line in the logs, which outlive the instance.
+    """
+    print(f'Persistence dead letter: {json.dumps(entry, default=custom_serializer)}')
@@ -0,0 +1,173 @@
+from dataclasses import dataclass, asdict
+from typing import Any, Iterator
+
+from utils import snake_to_camel
+
+_top = 5  # nodes listed per hotspot category
+_misestimate = 10  # actual vs estimated rows factor worth pointing out
+_large_scan = 100_000  # rows read by a sequential scan worth pointing out
+
+
+@dataclass
+class Node:
+    """
+    A plan node with its timings reduced to totals over all loops.
+
+    :ivar path: Position in the tree, e.g. '0.1.0' is the first child of the root's second child.
+    :ivar total_ms: Time spent in the node and its children.
+    :ivar self_ms: Time spent in the node alone.
+    :ivar estimated_rows: Rows the planner expected, over all loops.
+    :ivar actual_rows: Rows the node returned, over all loops.
+    :ivar scanned_rows: Rows the node read, including the ones its filter removed.
+    """
+    path: str
+    node_type: str
+    relation: str | None
+    total_ms: float
+    self_ms: float
+    estimated_rows: float
+    actual_rows: float
+    scanned_rows: float
+    loops: int
+    shared_hit_blocks: int
+    shared_read_blocks: int
+
+    @property
+    def misestimate(self) -> float:
+        """
+        How far off the row estimate was, as a factor >= 1.
+        """
+        estimated, actual = max(self.estimated_rows, 1), max(self.actual_rows, 1)
+        return max(estimated, actual) / min(estimated, actual)
+
+    def to_dict(self) -> dict[str, Any]:
+        fields = asdict(self) | {
+            'total_ms': round(self.total_ms, 3),
+            'self_ms': round(self.self_ms, 3),
+            'misestimate': round(self.misestimate, 1),
+        }
+        return {snake_to_camel(k): v for k, v in fields.items()}
+
+
+def root_of(explained: list | dict) -> dict:
+    """
+    :param explained: EXPLAIN JSON output: a one-element list, or its element.
+    :return: The top-level object holding 'Plan', 'Planning Time' and 'Execution Time'.
+    """
+    match explained:
+        case [{'Plan': dict()} as root]:
+            return root
+        case {'Plan': dict()}:
+            return explained
+    raise ValueError('Not an EXPLAIN (FORMAT JSON) document')
+
+
+def nodes(plan: dict, path: str = '0') -> Iterator[Node]:
+    """
+    Flattens a plan tree, parents before children.
+
+    :param plan: A 'Plan' object.
+    :param path: Position of `plan` in the tree.
+    """
+    loops = plan.get('Actual Loops', 1) or 1
+    total = plan.get('Actual Total Time', 0) * loops
+    children = plan.get('Plans', [])
+    children_total = sum(
+        each.get('Actual Total Time', 0) * (each.get('Actual Loops', 1) or 1)
+        for each in children
+    )
+    actual = plan.get('Actual Rows', 0) * loops
+    yield Node(
+        path=path,
+        node_type=plan['Node Type'],
+        relation=_relation(plan),
+        total_ms=total,
+        self_ms=max(total - children_total, 0),
+        estimated_rows=plan.get('Plan Rows', 0) * loops,
+        actual_rows=actual,
+        scanned_rows=actual + plan.get('Rows Removed by Filter', 0) * loops,
+        loops=loops,
+        shared_hit_blocks=plan.get('Shared Hit Blocks', 0),
+        shared_read_blocks=plan.get('Shared Read Blocks', 0),
+    )
+    for index, child in enumerate(children):
+        yield from nodes(child, f'{path}.{index}')
+
+
+def _relation(plan: dict) -> str | None:
+    match plan:
+        case {'Relation Name': relation, 'Schema': schema}:
+            return f'{schema}.{relation}'
+        case {'Relation Name': relation}:
+            return relation
+    return None
+
+
+def hotspots(
+        explained: list | dict,
+        *,
+        top: int = _top,
+        misestimate: float = _misestimate,
+        large_scan: int = _large_scan,
+        table_rows: dict[str, float] = None,
+) -> dict[str, Any]:
+    """
+    Summarizes where an analyzed plan spends its time.
+
+    :param explained: EXPLAIN (ANALYZE, FORMAT JSON) output.
+    :param top: How many nodes to list per category.
+    :param misestimate: Factor between estimated and actual rows from which a node is listed.
+    :param large_scan: Rows read from which a sequential scan is listed.
+    :param table_rows: Estimated rows per 'schema.table', e.g. from inspection; a sequential
+        scan over a table this large is listed even if its filter stopped it early.
+    :return: Timings plus the slowest nodes, the worst row misestimates and sequential scans on large tables.
+    """
+    root = root_of(explained)
+    flat = list(nodes(root['Plan']))
+    table_rows = table_rows or {}
+
+    slowest = sorted(flat, key=lambda each: each.self_ms, reverse=True)[:top]
+    misestimates = sorted(
+        (each for each in flat if each.misestimate >= misestimate),
+        key=lambda each: each.misestimate,
+        reverse=True,
+    )[:top]
+    scans = sorted(
+        (
+            each for each in flat
+            if each.node_type in ('Seq Scan', 'Parallel Seq Scan')
+            and max(each.scanned_rows, table_rows.get(each.relation, 0)) >= large_scan
+        ),
+        key=lambda each: each.scanned_rows,
+        reverse=True,
+    )[:top]
+
+    return {
+        'planningMs': root.get('Planning Time'),
+        'executionMs': root.get('Execution Time'),
+        'totalCost': root['Plan'].get('Total Cost'),
+        'slowest': [each.to_dict() for each in slowest],
+        'misestimates': [each.to_dict() for each in misestimates],
+        'largeSeqScans': [each.to_dict() for each in scans],
+    }
+
+
+def table_rows_of(inspection: dict | None, database: str = None) -> dict[str, float]:
+    """
+    Estimated rows per table from a `q.inspect` document, keyed both by 'schema.table'
+    and, since plans without VERBOSE do not name the schema, by the bare table name.
+
+    :param database: Only take the tables of this database, the one the plan ran in.
+    """
+    rows = {}
+    match inspection:
+        case {'databases': list() as databases}:
+            for each_database in databases:
+                if database is not None and each_database['databaseName'] != database:
+                    continue
+                for schema in each_database.get('schemata') or []:
+                    for table in schema.get('tables') or []:
+                        estimate = table.get('estimatedRows') or 0
+                        rows[f'{table["schema"]}.{table["tableName"]}'] = estimate
+                        rows[table['tableName']] = max(rows.get(table['tableName'], 0), estimate)
+    return rows
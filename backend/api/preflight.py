@@ -0,0 +1,103 @@
+import os
+import re
+from typing import Any
+
+from cache import TTLCache
+from errors import ExcessiveQuery
+from models import Connector
+
+_plans: TTLCache[tuple[str, str], dict] = TTLCache(ttl=float(os.environ.get('PLAN_CACHE_TTL', 300)))
+
+# literals and quoted identifiers come first, so that what looks like a comment or spacing inside them is kept
+_tokens = re.compile(
+    r"(?P<kept>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(?P<tag>\$(?:[A-Za-z_]\w*)?\$).*?(?P=tag))"
+    r'|(?:--[^\n]*|/\*.*?\*/|\s)+',
+    re.DOTALL,
+)
+
+
+def normalize(sql: str) -> str:
+    """
+    Strips comments, collapses whitespace and the trailing semicolon, so that
+    trivially different spellings of one query share a cached plan. String literals,
+    quoted identifiers and dollar-quoted bodies are left as they are.
+
+    The result is only a cache key: what gets planned is the query as written.
+    """
+    return _tokens.sub(lambda match: match['kept'] or ' ', sql).strip().rstrip(';').strip()
+
+
+def statement(sql: str) -> str:
+    """
+    The query as written, without the trailing semicolon, to be prefixed with EXPLAIN.
+    """
+    return sql.strip().rstrip(';')
+
+
+def estimate(connector: Connector, connection, sql: str) -> dict[str, Any]:
+    """
+    Planner estimate for a query, from `EXPLAIN (FORMAT JSON)`; the query itself is not run.
+    Estimates are cached per connector and normalized query.
+
+    :return: Total cost, estimated rows and the plan tree.
+    """
+    key = f'{connector.id}', normalize(sql)
+    if (cached := _plans.get(key)) is not None:
+        return cached
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {statement(sql)}')
+        [[plan]] = cursor.fetchone()
+    connection.rollback()
+
+    root = plan['Plan']
+    return _plans.put(key, {
+        'cost': root['Total Cost'],
+        'startupCost': root['Startup Cost'],
+        'rows': root['Plan Rows'],
+        'plan': root,
+    })
+
+
+def wanted(connector: Connector, requested: bool = False) -> bool:
+    """
+    Whether a query on this connector needs a preflight.
+    """
+    return requested or connector.max_cost is not None or connector.max_rows is not None
+
+
+def check(connector: Connector, connection, sql: str, *, requested: bool = False, confirmed: bool = False) -> dict | None:
+    """
+    Runs the preflight if the connector has limits or the client asked for it.
+
+    :param connector: Connector with optional `max_cost`, `max_rows` and `preflight` mode
+        ('confirm' by default, or 'refuse').
+    :param connection: Open connection to the connector's database.
+    :param sql: Query about to be run.
+    :param requested: Whether the client wants the estimate regardless of limits.
+    :param confirmed: Whether the client confirms running a query over the limits;
+        has no effect in 'refuse' mode.
+    :raises ExcessiveQuery: If the estimate is over a limit and the query is not confirmed.
+    :return: The estimate, or None if no preflight was done.
+    """
+    if not wanted(connector, requested):
+        return None
+
+    result = estimate(connector, connection, sql)
+    reasons = exceeded(connector, result)
+    confirmable = connector.preflight != 'refuse'
+    if reasons and not (confirmable and confirmed):
+        raise ExcessiveQuery(estimate=result, reasons=reasons, confirmable=confirmable)
+    return result
+
+
+def exceeded(connector: Connector, result: dict[str, Any]) -> list[str]:
+    """
+    The connector's limits that an estimate is over, as reasons for the client.
+    """
+    return [
+        *([f'estimated cost {result["cost"]:.0f} exceeds {connector.max_cost}']
+          if connector.max_cost is not None and result['cost'] > connector.max_cost else []),
+        *([f'estimated rows {result["rows"]} exceed {connector.max_rows}']
+          if connector.max_rows is not None and result['rows'] > connector.max_rows else []),
+    ]
@@ -0,0 +1,200 @@
+import os
+from typing import Any
+
+import preflight
+from models import Connector
+
+_timeout = int(os.environ.get('CHAT_PROFILE_TIMEOUT_MS', 10_000))  # per statement
+_sample = int(os.environ.get('CHAT_PROFILE_SAMPLE', 20))  # random rows sent along with the profile
+_top = int(os.environ.get('CHAT_PROFILE_TOP', 5))  # most frequent values per column
+_top_max_distinct = 10_000  # columns with more distinct values get no top values
+_max_columns = 100  # columns profiled; the rest are only in the sample
+_max_chars = 80  # of a value in top values
+
+_quantiles = (.05, .25, .5, .75, .95)
+
+# Postgres type OIDs -> kinds of column, which decide the statistics gathered; anything else is 'other'
+_kinds: dict[int, str] = {
+    16: 'boolean',
+    20: 'number',
+    21: 'number',
+    23: 'number',
+    700: 'number',
+    701: 'number',
+    1700: 'number',
+    1082: 'time',
+    1083: 'time',
+    1114: 'time',
+    1184: 'time',
+    1186: 'time',
+    1266: 'time',
+    18: 'text',
+    19: 'text',
+    25: 'text',
+    1042: 'text',
+    1043: 'text',
+    2950: 'text',
+}
+
+
+def profile(connector: Connector, connection, sql: str) -> dict[str, Any] | None:
+    """
+    Profiles the whole result of a query inside Postgres, so that a chat's first prompt covers every row
+    without carrying them. Three statements run over the query, in a read-only transaction that is rolled back:
+
+    - one aggregate pass: the row count, and per column the null fraction, distinct values and, by kind,
+      min, max, mean, standard deviation and quantiles;
+    - the most frequent values of the columns that repeat, in a single grouping;
+    - a random sample of `CHAT_PROFILE_SAMPLE` rows: a Bernoulli pass sized from the row count, then a top-N
+      sort on `random()`. `TABLESAMPLE` only applies to tables, not to the result of a query.
+
+    Each statement runs under `CHAT_PROFILE_TIMEOUT_MS`. Connectors with limits are checked first, as the
+    profile reads the full result rather than the first 250 rows.
+
+    :param connection: Open connection to the connector's database.
+    :param sql: The chat's query.
+    :return: The profile, with JSON values only, or None if the query is over the connector's limits.
+    """
+    sql = sql.strip().rstrip(';')
+    if preflight.wanted(connector) and preflight.exceeded(connector, preflight.estimate(connector, connection, sql)):
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SET TRANSACTION READ ONLY')
+            cursor.execute('SET LOCAL statement_timeout = %s', (_timeout,))
+            cursor.execute(f'WITH q AS ({sql}) SELECT * FROM q LIMIT 0')
+            names = [column.name for column in cursor.description]
+            kinds = [_kinds.get(column.type_code, 'other') for column in cursor.description]
+            relation = f'q AS t({", ".join(f"c{index}" for index in range(len(names)))})'
+            profiled = list(enumerate(kinds[:_max_columns]))
+
+            cursor.execute(f'WITH q AS ({sql}) SELECT {", ".join(_aggregates(profiled))} FROM {relation}')
+            stats = iter(cursor.fetchone())
+            rows = next(stats)
+            columns = [_column(names[index], kind, rows, stats) for index, kind in profiled]
+
+            repeating = [
+                (index, column) for (index, _), column in zip(profiled, columns)
+                if 0 < column['distinct'] <= _top_max_distinct and column['distinct'] < rows * (1 - column['nulls'])
+            ]
+            if repeating and _top > 0:
+                # the query may hold a literal %, so nothing it is part of is passed parameters
+                cursor.execute(_top_values(sql, relation, [index for index, _ in repeating]))
+                by_index = dict(repeating)
+                for index, value, count in cursor.fetchall():
+                    by_index[index].setdefault('top', []).append({'value': value, 'count': count})
+
+            # rows are thinned out at random before the sort, with a margin for the sample to fill up,
+            # and only the ones kept are turned into JSON
+            kept = min(1.0, (2 * _sample + 50) / rows) if rows else 1.0
+            cursor.execute(
+                f'WITH q AS ({sql}) SELECT to_json(s) FROM ('
+                f'SELECT * FROM {relation} WHERE random() < {kept!r} ORDER BY random() LIMIT {_sample:d}'
+                f') AS s'
+            )
+            sample = [[row[f'c{index}'] for index in range(len(names))] for [row] in cursor.fetchall()]
+    finally:
+        connection.rollback()
+
+    return {
+        'rows': rows,
+        'columns': columns,
+        'sample': {'columns': names, 'rows': sample},
+    }
+
+
+def _aggregates(profiled: list[tuple[int, str]]) -> list[str]:
+    """
+    The select list of the aggregate pass: `count(*)`, then per column the expressions `_column` reads.
+    """
+    quantiles = f'ARRAY[{", ".join(f"{each}" for each in _quantiles)}]'
+    expressions = ['count(*)']
+    for index, kind in profiled:
+        column = f'c{index}'
+        comparable = f'{column}::text' if kind == 'other' else column  # json, for one, has no equality
+        expressions += [f'count({column})', f'count(DISTINCT {comparable})']
+        match kind:
+            case 'number':
+                expressions += [
+                    f'min({column})::float8',
+                    f'max({column})::float8',
+                    f'avg({column})::float8',
+                    f'stddev_samp({column})::float8',
+                    f'percentile_cont({quantiles}) WITHIN GROUP (ORDER BY {column}::float8)',
+                ]
+            case 'time':
+                expressions += [
+                    f'min({column})::text',
+                    f'max({column})::text',
+                    f'percentile_disc({quantiles}) WITHIN GROUP (ORDER BY {column})::text[]',
+                ]
+            case 'text':
+                expressions += [f'min(length({column}))', f'max(length({column}))']
+    return expressions
+
+
+def _column(name: str, kind: str, rows: int, stats) -> dict[str, Any]:
+    """
+    A column's statistics, read off the aggregate row in the order `_aggregates` put them.
+    """
+    present, distinct = next(stats), next(stats)
+    column = {
+        'name': name,
+        'kind': kind,
+        'nulls': _round(1 - present / rows) if rows else 0,
+        'distinct': distinct,
+    }
+    match kind:
+        case 'number':
+            column |= {
+                'min': _round(next(stats)),
+                'max': _round(next(stats)),
+                'mean': _round(next(stats)),
+                'stddev': _round(next(stats)),
+                'quantiles': _by_quantile(_round(each) for each in next(stats) or ()),
+            }
+        case 'time':
+            column |= {
+                'min': next(stats),
+                'max': next(stats),
+                'quantiles': _by_quantile(next(stats) or ()),
+            }
+        case 'text':
+            column |= {'length': {'min': next(stats), 'max': next(stats)}}
+    return column
+
+
+def _top_values(sql: str, relation: str, indexes: list[int]) -> str:
+    """
+    The most frequent values of several columns in one pass: every row unpivots into (column, value) pairs
+    that are counted together, then ranked per column.
+    """
+    values = ', '.join(f'({index}, left(c{index}::text, {_max_chars}))' for index in indexes)
+    return f"""
+        WITH q AS ({sql})
+        SELECT i, v, n FROM (
+            SELECT i, v, n, row_number() OVER (PARTITION BY i ORDER BY n DESC, v) AS r
+            FROM (
+                SELECT x.i, x.v, count(*) AS n
+                FROM {relation} CROSS JOIN LATERAL (VALUES {values}) AS x(i, v)
+                WHERE x.v IS NOT NULL
+                GROUP BY x.i, x.v
+            ) AS counted
+        ) AS ranked
+        WHERE r <= {_top:d}
+        ORDER BY i, r
+    """
+
+
+def _by_quantile(values) -> dict[str, Any]:
+    return {f'p{round(quantile * 100)}': value for quantile, value in zip(_quantiles, values)}
+
+
+def _round(value: float | None) -> float | int | None:
+    """
+    Six significant digits are plenty for a prompt; integral values lose their decimal point.
+    """
+    if value is None or value != value or value in (float('inf'), float('-inf')):
+        return None
+    rounded = float(f'{value:.6g}')
+    return int(rounded) if rounded.is_integer() and abs(rounded) < 1e15 else rounded
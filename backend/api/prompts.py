@@ -13,6 +13,32 @@ Retrieved Data:
 ```
 """)
 
+profiled_initial_prompt = dedent("""
+You are an expert data analyst. A user has executed an SQL query to retrieve a dataset and has asked an initial question to begin an analysis.
+
+The user's high-level goal is: "{prompt}"
+
+The dataset has {rows} rows. Rather than the rows themselves, you are given a profile of the whole dataset, computed by
+the database, and a random sample of its rows.
+
+For each column, the profile gives its kind, the fraction of nulls (`nulls`) and the number of distinct values. Numbers
+also come with their minimum, maximum, mean, standard deviation and quantiles (p5 to p95), times with their range and
+quantiles, and text with the range of its length. Columns whose values repeat list their most frequent values (`top`),
+with counts. Base your analysis on the profile, which covers every row; use the sample to illustrate what rows look
+like, not to draw conclusions about the whole dataset. Structure your response in clear, readable markdown that
+directly addresses the user's goal.
+
+Profile of the columns, one per line:
+```json
+{profile}
+```
+
+A random sample of {sampled} rows, one JSON array per line, with the columns {columns}:
+```
+{sample}
+```
+""")
+
 explain_db_prompt_template = dedent("""
 You are an expert data architect AI. Your task is to analyze a PostgreSQL database schema provided in JSON format and
 generate a helpful, easy-to-understand summary for a developer.
@@ -25,6 +51,13 @@ The schema for the database named '{database_name}' is as follows:
 {schema_json}
 ```
 
+Tables come with planner statistics: `estimatedRows`, `totalBytes` (also as a readable `size`) and their `indexes`.
+Columns come with `nullFraction` and `distinctValues`. All of them are estimates and may be missing for tables that
+have never been analyzed. Use them to tell small lookup tables from large fact tables, and to judge which columns are
+selective enough to filter on. Tables list their foreign keys under `references`.
+
+{scope}
+
 Based on this schema, please provide a comprehensive analysis. Your entire response MUST be in Markdown format with the
 following structure:
 
@@ -36,10 +69,51 @@ columns (e.g., "This appears to be a standard e-commerce backend...").
 
 ### Key Tables & Relationships
 Identify the 3-4 most important tables that seem central to the application's function. For each table, provide a bullet
-point describing its likely purpose. Speculate on the relationships between them (e.g., "The users table is likely
-linked to the orders table via orders.user_id).
+point describing its likely purpose. Describe the relationships between them from their foreign keys, and speculate
+where there are none (e.g., "The users table is likely linked to the orders table via orders.user_id).
+
+### Size & Cost
+Name the largest tables by estimated rows and size, and point out any large table that is missing an index on a column
+that is likely used for filtering or joining.
 
 ## Sample Queries
 Provide 3 to 5 useful and distinct sample queries that a user might want to run to explore the data. For each query,
 provide a one-sentence explanation of what it does. Each query must be formatted within its own ```sql code block.
+Keep every query cheap to run: filter and join on indexed columns, always bound the result with LIMIT, and never scan
+or aggregate a large table without a selective, indexed predicate. If a query is still likely to be expensive, say so
+in its explanation.
+""")
+
+profile_prompt_template = dedent("""
+You are an expert PostgreSQL performance engineer. A user wants to know why their query is slow. It was run with
+EXPLAIN (ANALYZE, BUFFERS) on the database named '{database_name}'.
+
+The query:
+
+```sql
+{query}
+```
+
+A summary of the plan's hotspots, with times in milliseconds totalled over all loops: the nodes that spent the most
+time on their own, the nodes whose row estimates were furthest off, and sequential scans over large tables:
+
+```json
+{hotspots_json}
+```
+
+The full plan:
+
+```json
+{plan_json}
+```
+
+Your entire response MUST be in Markdown format with the following structure:
+
+## Why It Is Slow
+Explain in a short paragraph where the time goes, referring to specific plan nodes and tables.
+
+## Recommendations
+A prioritized list of concrete fixes: indexes to add (as ```sql code blocks), query rewrites, or statistics to
+refresh (e.g. ANALYZE when estimates are far off). For each, say which hotspot it addresses and what to expect.
+Do not recommend anything the plan gives no evidence for.
 """)
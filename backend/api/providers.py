@@ -0,0 +1,279 @@
+import asyncio
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Iterator, Protocol
+
+Contents = list[dict[str, Any]]  # Gemini-style turns: {'role': ..., 'parts': [{'text': ...}]}
+
+
+class CacheExpired(Exception):
+    """
+    A request referred to cached context the provider no longer has.
+    """
+
+
+@dataclass
+class CachedContext:
+    """
+    Leading turns of a conversation stored with the provider, which later requests refer to
+    instead of sending them again.
+
+    :ivar name: The provider's handle.
+    :ivar model: Model the context was cached for; other models cannot use it.
+    :ivar expires: When the provider drops it, in seconds since the epoch.
+    :ivar turns: How many leading turns it holds.
+    :ivar lost: Set when a request found it gone before `expires`.
+    """
+    name: str
+    model: str
+    expires: float
+    turns: int
+    lost: bool = field(default=False, compare=False)
+
+    def usable(self, model: str, margin: float = 30) -> bool:
+        return not self.lost and self.model == model and self.expires - margin > time.time()
+
+
+@dataclass
+class Usage:
+    """
+    Tokens a response took, as reported by the provider.
+
+    :ivar prompt_tokens: Tokens of input, cached ones included.
+    :ivar completion_tokens: Tokens generated.
+    :ivar cached_tokens: Tokens of input read from cached context.
+    """
+    prompt_tokens: int = None
+    completion_tokens: int = None
+    cached_tokens: int = None
+
+
+class Provider(Protocol):
+    """
+    An LLM API. Every method sends a single request; timeouts, hedging and retries
+    are left to `llm.resilient`.
+
+    `cached` names a context created with `cache`, which the contents continue;
+    a provider raises `CacheExpired` if it no longer has it. `usage`, if given,
+    is filled in once the response has been received in full.
+    """
+
+    def generate(self, model: str, contents: Contents, cached: str = None, usage: Usage = None) -> str: ...
+
+    def stream(self, model: str, contents: Contents, cached: str = None, usage: Usage = None) -> Iterator[str]: ...
+
+    def astream(
+            self, model: str, contents: Contents, cached: str = None, usage: Usage = None,
+    ) -> AsyncIterator[str]: ...
+
+    def cache(self, model: str, contents: Contents, ttl: float) -> CachedContext | None:
+        """
+        Stores leading turns with the provider.
+
+        :return: The handle, or None if the provider does not cache context.
+        """
+
+
+class Gemini:
+    """
+    Google's Gemini API through google-genai. The client is created on first use,
+    so that importing this module needs no credentials.
+
+    :param base_url: Endpoint to use instead of Google's, e.g. backend/benchmarks/fake_llm.py.
+    """
+
+    def __init__(self, base_url: str = None):
+        self._base_url = base_url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google import genai
+            self._client = genai.Client(**({'http_options': {'base_url': self._base_url}} if self._base_url else {}))
+        return self._client
+
+    @staticmethod
+    def _config(cached: str | None) -> dict:
+        return {'config': {'cached_content': cached}} if cached else {}
+
+    @staticmethod
+    def _expired(error: Exception, cached: str | None) -> bool:
+        from google.genai import errors
+        return cached is not None and isinstance(error, errors.ClientError) and error.code in (400, 403, 404)
+
+    @staticmethod
+    def _count(response, usage: Usage | None) -> None:
+        if usage is not None and (metadata := getattr(response, 'usage_metadata', None)) is not None:
+            usage.prompt_tokens = metadata.prompt_token_count or usage.prompt_tokens
+            usage.completion_tokens = metadata.candidates_token_count or usage.completion_tokens
+            usage.cached_tokens = metadata.cached_content_token_count or usage.cached_tokens
+
+    def generate(self, model: str, contents: Contents, cached: str = None, usage: Usage = None) -> str:
+        try:
+            response = self.client.models.generate_content(model=model, contents=contents, **self._config(cached))
+        except Exception as e:
+            if self._expired(e, cached):
+                raise CacheExpired(cached) from e
+            raise
+        self._count(response, usage)
+        return response.text or ''
+
+    def stream(self, model: str, contents: Contents, cached: str = None, usage: Usage = None) -> Iterator[str]:
+        try:
+            chunks = iter(self.client.models.generate_content_stream(
+                model=model, contents=contents, **self._config(cached),
+            ))
+            first = next(chunks, None)
+        except Exception as e:
+            if self._expired(e, cached):
+                raise CacheExpired(cached) from e
+            raise
+        if first is not None:
+            self._count(first, usage)
+            yield first.text
+        for chunk in chunks:
+            self._count(chunk, usage)  # the last chunk has the totals
+            yield chunk.text
+
+    async def astream(
+            self, model: str, contents: Contents, cached: str = None, usage: Usage = None,
+    ) -> AsyncIterator[str]:
+        try:
+            chunks = await self.client.aio.models.generate_content_stream(
+                model=model, contents=contents, **self._config(cached),
+            )
+        except Exception as e:
+            if self._expired(e, cached):
+                raise CacheExpired(cached) from e
+            raise
+        async for chunk in chunks:
+            self._count(chunk, usage)
+            yield chunk.text
+
+    def cache(self, model: str, contents: Contents, ttl: float) -> CachedContext | None:
+        created = self.client.caches.create(model=model, config={'contents': contents, 'ttl': f'{int(ttl)}s'})
+        return CachedContext(name=created.name, model=model, expires=created.expire_time.timestamp(), turns=len(contents))
+
+
+_words = (
+    'rows grouped by month show steady growth with a dip in february while the largest customers '
+    'account for most of the revenue and the median order stays flat'
+).split()
+
+
+@dataclass
+class Fake:
+    """
+    Local stand-in answering with deterministic text at a set pace, for load tests and benchmarks.
+    The same prompt always gets the same answer.
+
+    Context caching is simulated: `cache` keeps the turns for `ttl` seconds, and `requests`,
+    when set to a list, records what every request sent, e.g. to check that cached turns are not resent.
+
+    :ivar ttft: Seconds before the first token.
+    :ivar tokens_per_second: Pace of the following tokens; 0 sends them as fast as they are consumed.
+    :ivar tokens: Tokens per answer.
+    :ivar requests: If a list, (kind, model, contents, cached) of every request is appended to it.
+
+    Usage counts four characters per input token.
+    """
+    ttft: float = .2
+    tokens_per_second: float = 50
+    tokens: int = 40
+    requests: list[tuple[str, str, Contents, str | None]] = None
+    _caches: dict[str, tuple[float, int]] = field(default_factory=dict, repr=False)  # name: expiry, tokens
+    _names: Iterator[int] = field(default_factory=itertools.count, repr=False)
+
+    @staticmethod
+    def _input_tokens(contents: Contents) -> int:
+        return sum(len(part.get('text') or '') for each in contents for part in each.get('parts', [])) // 4
+
+    def _receive(self, kind: str, model: str, contents: Contents, cached: str | None) -> int:
+        """
+        :return: Input tokens read from the cache.
+        """
+        if self.requests is not None:
+            self.requests.append((kind, model, contents, cached))
+        if cached is None:
+            return 0
+        expires, tokens = self._caches.get(cached, (0, 0))
+        if expires <= time.time():
+            raise CacheExpired(cached)
+        return tokens
+
+    def _count(self, usage: Usage | None, contents: Contents, cached_tokens: int) -> None:
+        if usage is not None:
+            usage.prompt_tokens = self._input_tokens(contents) + cached_tokens
+            usage.completion_tokens = self.tokens
+            usage.cached_tokens = cached_tokens
+
+    def _tokens(self, contents: Contents) -> list[str]:
+        prompt = ''.join(part.get('text') or '' for each in contents[-1:] for part in each.get('parts', []))
+        offset = sum(prompt.encode()) % len(_words)
+        return [f'{_words[(offset + i) % len(_words)]} ' for i in range(self.tokens)]
+
+    @property
+    def _gap(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+
+    def generate(self, model: str, contents: Contents, cached: str = None, usage: Usage = None) -> str:
+        cached_tokens = self._receive('generate', model, contents, cached)
+        time.sleep(self.ttft + self._gap * max(self.tokens - 1, 0))
+        self._count(usage, contents, cached_tokens)
+        return ''.join(self._tokens(contents))
+
+    def stream(self, model: str, contents: Contents, cached: str = None, usage: Usage = None) -> Iterator[str]:
+        cached_tokens = self._receive('stream', model, contents, cached)
+        time.sleep(self.ttft)
+        tokens = self._tokens(contents)
+        for index, token in enumerate(tokens):
+            if index and self._gap:
+                time.sleep(self._gap)
+            if index == len(tokens) - 1:
+                self._count(usage, contents, cached_tokens)
+            yield token
+
+    async def astream(
+            self, model: str, contents: Contents, cached: str = None, usage: Usage = None,
+    ) -> AsyncIterator[str]:
+        cached_tokens = self._receive('astream', model, contents, cached)
+        await asyncio.sleep(self.ttft)
+        tokens = self._tokens(contents)
+        for index, token in enumerate(tokens):
+            if index and self._gap:
+                await asyncio.sleep(self._gap)
+            if index == len(tokens) - 1:
+                self._count(usage, contents, cached_tokens)
+            yield token
+
+    def cache(self, model: str, contents: Contents, ttl: float) -> CachedContext | None:
+        if self.requests is not None:
+            self.requests.append(('cache', model, contents, None))
+        name = f'cachedContents/fake-{next(self._names)}'
+        self._caches[name] = time.time() + ttl, self._input_tokens(contents)
+        return CachedContext(name=name, model=model, expires=self._caches[name][0], turns=len(contents))
+
+    def expire(self) -> None:
+        """Drops every cached context, as the provider may do before they expire."""
+        self._caches.clear()
+
+
+def configured() -> Provider:
+    """
+    Provider selected with `LLM_PROVIDER`: 'gemini' (default) or 'fake', the latter paced by
+    `FAKE_LLM_TTFT`, `FAKE_LLM_TOKENS_PER_SECOND` and `FAKE_LLM_TOKENS`.
+    """
+    match os.environ.get('LLM_PROVIDER', 'gemini'):
+        case 'fake':
+            return Fake(
+                ttft=float(os.environ.get('FAKE_LLM_TTFT', Fake.ttft)),
+                tokens_per_second=float(os.environ.get('FAKE_LLM_TOKENS_PER_SECOND', Fake.tokens_per_second)),
+                tokens=int(os.environ.get('FAKE_LLM_TOKENS', Fake.tokens)),
+            )
+        case 'gemini':
+            return Gemini(base_url=os.environ.get('LLM_BASE_URL'))
+        case other:
+            raise ValueError(f'Unknown LLM_PROVIDER: {other}')
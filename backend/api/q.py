@@ -1,10 +1,8 @@
 inspect = """
 WITH 
   _databases AS (
-    SELECT datname AS database_name
-    FROM pg_database
-    WHERE NOT datistemplate
-      AND datname != 'rdsadmin' AND datname != 'qa' AND datname != 'pg_catalog'
+    -- catalogs below only describe the database connected to, see `databases` for the others
+    SELECT current_database() AS database_name
   ),
   _schemata AS (
     SELECT 
@@ -31,7 +29,9 @@ WITH
     table_schema,
     table_catalog AS database_name,
     table_name,
-    max(d.description) AS table_comment
+    max(d.description) AS table_comment,
+    CASE WHEN c.reltuples < 0 THEN NULL ELSE c.reltuples::BIGINT END AS estimated_rows,
+    pg_total_relation_size(c.oid) AS total_bytes
   FROM information_schema.tables t
   JOIN pg_class c 
     ON c.relname = table_name 
@@ -42,7 +42,63 @@ WITH
   LEFT JOIN pg_description d ON d.objoid = c.oid
   WHERE table_schema = ANY(SELECT schema_name FROM _schemata)
     AND table_type = 'BASE TABLE'
-  GROUP BY t.table_schema, t.table_catalog, t.table_name
+  GROUP BY t.table_schema, t.table_catalog, t.table_name, c.oid, c.reltuples
+)
+, _indexes AS (
+    SELECT
+        n.nspname AS table_schema,
+        t.relname AS table_name,
+        i.relname AS index_name,
+        pg_get_indexdef(i.oid) AS definition,
+        ix.indisunique AS is_unique,
+        ix.indisprimary AS is_primary,
+        pg_relation_size(i.oid) AS index_bytes,
+        (
+            SELECT array_agg(a.attname ORDER BY k.ordinality)
+            FROM unnest(ix.indkey) WITH ORDINALITY k(attnum, ordinality)
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+        ) AS index_columns
+    FROM pg_index ix
+    JOIN pg_class i ON i.oid = ix.indexrelid
+    JOIN pg_class t ON t.oid = ix.indrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    WHERE n.nspname = ANY(SELECT schema_name FROM _schemata)
+)
+, _references AS (
+    SELECT
+        n.nspname AS table_schema,
+        t.relname AS table_name,
+        c.conname AS constraint_name,
+        rn.nspname AS referenced_schema,
+        r.relname AS referenced_table,
+        (
+            SELECT array_agg(a.attname ORDER BY k.ordinality)
+            FROM unnest(c.conkey) WITH ORDINALITY k(attnum, ordinality)
+            JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.attnum
+        ) AS columns,
+        (
+            SELECT array_agg(a.attname ORDER BY k.ordinality)
+            FROM unnest(c.confkey) WITH ORDINALITY k(attnum, ordinality)
+            JOIN pg_attribute a ON a.attrelid = c.confrelid AND a.attnum = k.attnum
+        ) AS referenced_columns
+    FROM pg_constraint c
+    JOIN pg_class t ON t.oid = c.conrelid
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    JOIN pg_class r ON r.oid = c.confrelid
+    JOIN pg_namespace rn ON rn.oid = r.relnamespace
+    WHERE c.contype = 'f'
+      AND n.nspname = ANY(SELECT schema_name FROM _schemata)
+)
+, _stats AS (
+    SELECT DISTINCT ON (schemaname, tablename, attname)
+        schemaname AS table_schema,
+        tablename AS table_name,
+        attname AS column_name,
+        null_frac,
+        n_distinct
+    FROM pg_stats
+    WHERE schemaname = ANY(SELECT schema_name FROM _schemata)
+    ORDER BY schemaname, tablename, attname, inherited
 )
 , _columns AS (
     SELECT
@@ -62,7 +118,9 @@ WITH
                 FROM information_schema.table_constraints 
                 WHERE constraint_type = 'FOREIGN KEY'
             )
-        ) AS is_foreign_key
+        ) AS is_foreign_key,
+        st.null_frac,
+        st.n_distinct
     FROM information_schema.columns columns
     LEFT JOIN information_schema.key_column_usage kcu 
       ON columns.table_schema = kcu.table_schema
@@ -71,6 +129,10 @@ WITH
     LEFT JOIN information_schema.table_constraints tc 
       ON kcu.constraint_name = tc.constraint_name
      AND tc.constraint_type IN ('PRIMARY KEY', 'FOREIGN KEY')
+    LEFT JOIN _stats st
+      ON st.table_schema = columns.table_schema
+     AND st.table_name = columns.table_name
+     AND st.column_name = columns.column_name
 )
 , _triggers AS (
     SELECT
@@ -118,6 +180,38 @@ SELECT jsonb_agg(
                 'tableName', t.table_name,
                 'schema', t.table_schema,
                 'comment', t.table_comment,
+                'estimatedRows', t.estimated_rows,
+                'totalBytes', t.total_bytes,
+                'size', pg_size_pretty(t.total_bytes),
+                'indexes', (
+                  SELECT jsonb_agg(
+                    jsonb_build_object(
+                      'indexName', i.index_name,
+                      'columns', i.index_columns,
+                      'isUnique', i.is_unique,
+                      'isPrimary', i.is_primary,
+                      'bytes', i.index_bytes,
+                      'definition', i.definition
+                    )
+                  )
+                  FROM _indexes i
+                  WHERE i.table_schema = t.table_schema
+                    AND i.table_name = t.table_name
+                ),
+                'references', (
+                  SELECT jsonb_agg(
+                    jsonb_build_object(
+                      'constraintName', fk.constraint_name,
+                      'columns', fk.columns,
+                      'referencedSchema', fk.referenced_schema,
+                      'referencedTable', fk.referenced_table,
+                      'referencedColumns', fk.referenced_columns
+                    )
+                  )
+                  FROM _references fk
+                  WHERE fk.table_schema = t.table_schema
+                    AND fk.table_name = t.table_name
+                ),
                 'columns', (
                   SELECT jsonb_agg(
                     jsonb_build_object(
@@ -125,7 +219,12 @@ SELECT jsonb_agg(
                       'dataType', c.column_data_type,
                       'isPrimaryKey', c.is_primary_key,
                       'isForeignKey', c.is_foreign_key,
-                      'isNullable', c.is_nullable = 'YES'
+                      'isNullable', c.is_nullable = 'YES',
+                      'nullFraction', round(c.null_frac::NUMERIC, 4),
+                      'distinctValues', CASE
+                        WHEN c.n_distinct >= 0 THEN c.n_distinct::BIGINT
+                        ELSE round(-c.n_distinct * t.estimated_rows)::BIGINT
+                      END
                     )
                   )
                   FROM _columns c
@@ -205,3 +304,49 @@ WHERE n.nspname = %(schema)s
     AND p.proname = %(routine)s
 ; 
 """
+
+databases = """
+SELECT datname AS database_name
+FROM pg_database
+WHERE NOT datistemplate
+  AND datallowconn
+  AND datname != 'rdsadmin' AND datname != 'qa' AND datname != 'pg_catalog'
+  AND has_database_privilege(datname, 'CONNECT')
+ORDER BY datname = current_database() DESC, datname
+;
+"""
+
+schemata = """
+SELECT nspname AS schema_name
+FROM pg_namespace
+WHERE nspname NOT IN ('pg_catalog', 'information_schema', 'pg_toast')
+  AND nspname !~ '^pg_(toast_)?temp_'
+ORDER BY nspname
+;
+"""
+
+extensions = """
+SELECT
+    current_setting('server_version_num')::INT AS server_version,
+    coalesce(array_agg(extname) FILTER (WHERE extname IS NOT NULL), '{}') AS extensions
+FROM pg_extension
+;
+"""
+
+# pg_stat_statements before PostgreSQL 13 calls the timings total_time and mean_time
+statements = """
+SELECT
+    queryid::TEXT AS query_id,
+    query,
+    calls,
+    {total} AS total_ms,
+    {mean} AS mean_ms,
+    rows
+FROM pg_stat_statements
+WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+  AND query ~* '^\\s*(WITH|SELECT|UPDATE|DELETE)\\M'
+  AND query !~* 'pg_stat_statements|pg_catalog|information_schema'
+ORDER BY {total} DESC
+LIMIT %(limit)s
+;
+"""
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Self
+
+_budget = int(os.environ.get('EXPLAIN_TOKEN_BUDGET', 12_000))  # estimated tokens of schema in a prompt
+_top = int(os.environ.get('EXPLAIN_TOP_TABLES', 12))  # tables picked by relevance, before their neighbours
+
+_k1, _b = 1.2, .75  # BM25's usual term saturation and length normalization
+_name_weight = 3  # a table's own name counts this many times its column names
+_chars_per_token = 4
+
+_words = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+# words of questions that say nothing about which tables are meant, as `terms` gives them ('does' is 'doe')
+_ignored = frozenset({
+    'a', 'all', 'an', 'and', 'are', 'by', 'do', 'doe', 'each', 'for', 'from', 'how', 'in', 'is', 'me', 'my',
+    'of', 'on', 'or', 'per', 'show', 'the', 'their', 'to', 'what', 'which', 'who', 'with',
+})
+
+
+def terms(text: str | None) -> list[str]:
+    """
+    Lower-cased words of identifiers and prose: `order_items`, `OrderItems` and 'order items'
+    all give 'order' and 'item'. Plurals are folded crudely, which is all that names need.
+    """
+    return [_singular(word.lower()) for word in _words.findall(text or '')]
+
+
+def _singular(word: str) -> str:
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def _tables(inspection: dict | None) -> Iterator[tuple[str, str, dict]]:
+    """
+    Tables of a `q.inspect` document, with their database and their key, 'database.schema.table'.
+    """
+    match inspection:
+        case {'databases': list() as databases}:
+            for database in databases:
+                for schema in database.get('schemata') or []:
+                    for table in schema.get('tables') or []:
+                        name = database['databaseName']
+                        yield name, _key(name, table['schema'], table['tableName']), table
+
+
+def _key(database: str, schema: str, table: str) -> str:
+    return f'{database}.{schema}.{table}'
+
+
+def _fingerprint(serialized: str) -> str:
+    return hashlib.sha1(serialized.encode()).hexdigest()[:16]  # to tell versions of one table apart, not to sign
+
+
+@dataclass
+class Entry:
+    """
+    A table as indexed.
+
+    :ivar fingerprint: Hash of the table's inspection; an unchanged table keeps its entry.
+    :ivar tokens: Estimated prompt tokens of the table's inspection.
+    :ivar rows: Estimated rows, to rank tables when there is no question.
+    :ivar terms: Term frequencies over the table's name, comment and column names.
+    :ivar references: Keys of the tables it has foreign keys to.
+    """
+    fingerprint: str
+    tokens: int
+    rows: int
+    terms: dict[str, int]
+    references: list[str]
+
+    @classmethod
+    def of(cls, database: str, table: dict, serialized: str, fingerprint: str) -> Self:
+        counts: dict[str, int] = {}
+        words = [
+            *terms(table['tableName']) * _name_weight,
+            *terms(table['schema']),
+            *terms(table.get('comment')),
+            *(word for column in table.get('columns') or [] for word in terms(column['columnName'])),
+        ]
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        return cls(
+            fingerprint=fingerprint,
+            tokens=math.ceil(len(serialized) / _chars_per_token),
+            rows=table.get('estimatedRows') or 0,
+            terms=counts,
+            references=sorted({
+                _key(database, each['referencedSchema'], each['referencedTable'])
+                for each in table.get('references') or []
+            }),
+        )
+
+    @property
+    def length(self) -> int:
+        return sum(self.terms.values())
+
+
+@dataclass
+class Index:
+    """
+    A BM25 index over the tables of a connector's inspection, kept on the connector as `schema_index`
+    and brought up to date table by table: only tables whose inspection changed are indexed again.
+
+    :ivar inspection: ETag of the inspection the index was built from.
+    :ivar tables: Entries by 'database.schema.table'.
+    """
+    inspection: str = None
+    tables: dict[str, Entry] = field(default_factory=dict)
+
+    @classmethod
+    def from_json(cls, value: str | None) -> Self:
+        if not value:
+            return cls()
+        stored = json.loads(value)
+        return cls(
+            inspection=stored['inspection'],
+            tables={key: Entry(*entry) for key, entry in stored['tables'].items()},
+        )
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'inspection': self.inspection,
+            'tables': {
+                key: [entry.fingerprint, entry.tokens, entry.rows, entry.terms, entry.references]
+                for key, entry in self.tables.items()
+            },
+        })
+
+    def update(self, inspection: dict, etag: str) -> int:
+        """
+        Brings the index in line with an inspection: new and changed tables are indexed, dropped ones removed.
+
+        :param etag: The inspection's ETag, see `framework.etag_of`.
+        :return: The number of tables indexed.
+        """
+        tables, indexed = {}, 0
+        for database, key, table in _tables(inspection):
+            serialized = json.dumps(table)
+            fingerprint = _fingerprint(serialized)
+            entry = self.tables.get(key)
+            if entry is None or entry.fingerprint != fingerprint:
+                entry, indexed = Entry.of(database, table, serialized, fingerprint), indexed + 1
+            tables[key] = entry
+        self.tables, self.inspection = tables, etag
+        return indexed
+
+    def rank(self, question: str | None, within: set[str] = None) -> list[tuple[str, float]]:
+        """
+        Tables by BM25 score against the question, best first, leaving out those that match none
+        of its terms. Without a question, tables are ranked by how connected and how large they are.
+
+        :param within: Only rank these tables.
+        """
+        tables = {key: entry for key, entry in self.tables.items() if within is None or key in within}
+        if not tables:
+            return []
+        wanted = set(terms(question)) - _ignored
+        if not wanted:
+            links = {key: len(entry.references) for key, entry in tables.items()}
+            for entry in tables.values():
+                for each in entry.references:
+                    if each in links:
+                        links[each] += 1
+            return sorted(
+                ((key, float(links[key])) for key in tables),
+                key=lambda each: (-each[1], -tables[each[0]].rows, each[0]),
+            )
+
+        average = sum(entry.length for entry in tables.values()) / len(tables) or 1
+        frequency = {term: sum(term in entry.terms for entry in tables.values()) for term in wanted}
+        scores = []
+        for key, entry in tables.items():
+            score = 0.
+            for term in wanted:
+                if (count := entry.terms.get(term)) is None:
+                    continue
+                idf = math.log(1 + (len(tables) - frequency[term] + .5) / (frequency[term] + .5))
+                score += idf * count * (_k1 + 1) / (count + _k1 * (1 - _b + _b * entry.length / average))
+            if score > 0:
+                scores.append((key, score))
+        return sorted(scores, key=lambda each: (-each[1], each[0]))
+
+    def select(self, question: str | None, *, database: str = None, top: int = _top,
+               budget: int = _budget) -> list[str]:
+        """
+        The tables a prompt about `question` should describe: the `top` most relevant ones, each followed by
+        the tables it references or is referenced by, as long as they fit in `budget` estimated tokens.
+        Tables that do not fit are skipped, so a smaller one further down may still make it. If fewer than
+        `top` tables match the question, the most connected ones make up the difference.
+
+        :param database: Only select among the tables of this database.
+        :return: Keys of the selected tables, most relevant first.
+        """
+        tables = {
+            key: entry for key, entry in self.tables.items()
+            if database is None or key.startswith(f'{database}.')
+        }
+        referenced_by: dict[str, list[str]] = {}
+        for key, entry in tables.items():
+            for each in entry.references:
+                referenced_by.setdefault(each, []).append(key)
+
+        ranked = [key for key, _ in self.rank(question, within=set(tables))]
+        if len(ranked) < top:
+            matched = set(ranked)
+            ranked += [key for key, _ in self.rank(None, within=set(tables)) if key not in matched]
+
+        selected, spent = [], 0
+        for key in ranked[:top]:
+            for candidate in (key, *tables[key].references, *sorted(referenced_by.get(key, ()))):
+                entry = tables.get(candidate)
+                if entry is None or candidate in selected or spent + entry.tokens > budget:
+                    continue
+                selected.append(candidate)
+                spent += entry.tokens
+        return selected
+
+
+def prune(inspection: dict, selected: list[str]) -> dict[str, Any]:
+    """
+    The inspection with only the selected tables, in the same shape. Routines are left out,
+    as nothing ranks them.
+    """
+    keep = set(selected)
+    databases = []
+    for database in inspection.get('databases') or []:
+        schemata = []
+        for schema in database.get('schemata') or []:
+            tables = [
+                table for table in schema.get('tables') or []
+                if _key(database['databaseName'], table['schema'], table['tableName']) in keep
+            ]
+            if tables:
+                schemata.append({key: value for key, value in schema.items() if key != 'routines'} | {'tables': tables})
+        databases.append(database | {'schemata': schemata})
+    return {'databases': databases}
+
+
+def tokens(inspection: dict) -> int:
+    """
+    Estimated prompt tokens of a whole inspection.
+    """
+    return math.ceil(len(json.dumps(inspection)) / _chars_per_token)
+
+
+def scope(inspection: dict, index: Index, database: str, question: str = None, *,
+          budget: int = _budget) -> tuple[dict[str, Any], int, int]:
+    """
+    What a prompt gets of a database's schema: all of it if it fits in `budget` estimated tokens,
+    otherwise the tables `index` selects for the question, see `Index.select`.
+
+    :param inspection: A `q.inspect` document, possibly over several databases.
+    :param database: The database to describe.
+    :return: The inspection of that database, possibly pruned, with the number of tables it keeps and has.
+    """
+    own = {'databases': [each for each in inspection.get('databases') or [] if each['databaseName'] == database]}
+    total = sum(1 for _ in _tables(own))
+    if sum(entry.tokens for key, entry in index.tables.items() if key.startswith(f'{database}.')) <= budget:
+        return own, total, total
+    selected = index.select(question, database=database, budget=budget)
+    return prune(own, selected), len(selected), total
@@ -0,0 +1,207 @@
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator
+
+import llm
+from errors import IncorrectSignature
+from providers import CachedContext, Usage
+
+_lite_model = os.environ.get('LLM_LITE_MODEL', 'gemini-2.5-flash-lite')
+_pro_model = os.environ.get('LLM_PRO_MODEL', 'gemini-2.5-pro')
+
+
+@dataclass(frozen=True)
+class Request:
+    """
+    What a routing policy may look at.
+
+    :ivar route: 'chat' (first turn), 'message' (follow-up), 'explain' or 'profile'.
+    :ivar prompt_chars: Length of the new prompt, history excluded.
+    :ivar history_turns: Turns sent before the prompt.
+    :ivar tier: User tier the edge authorizer found in the user's token claims, if any.
+    """
+    route: str
+    prompt_chars: int
+    history_turns: int
+    tier: str = None
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    One entry of a routing policy; the first rule whose conditions all hold picks the models.
+    Unset conditions always hold.
+
+    :ivar models: Model to use, then fallbacks in order.
+    :ivar budget: Seconds every model but the last has to yield its first token before the next is tried;
+        unset, it gets `LLM_TTFT_DEADLINE` like any request.
+    """
+    models: tuple[str, ...]
+    routes: frozenset[str] = None
+    tiers: frozenset[str] = None
+    max_prompt_chars: int = None
+    max_history_turns: int = None
+    budget: float = None
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]) -> 'Rule':
+        return cls(
+            models=tuple(d['models']),
+            routes=frozenset(d['routes']) if d.get('routes') else None,
+            tiers=frozenset(d['tiers']) if d.get('tiers') else None,
+            max_prompt_chars=d.get('max_prompt_chars'),
+            max_history_turns=d.get('max_history_turns'),
+            budget=d.get('budget'),
+        )
+
+    def matches(self, request: Request) -> bool:
+        return (
+            (self.routes is None or request.route in self.routes)
+            and (self.tiers is None or request.tier in self.tiers)
+            and (self.max_prompt_chars is None or request.prompt_chars <= self.max_prompt_chars)
+            and (self.max_history_turns is None or request.history_turns <= self.max_history_turns)
+        )
+
+
+_defaults = [
+    Rule(models=(_pro_model, llm.default_model), routes=frozenset({'chat', 'message'}), tiers=frozenset({'pro'}),
+         budget=8),
+    # short follow-ups in short chats: the data is already in the history, a small model answers faster
+    Rule(models=(_lite_model, llm.default_model), routes=frozenset({'message'}), max_prompt_chars=500,
+         max_history_turns=8, budget=4),
+    Rule(models=(llm.default_model, _lite_model)),
+]
+
+
+def _configured() -> list[Rule]:
+    """
+    Policy from `LLM_ROUTING`, a JSON list of rules with snake_case keys, e.g.
+    `[{"routes": ["message"], "max_prompt_chars": 300, "models": ["gemini-2.5-flash-lite"]}]`.
+    Without it, short follow-ups go to `LLM_LITE_MODEL`, the 'pro' tier's chats to `LLM_PRO_MODEL`,
+    and the rest to `LLM_MODEL`, each falling back to another.
+    """
+    match os.environ.get('LLM_ROUTING'):
+        case None | '':
+            return _defaults
+        case raw:
+            return [Rule.from_dict(each) for each in json.loads(raw)]
+
+
+policy: list[Rule] = _configured()
+
+
+@dataclass
+class Choice:
+    """
+    Models picked for a request, in order of preference.
+
+    :ivar model: The model that answered, once one has.
+    """
+    models: tuple[str, ...]
+    budget: float = None
+    model: str = field(default=None, compare=False)
+
+    @property
+    def key(self) -> str:
+        """Identifies the choice in single-flight keys."""
+        return ','.join(self.models)
+
+
+def available(tier: str = None) -> list[str]:
+    """
+    Models a client may ask for by name: those of the rules of `policy` open to its tier.
+    """
+    return list(dict.fromkeys(
+        model
+        for rule in policy if rule.tiers is None or tier in rule.tiers
+        for model in rule.models
+    ))
+
+
+def check(model: str | None, tier: str = None) -> None:
+    """
+    :raises IncorrectSignature: If a model was asked for that is not `available` to the tier.
+    """
+    if model and model not in (models := available(tier)):
+        raise IncorrectSignature([f'model: one of {", ".join(models)}'])
+
+
+def choose(route: str, *, prompt: str, history: list | None = None, tier: str = None, model: str = None) -> Choice:
+    """
+    Picks models for a request from `policy`.
+
+    :param model: Model the client asked for; it is used as is, without fallback.
+    :raises IncorrectSignature: If the model is not `available` to the tier.
+    """
+    if model:
+        check(model, tier)
+        return Choice(models=(model,))
+    request = Request(route=route, prompt_chars=len(prompt), history_turns=len(history or []), tier=tier)
+    for rule in policy:
+        if rule.matches(request):
+            return Choice(models=tuple(dict.fromkeys(rule.models)), budget=rule.budget)
+    return Choice(models=(llm.default_model,))
+
+
+async def astream(
+        choice: Choice,
+        prompt: str,
+        *,
+        history: list[dict[str, Any]] = None,
+        context: CachedContext = None,
+        usage: Usage = None,
+) -> AsyncIterator[str]:
+    """
+    Streams from the first of the chosen models that yields within its budget, setting `choice.model`.
+    A model that fails or misses its budget is not retried; the next one is. Once tokens flow,
+    errors propagate as they are.
+
+    :param context: Cached leading turns of `history`, used by the model it was cached for.
+    :param usage: Filled in with the tokens the answering model's response took.
+    """
+    *fallible, last = choice.models
+    for model in fallible:
+        stream = llm.astream(
+            prompt, history=history, model=model, retries=0, context=context, usage=usage,
+            **({'deadline': choice.budget} if choice.budget else {}),
+        )
+        try:
+            first = await anext(stream, None)
+        except Exception as e:
+            print(f'{model} failed, falling back: {type(e).__name__}: {e}')
+            continue
+        choice.model = model
+        if first is not None:
+            yield first
+        async for text in stream:
+            yield text
+        return
+
+    choice.model = last
+    async for text in llm.astream(prompt, history=history, model=last, context=context, usage=usage):
+        yield text
+
+
+def call(
+        choice: Choice,
+        prompt: str,
+        *,
+        history: list[dict[str, Any]] = None,
+        context: CachedContext = None,
+        usage: Usage = None,
+) -> str:
+    """
+    Same as `astream`, for a whole response at once; only errors make it fall back.
+    """
+    *fallible, last = choice.models
+    for model in fallible:
+        try:
+            text = llm.call(prompt=prompt, history=history, model=model, retries=0, context=context, usage=usage)
+        except Exception as e:
+            print(f'{model} failed, falling back: {type(e).__name__}: {e}')
+            continue
+        choice.model = model
+        return text
+    choice.model = last
+    return llm.call(prompt=prompt, history=history, model=last, context=context, usage=usage)
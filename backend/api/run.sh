@@ -1,4 +1,6 @@
 #!/bin/sh
 set -e
 
-exec python -m uvicorn app:app --host 0.0.0.0 --port 8080
+# One process on Lambda, where each instance serves a request at a time. In containers and on
+# long-running hosts, WEB_CONCURRENCY sets the number of Uvicorn workers, e.g. one per core.
+exec python -m uvicorn app:app --host 0.0.0.0 --port "${PORT:-8080}" --workers "${WEB_CONCURRENCY:-1}"
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import os
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Protocol
+
+from errors import NotFound
+from signatures import Send
+from sse import send_event
+
+_ttl = int(os.environ.get('STREAM_BUFFER_TTL', 300))  # seconds a finished generation stays replayable
+
+
+@dataclass(frozen=True)
+class Event:
+    seq: int
+    event: str
+    data: Any = None
+
+
+@dataclass
+class Generation:
+    """
+    A single in-flight generation (one chat turn or one explanation) and every event
+    it has produced so far. The producer runs detached from any request, so a client
+    dropping its connection does not stop it; subscribers replay the buffer and then
+    follow it live.
+
+    :ivar key: Identifies the generation; prefixed by the chat or connector it belongs to.
+    :ivar events: Events in publication order, `seq` starts from 1.
+    :ivar done: Whether the producer has finished.
+    """
+    key: str
+    events: list[Event] = field(default_factory=list)
+    done: bool = False
+    closed_at: float = None
+    _changed: asyncio.Condition = field(default_factory=asyncio.Condition)
+
+    def event_id(self, seq: int) -> str:
+        return f'{self.key}:{seq}'
+
+    async def publish(self, event: str, data: Any = None) -> int:
+        async with self._changed:
+            seq = len(self.events) + 1
+            self.events.append(Event(seq, event, data))
+            self._changed.notify_all()
+            return seq
+
+    async def close(self) -> None:
+        async with self._changed:
+            self.done = True
+            self.closed_at = time.monotonic()
+            self._changed.notify_all()
+
+    async def follow(self, after: int = 0) -> AsyncIterator[Event]:
+        """
+        Yields every event past `after`, then waits for new ones until the producer is done.
+        """
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.done or len(self.events) > after)
+                pending, done = self.events[after:], self.done
+            for each in pending:
+                yield each
+            after += len(pending)
+            if done and after >= len(self.events):
+                return
+
+
+class Store(Protocol):
+    """
+    Where generations are kept. A deployment running several instances would back this
+    with a shared store (e.g. Redis streams) so a reconnect may land on any of them.
+    """
+
+    def open(self, key: str) -> Generation: ...
+
+    def get(self, key: str) -> Generation | None: ...
+
+
+class LocalStore:
+    """
+    In-process stand-in for a shared store. Finished generations are evicted
+    `_ttl` seconds after they close.
+    """
+
+    def __init__(self, ttl: int = _ttl):
+        self._ttl = ttl
+        self._generations: dict[str, Generation] = {}
+
+    def open(self, key: str) -> Generation:
+        self._evict()
+        generation = self._generations[key] = Generation(key)
+        return generation
+
+    def get(self, key: str) -> Generation | None:
+        self._evict()
+        return self._generations.get(key)
+
+    def _evict(self) -> None:
+        now = time.monotonic()
+        expired = [
+            key for key, each in self._generations.items()
+            if each.done and now - each.closed_at > self._ttl
+        ]
+        for key in expired:
+            del self._generations[key]
+
+
+_store: Store = LocalStore()
+_tasks: set[asyncio.Task] = set()  # strong references, so running producers are not garbage-collected
+_flights: dict[str, str] = {}  # flight key -> key of the generation serving it
+
+
+def launch(
+        key: str,
+        produce: Callable[[Generation], Awaitable[None]],
+        *,
+        flight: str = None,
+) -> Generation:
+    """
+    Starts a producer in the background and returns its generation right away.
+    An exception in the producer is published as an `error` event.
+
+    :param key: Generation key, see `Generation.key`.
+    :param produce: Coroutine function publishing events to the generation it is given.
+    :param flight: Single-flight key to release once the producer is done, see `single_flight`.
+    :return: The new generation.
+    """
+    generation = _store.open(key)
+
+    async def run() -> None:
+        try:
+            await produce(generation)
+        except Exception as e:
+            traceback.print_exc()
+            await generation.publish('error', {'message': str(e)})
+        finally:
+            await generation.close()
+            if flight and _flights.get(flight) == key:
+                del _flights[flight]
+
+    task = asyncio.create_task(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return generation
+
+
+def single_flight(
+        flight: str,
+        key: str,
+        produce: Callable[[Generation], Awaitable[None]],
+        *,
+        idempotent: bool = False,
+) -> Generation:
+    """
+    Shares one generation between identical concurrent requests: the first one
+    launches the producer, the rest subscribe to the same buffer from its start.
+
+    :param flight: What makes requests identical, e.g. a chat id and a hash of the message,
+        see `flight_key`.
+    :param key: Generation key used if a new producer is launched.
+    :param produce: Producer, as in `launch`.
+    :param idempotent: Whether `flight` comes from an explicit idempotency key.
+        Such flights keep answering with the same generation after it is done,
+        for as long as it is buffered; content-derived ones end with the generation,
+        so the same question asked again later gets a fresh answer.
+    :return: The generation serving the request.
+    """
+    for stale in [f for f, k in _flights.items() if _store.get(k) is None]:
+        del _flights[stale]
+
+    if (running := _flights.get(flight)) and (generation := _store.get(running)):
+        return generation
+
+    _flights[flight] = key
+    return launch(key, produce, flight=None if idempotent else flight)
+
+
+def flight_key(scope: str, content: str, idempotency_key: str = None) -> str:
+    """
+    :param scope: Chat or connector id.
+    :param content: What the generation is derived from, e.g. the message or the schema.
+    :param idempotency_key: Value of the `Idempotency-Key` request header; takes precedence over content.
+    :return: Single-flight key.
+    """
+    if idempotency_key:
+        return f'{scope}/key/{idempotency_key}'
+    return f'{scope}/sha/{hashlib.sha256(content.encode()).hexdigest()}'
+
+
+def resume(last_event_id: str | None, scope: str) -> tuple[Generation, int] | None:
+    """
+    Finds the generation a reconnecting client was following.
+
+    :param last_event_id: Value of the `Last-Event-ID` request header, if any.
+    :param scope: Chat or connector id the request is authorized for;
+        generations outside of it are treated as unknown.
+    :raises NotFound: If the client asks to resume a stream that is not (or no longer) buffered.
+    :return: The generation and the last sequence number the client has seen,
+        or None if this is not a reconnect.
+    """
+    if not last_event_id:
+        return None
+    key, _, seq = last_event_id.rpartition(':')
+    generation = _store.get(key) if key.startswith(f'{scope}.') else None
+    if generation is None or not seq.isdigit():
+        raise NotFound(f'stream {last_event_id}')
+    return generation, int(seq)
+
+
+async def relay(send: Send, generation: Generation, after: int = 0) -> None:
+    """
+    Sends the generation's events past `after` to one client, each tagged with its id.
+    """
+    async for each in generation.follow(after):
+        await send_event(send, event=each.event, data=each.data, id=generation.event_id(each.seq))
@@ -0,0 +1,147 @@
+"""
+`plans` over EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) output captured from Postgres 16, with parallel
+workers off and hash and merge joins disabled:
+
+- nested_loop: `plan_orders` joined to `plan_items` on an index, the inner scan looping 50 times;
+- misestimate: two correlated equality filters on `plan_orders` (200k rows), estimated at 1 row, 200 found;
+- large_seq_scan: a sequential scan of `plan_orders` stopped by a LIMIT after 100 rows.
+"""
+import json
+import os
+
+import pytest
+
+import plans
+
+_fixtures = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def _explained(name: str) -> list:
+    with open(os.path.join(_fixtures, f'{name}.json')) as f:
+        return json.load(f)
+
+
+def _nodes(name: str) -> dict[str, plans.Node]:
+    return {node.path: node for node in plans.nodes(plans.root_of(_explained(name))['Plan'])}
+
+
+def _inspection(rows: dict[str, int]) -> dict:
+    return {'databases': [
+        {
+            'databaseName': database,
+            'schemata': [{'schemaName': 'public', 'tables': [
+                {'schema': 'public', 'tableName': 'plan_orders', 'estimatedRows': count},
+            ]}],
+        }
+        for database, count in rows.items()
+    ]}
+
+
+def test_nodes_flattens_parents_first():
+    flat = list(plans.nodes(plans.root_of(_explained('nested_loop'))['Plan']))
+    assert [(node.path, node.node_type) for node in flat] == [
+        ('0', 'Aggregate'),
+        ('0.0', 'Nested Loop'),
+        ('0.0.0', 'Index Only Scan'),
+        ('0.0.1', 'Index Scan'),
+    ]
+    assert flat[2].relation == 'plan_orders'
+    assert flat[0].relation is None
+
+
+def test_nodes_total_over_loops():
+    plan = plans.root_of(_explained('nested_loop'))['Plan']
+    inner = plan['Plans'][0]['Plans'][1]
+    node = _nodes('nested_loop')['0.0.1']
+
+    assert node.loops == inner['Actual Loops'] == 50
+    assert node.total_ms == pytest.approx(inner['Actual Total Time'] * 50)
+    assert node.actual_rows == inner['Actual Rows'] * 50
+    assert node.estimated_rows == inner['Plan Rows'] * 50
+
+
+def test_nodes_self_time_subtracts_children_over_their_loops():
+    flat = _nodes('nested_loop')
+    join, outer, inner = flat['0.0'], flat['0.0.0'], flat['0.0.1']
+    assert join.self_ms == pytest.approx(max(join.total_ms - outer.total_ms - inner.total_ms, 0))
+    # the inner scan's 50 loops are counted in full, so the join keeps little of its own time
+    assert join.self_ms < inner.total_ms
+
+    root = flat['0']
+    assert root.self_ms == pytest.approx(root.total_ms - join.total_ms)
+
+
+def test_nodes_count_rows_removed_by_filter():
+    plan = plans.root_of(_explained('misestimate'))['Plan']
+    scan = _nodes('misestimate')['0.0']
+    assert scan.scanned_rows == plan['Plans'][0]['Actual Rows'] + plan['Plans'][0]['Rows Removed by Filter']
+    assert scan.scanned_rows == 200_000
+
+
+def test_misestimates():
+    result = plans.hotspots(_explained('misestimate'))
+    [worst] = result['misestimates']
+    assert worst['nodeType'] == 'Seq Scan'
+    assert worst['estimatedRows'] == 1
+    assert worst['actualRows'] == 200
+    assert worst['misestimate'] == 200.0
+
+    assert plans.hotspots(_explained('misestimate'), misestimate=1000)['misestimates'] == []
+    assert plans.hotspots(_explained('nested_loop'))['misestimates'] == []
+
+
+def test_slowest_by_self_time():
+    result = plans.hotspots(_explained('misestimate'), top=1)
+    assert [each['nodeType'] for each in result['slowest']] == ['Seq Scan']
+    assert result['planningMs'] == _explained('misestimate')[0]['Planning Time']
+    assert result['executionMs'] == _explained('misestimate')[0]['Execution Time']
+
+
+def test_large_seq_scans_by_rows_read():
+    [scan] = plans.hotspots(_explained('misestimate'))['largeSeqScans']
+    assert scan['relation'] == 'plan_orders'
+    assert scan['scannedRows'] == 200_000
+
+    assert plans.hotspots(_explained('misestimate'), large_scan=500_000)['largeSeqScans'] == []
+
+
+def test_large_seq_scans_by_table_rows():
+    # the LIMIT stops the scan after 100 rows; only the table's size gives it away
+    assert plans.hotspots(_explained('large_seq_scan'))['largeSeqScans'] == []
+
+    table_rows = plans.table_rows_of(_inspection({'main': 200_000}))
+    [scan] = plans.hotspots(_explained('large_seq_scan'), table_rows=table_rows)['largeSeqScans']
+    assert scan['relation'] == 'plan_orders'
+    assert scan['scannedRows'] == 100
+
+
+def test_table_rows_of():
+    inspection = _inspection({'main': 200_000, 'other': 10})
+    assert plans.table_rows_of(inspection, 'main') == {'public.plan_orders': 200_000, 'plan_orders': 200_000}
+    assert plans.table_rows_of(inspection, 'other') == {'public.plan_orders': 10, 'plan_orders': 10}
+    assert plans.table_rows_of(inspection, 'missing') == {}
+    assert plans.table_rows_of(None) == {}
+
+    table_rows = plans.table_rows_of(inspection, 'other')
+    assert plans.hotspots(_explained('large_seq_scan'), table_rows=table_rows)['largeSeqScans'] == []
+
+
+def test_root_of():
+    [root] = _explained('nested_loop')
+    assert plans.root_of([root]) is root
+    assert plans.root_of(root) is root
+
+
+@pytest.mark.parametrize('explained', [
+    None,
+    [],
+    [{}],
+    [{'Plan': {}}, {'Plan': {}}],
+    {'QUERY PLAN': []},
+    'Seq Scan on plan_orders',
+])
+def test_root_of_malformed(explained):
+    with pytest.raises(ValueError):
+        plans.root_of(explained)
+    with pytest.raises(ValueError):
+        plans.hotspots(explained)
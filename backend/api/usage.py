@@ -0,0 +1,113 @@
+import os
+from datetime import datetime, timezone
+
+from dynamo import db
+
+import persistence
+from errors import NotFound
+from models import Message, user_type, usage_type
+from persistence import Job
+from utils import snake_to_camel
+
+_table = os.environ['TABLE_NAME']
+_everything = 'ALL'  # in place of a connector id, the user's totals
+
+# summed per turn; `timed_turns` counts the turns whose time to the first token was measured
+_counters = ('turns', 'timed_turns', 'prompt_tokens', 'completion_tokens', 'cached_tokens', 'ttft_ms', 'duration_ms')
+
+
+def _month(moment: datetime = None) -> str:
+    return (moment or datetime.now(timezone.utc)).strftime('%Y-%m')
+
+
+def _key(user_id: str, month: str, connector_id: str) -> dict:
+    return {
+        'PK': {'S': f'{user_type}#{user_id}'},
+        'SK': {'S': f'{usage_type}#{month}#{connector_id}'},
+    }
+
+
+def _counts(message: Message) -> dict[str, int]:
+    return {
+        'turns': 1,
+        'timed_turns': int(message.ttft_ms is not None),
+        **{key: value for key, value in message.usage().items() if value},
+    }
+
+
+def record(user_id: str, connector_id: str, message: Message) -> None:
+    """
+    Adds a turn's tokens and timings to the month's counters of its user and of its connector,
+    two small items updated in place, so that `summary` reads them without touching any chat.
+    The writes go through `persistence`, after the response.
+    """
+    month = _month(message.id.datetime if message.id is not None else None)
+    counts = _counts(message)
+    for scope in (_everything, connector_id):
+        key = _key(user_id, month, scope)
+        persistence.submit(
+            Job(
+                description=f'count turn {message.id} in usage {key["SK"]["S"]}',
+                write=lambda key=key: _add(key, counts),
+                record={'op': 'add_usage', 'key': key, 'counts': counts},
+            )
+        )
+
+
+def _add(key: dict, counts: dict[str, int]) -> dict:
+    return db().update_item(
+        TableName=_table,
+        Key=key,
+        UpdateExpression='ADD ' + ', '.join(f'#{name} :{name}' for name in counts),
+        ExpressionAttributeNames={f'#{name}': name for name in counts},
+        ExpressionAttributeValues={f':{name}': {'N': f'{value}'} for name, value in counts.items()},
+    )
+
+
+def _summarize(item: dict) -> dict:
+    counts = {name: int(item.get(name, {}).get('N', 0)) for name in _counters}
+    turns, timed = counts.pop('turns'), counts.pop('timed_turns')
+    return {
+        'turns': turns,
+        **{snake_to_camel(name): value for name, value in counts.items()},
+        'averages': {
+            'promptTokens': round(counts['prompt_tokens'] / turns) if turns else None,
+            'completionTokens': round(counts['completion_tokens'] / turns) if turns else None,
+            'ttftMs': round(counts['ttft_ms'] / timed) if timed else None,
+            'durationMs': round(counts['duration_ms'] / turns) if turns else None,
+        },
+    }
+
+
+def summary(user_id: str, params: dict = None) -> dict:
+    """
+    The user's LLM usage over a month, in all and per connector, from the counters kept by `record`:
+    a single query over a handful of items, however many chats there are.
+
+    :param params: Query parameters, with an optional `month`, e.g. '2025-06'; the current month by default.
+    :raises NotFound: If `month` is not a month.
+    """
+    month = (params or {}).get('month') or _month()
+    try:
+        datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        raise NotFound(f'usage for {month}')
+
+    response = db().query(
+        TableName=_table,
+        KeyConditionExpression='#PK = :PK AND begins_with(#SK, :prefix)',
+        ExpressionAttributeNames={
+            '#PK': 'PK',
+            '#SK': 'SK',
+        },
+        ExpressionAttributeValues={
+            ':PK': {'S': f'{user_type}#{user_id}'},
+            ':prefix': {'S': f'{usage_type}#{month}#'},
+        },
+    )
+    items = {item['SK']['S'].split('#', 2)[2]: item for item in response.get('Items') or []}
+    return {
+        'month': month,
+        'total': _summarize(items.pop(_everything, {})),
+        'connectors': {connector_id: _summarize(item) for connector_id, item in items.items()},
+    }
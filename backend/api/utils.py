@@ -19,12 +19,21 @@ def dash_to_snake(s: str) -> str:
     return s.replace('-', '_')
 
 
+def is_true(value) -> bool:
+    """
+    Reads a boolean flag that may come from a JSON body or a query string.
+    """
+    return value in (True, 'true', 'True', '1', 1)
+
+
 def custom_serializer(obj):
     match obj:
         case datetime():
             return obj.isoformat()
-        case Decimal():
+        case Decimal() if obj == obj.to_integral_value():
             return int(obj)
+        case Decimal():
+            return float(obj)
         case _:
             raise TypeError(f"Type {type(obj)} not serializable")
 
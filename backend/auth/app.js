@@ -37,6 +37,9 @@ export const handler = async (event) => {
 
     const token = authz.slice(7);
 
+    // The tier picks the models a user may use, so only the token's claims may set it
+    delete req.headers["x-user-tier"];
+
     try {
         const {payload} = await jwtVerify(
             token,
@@ -57,6 +60,12 @@ export const handler = async (event) => {
             ];
         }
 
+        if (typeof payload.tier === "string" && payload.tier) {
+            req.headers["x-user-tier"] = [
+                {key: "x-user-tier", value: payload.tier},
+            ];
+        }
+
         return req;
     } catch (e) {
         console.log("JWT verify failed:", e);
@@ -0,0 +1,82 @@
+"""
+Time and memory to decode chats from DynamoDB items, as `chats.list_chats` and `models.with_chat` do:
+`--chats` chat items (default 1000) of `--messages` turns each (default 50) with a 250-row result.
+
+- from_item: the items turned into `Chat` objects, nothing else touched;
+- pending: the same, reading only `pending_turns`, as a glance at a chat's state would;
+- history: the history of the latest turn built for each chat, as a follow-up does;
+- to_dict: every chat rendered as `/chats` returns it.
+
+Memory is the peak allocated by Python while a stage runs, with all of its chats alive,
+measured in a second run.
+
+    python backend/benchmarks/chat_decoding.py --chats 1000 --messages 50
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+os.environ.setdefault('TABLE_NAME', 'benchmark')
+
+from dynamo import Ksuid  # noqa: E402
+from models import Chat, Message  # noqa: E402
+
+
+def _item(messages: int, rows: int) -> dict:
+    chat = Chat.from_dict({'query': 'SELECT * FROM orders', 'prompt': 'What stands out?'}, 'benchmark', 'connector')
+    chat.query_results = (
+        ['id', 'customer', 'amount', 'created'],
+        [[i, f'customer {i % 37}', round(i * 1.37, 2), f'2024-{i % 12 + 1:02}-01'] for i in range(rows)],
+    )
+    for turn in range(messages):
+        chat.add(Message(
+            message=f'Question {turn} about the orders?',
+            response=f'Answer {turn}: ' + 'the amounts grow month over month. ' * 12,
+            model='gemini-2.5-flash',
+            prompt_tokens=4000 + turn,
+            completion_tokens=120,
+            ttft_ms=400,
+            duration_ms=2400,
+        ))
+    return chat.to_item() | {'pending_turns': {'SS': [f'{Ksuid()}']}}
+
+
+def _run(items: list[dict], stage: Callable[[list[Chat]], object]) -> float:
+    gc.collect()
+    started = time.perf_counter()
+    stage([Chat.from_item(item) for item in items])
+    return time.perf_counter() - started
+
+
+def _measure(name: str, items: list[dict], stage: Callable[[list[Chat]], object]) -> None:
+    elapsed = _run(items, stage)
+    tracemalloc.start()  # a second run, as tracing slows allocations down
+    _run(items, stage)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:>10}: {elapsed * 1000:8.1f} ms | {elapsed / len(items) * 1e6:7.1f} µs per chat | peak {peak / 2 ** 20:7.1f} MB')
+
+
+def main(chats: int, messages: int, rows: int) -> None:
+    item = _item(messages, rows)
+    # items as a query returns them: separate dicts, with separate strings
+    items = [{key: dict(value) for key, value in item.items()} for _ in range(chats)]
+    print(f'{chats} chats of {messages} messages and {rows} rows')
+    _measure('from_item', items, lambda decoded: None)
+    _measure('pending', items, lambda decoded: [chat.pending_turns for chat in decoded])
+    _measure('history', items, lambda decoded: [chat.to_history() for chat in decoded])
+    _measure('to_dict', items, lambda decoded: [chat.to_dict() for chat in decoded])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--rows', type=int, default=250)
+    args = parser.parse_args()
+    main(args.chats, args.messages, args.rows)
@@ -0,0 +1,117 @@
+"""
+What a chat sends to the LLM over its follow-ups, with and without the first turn (instructions
+and data) cached as provider context. Runs `chats.start_chat` and `chats.add_message` against
+an in-memory DynamoDB, a synthetic query result and the fake provider, which records every request.
+
+- uncached: every follow-up resends the data;
+- cached: the data is sent once, to create the cache, and follow-ups refer to it;
+- expired: the provider drops the cache halfway; the next follow-up resends the data in full
+  and the one after caches it again.
+
+    python backend/benchmarks/context_cache.py --turns 10 --rows 250
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+os.environ.setdefault('TABLE_NAME', 'benchmark')
+os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+
+import chats  # noqa: E402
+import connectors  # noqa: E402
+import llm  # noqa: E402
+import models  # noqa: E402
+import persistence  # noqa: E402
+import providers  # noqa: E402
+import routing  # noqa: E402
+import usage  # noqa: E402
+from memory_dynamo import MemoryDynamo  # noqa: E402
+from models import Connector  # noqa: E402
+
+_user = 'benchmark-user'
+
+
+async def _ignore(_: dict) -> None:
+    pass
+
+
+async def _chat_id(connector_id: str) -> str:
+    chat_id = None
+
+    async def send(message: dict) -> None:
+        nonlocal chat_id
+        body = message.get('body') or b''
+        if chat_id is None and body.startswith(b'event: stored'):
+            chat_id = body.decode().split('"chat_id": "')[1].split('"')[0]
+
+    await chats.start_chat(connector_id, _user, send, {'query': 'SELECT 1', 'prompt': 'Summarize'}, stream=True)
+    await persistence.drain()
+    return chat_id
+
+
+def _sent(requests: list, prefix: str) -> tuple[int, int]:
+    """
+    :return: How many requests carried the prefix, and how many characters were sent in all.
+    """
+    texts = [
+        [part.get('text') or '' for turn in contents for part in turn['parts']]
+        for _, _, contents, _ in requests
+    ]
+    return sum(prefix in each for each in texts), sum(len(text) for each in texts for text in each)
+
+
+async def run(name: str, connector_id: str, turns: int, caching: bool, expire_at: int = None) -> None:
+    fake = providers.Fake(ttft=0, tokens_per_second=0, tokens=40, requests=[])
+    llm.use(fake)
+    chats._context_min_chars = 0 if caching else float('inf')
+
+    with contextlib.redirect_stdout(io.StringIO()):  # the app logs as it goes
+        chat_id = await _chat_id(connector_id)
+        fake.requests.clear()  # only follow-ups count
+        for turn in range(turns):
+            if turn == expire_at:
+                fake.expire()
+            await chats.add_message(chat_id, _user, _ignore, {'message': f'And what about item {turn}?'}, stream=True)
+            await persistence.drain()
+
+    chat = models._get_chat(chat_id, _user)
+    prefix = (await chats._history(chat))[0]['parts'][0]['text']
+    carrying, characters = _sent(fake.requests, prefix)
+    caches = sum(kind == 'cache' for kind, *_ in fake.requests)
+    print(
+        f'{name:>9}: {len(fake.requests):3} requests, {caches} cache creations, '
+        f'data sent {carrying:3} times, {characters:10,} characters in all'
+    )
+
+
+async def main(turns: int, rows: int) -> None:
+    store = MemoryDynamo()
+    models.db = chats.db = connectors.db = usage.db = lambda: store
+    result = ['id', 'customer', 'amount', 'created'], [
+        [i, f'customer {i % 37}', round(i * 1.37, 2), f'2024-{i % 12 + 1:02}-01'] for i in range(rows)
+    ]
+    chats._run_limited = lambda *_: result
+    chats._heartbeat = 60
+    routing.policy = [routing.Rule(models=(llm.default_model,))]  # caches are per model, so one model throughout
+
+    connector = Connector.from_dict(
+        {'host': 'localhost', 'port': 5432, 'user': 'postgres', 'password': '', 'database': 'postgres'}, _user,
+    )
+    store.put_item(TableName='benchmark', Item=connector.to_item())
+
+    print(f'{turns} follow-ups on a chat over {rows} rows')
+    await run('uncached', f'{connector.id}', turns, caching=False)
+    await run('cached', f'{connector.id}', turns, caching=True)
+    await run('expired', f'{connector.id}', turns, caching=True, expire_at=turns // 2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=10)
+    parser.add_argument('--rows', type=int, default=250)
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.rows))
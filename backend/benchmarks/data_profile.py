@@ -0,0 +1,79 @@
+"""
+What a chat's first prompt tells the model about its data: the first 250 rows of the query, as chats
+analyse by default, against a profile of the whole result computed in Postgres (`"profile": true`).
+For each, the time to gather the data and the size of the prompt, then per column the range the model
+gets to see either way.
+
+Postgres is a local server, seeded with load_test.py's `bench_orders` table of `--rows` rows.
+
+    python backend/benchmarks/data_profile.py --pg-host /var/run/postgresql --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+from contextlib import closing
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import load_test  # noqa: E402
+from load_test import Connector  # noqa: E402
+
+import cpu  # noqa: E402
+import profiling  # noqa: E402
+from db import connect  # noqa: E402
+from models import Chat  # noqa: E402
+from utils import run_query  # noqa: E402
+
+_prompt = 'How do order amounts evolve over the year?'
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - started
+
+
+def _range(values: list) -> str:
+    values = [each for each in values if each is not None]
+    return f'{min(values)} .. {max(values)}' if values else '-'
+
+
+def main(args: argparse.Namespace) -> None:
+    pg = {
+        'host': args.pg_host, 'port': args.pg_port, 'user': args.pg_user,
+        'password': args.pg_password, 'database': args.pg_database,
+    }
+    load_test.seed_postgres(pg, args.rows)
+    connector = Connector.from_dict(pg | {'name': 'profile'}, 'benchmark')
+    chat = Chat.from_dict({'query': args.query, 'prompt': _prompt}, 'benchmark', f'{connector.id}')
+
+    with closing(connect(connector)) as connection:
+        (columns, rows), limited = _timed(lambda: run_query(connection, chat.limited_query()))
+        connection.rollback()
+        data_profile, profiled = _timed(lambda: profiling.profile(connector, connection, chat.initial_query))
+
+    first_rows = cpu.initial_prompt(_prompt, (columns, rows))
+    whole = cpu.initial_prompt(_prompt, None, data_profile)
+    print(f'{args.query}: {data_profile["rows"]} rows')
+    print(f'first rows: {limited * 1000:8.1f} ms | prompt {len(first_rows):9,} characters | {len(rows)} rows seen')
+    print(f'   profile: {profiled * 1000:8.1f} ms | prompt {len(whole):9,} characters | {data_profile["rows"]} rows seen')
+    print()
+    print(f'{"column":>12}  {"first rows":>44}  {"profile":>44}')
+    for index, column in enumerate(data_profile['columns']):
+        if 'min' in column:
+            seen = _range([row[index] for row in rows])
+            whole_range = f'{column["min"]} .. {column["max"]}'
+            print(f'{column["name"]:>12}  {seen:>44}  {whole_range:>44}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--query', default='SELECT * FROM bench_orders ORDER BY id')
+    parser.add_argument('--pg-host', default=os.environ.get('PGHOST', 'localhost'))
+    parser.add_argument('--pg-port', type=int, default=int(os.environ.get('PGPORT', 5432)))
+    parser.add_argument('--pg-user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--pg-password', default=os.environ.get('PGPASSWORD', 'postgres'))
+    parser.add_argument('--pg-database', default=os.environ.get('PGDATABASE', 'postgres'))
+    main(parser.parse_args())
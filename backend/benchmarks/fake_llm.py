@@ -0,0 +1,122 @@
+"""
+Local stand-in for the Gemini API with injectable latency and failures.
+
+Serves `generateContent` and `streamGenerateContent` (SSE) for any model, so the API can be
+run against it by pointing the client at it:
+
+    python backend/benchmarks/fake_llm.py --port 8089 --ttft 0.3 --slow-rate 0.1 --slow-delay 5
+    LLM_BASE_URL=http://localhost:8089 GEMINI_API_KEY=fake ./run.sh
+
+Each request independently may fail (`--error-rate`, answered with a 503) or be slow
+(`--slow-rate`, the first chunk is held back by `--slow-delay` more seconds), which is
+what hedging and retries in backend/api/llm.py are meant to absorb.
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_words = (
+    'the query scans orders by customer and aggregates totals per month while the index on '
+    'created covers the range filter so the planner prefers a bitmap heap scan'
+).split()
+
+
+class Settings:
+    ttft = .3
+    tokens_per_second = 50.
+    tokens = 40
+    slow_rate = 0.
+    slow_delay = 5.
+    error_rate = 0.
+
+
+def _chunk(text: str, last: bool = False) -> dict:
+    candidate = {'content': {'role': 'model', 'parts': [{'text': text}]}, 'index': 0}
+    chunk = {'candidates': [candidate | ({'finishReason': 'STOP'} if last else {})], 'modelVersion': 'fake'}
+    if last:
+        chunk['usageMetadata'] = {
+            'promptTokenCount': 0,
+            'candidatesTokenCount': Settings.tokens,
+            'totalTokenCount': Settings.tokens,
+        }
+    return chunk
+
+
+def _tokens() -> list[str]:
+    return [f'{_words[i % len(_words)]} ' for i in range(Settings.tokens)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('content-length') or 0))
+        if random.random() < Settings.error_rate:
+            return self._json(503, {'error': {'code': 503, 'message': 'injected failure', 'status': 'UNAVAILABLE'}})
+
+        delay = Settings.ttft + (Settings.slow_delay if random.random() < Settings.slow_rate else 0)
+        time.sleep(delay)
+        if ':streamGenerateContent' in self.path:
+            return self._stream()
+        if ':generateContent' in self.path:
+            return self._json(200, _chunk(''.join(_tokens()), last=True))
+        return self._json(404, {'error': {'code': 404, 'message': self.path, 'status': 'NOT_FOUND'}})
+
+    def _json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', f'{len(payload)}')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self) -> None:
+        self.send_response(200)
+        self.send_header('content-type', 'text/event-stream')
+        self.send_header('transfer-encoding', 'chunked')
+        self.end_headers()
+        tokens = _tokens()
+        try:
+            for index, token in enumerate(tokens):
+                if index:
+                    time.sleep(1 / Settings.tokens_per_second)
+                self._write(f'data: {json.dumps(_chunk(token, last=index == len(tokens) - 1))}\r\n\r\n'.encode())
+            self._write(b'')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up on this request, e.g. a hedge that lost
+
+    def _write(self, data: bytes) -> None:
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--ttft', type=float, default=Settings.ttft, help='seconds before the first chunk')
+    parser.add_argument('--tokens-per-second', type=float, default=Settings.tokens_per_second)
+    parser.add_argument('--tokens', type=int, default=Settings.tokens, help='chunks per response')
+    parser.add_argument('--slow-rate', type=float, default=Settings.slow_rate, help='share of slow requests')
+    parser.add_argument('--slow-delay', type=float, default=Settings.slow_delay, help='extra seconds for slow ones')
+    parser.add_argument('--error-rate', type=float, default=Settings.error_rate, help='share of 503 answers')
+    args = parser.parse_args()
+
+    Settings.ttft = args.ttft
+    Settings.tokens_per_second = args.tokens_per_second
+    Settings.tokens = args.tokens
+    Settings.slow_rate = args.slow_rate
+    Settings.slow_delay = args.slow_delay
+    Settings.error_rate = args.error_rate
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), Handler)
+    print(f'Fake LLM on http://127.0.0.1:{args.port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
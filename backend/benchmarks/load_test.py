@@ -0,0 +1,393 @@
+"""
+End-to-end load test of the API, offline: DynamoDB is replaced with an in-process stand-in
+(benchmarks/memory_dynamo.py) or DynamoDB Local, the LLM with `providers.Fake`, and Postgres
+is a local server seeded with a synthetic `bench_orders` table.
+
+Requests go through the ASGI callable directly (`--mode asgi`), which measures the app alone,
+or through an in-process Uvicorn over loopback HTTP (`--mode uvicorn`), which adds the server.
+Each scenario runs `--requests` requests at `--concurrency` and reports requests per second,
+latency percentiles, time to the first streamed token and the peak RSS of the process:
+
+- connectors: `GET /connectors`;
+- query: `POST /connectors/{id}/query`, a point lookup on `bench_orders`;
+- chat: `POST /connectors/{id}/chats`, streamed;
+- message: `POST /chats/{id}/messages`, streamed, on chats opened beforehand;
+- mix: all of the above, weighted like a session of a few chats over a list of connectors.
+
+    python backend/benchmarks/load_test.py --scenario all --concurrency 16 --requests 400
+    python backend/benchmarks/load_test.py --mode uvicorn --scenario mix --pg-host /var/run/postgresql
+
+With `--dynamo local`, `AWS_ENDPOINT_URL_DYNAMODB` must point at DynamoDB Local; the table is
+created when missing.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+os.environ.setdefault('TABLE_NAME', 'load-test')
+os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+os.environ['LLM_PROVIDER'] = 'fake'
+
+import psycopg2  # noqa: E402
+
+import app as api  # noqa: E402
+import dynamo  # noqa: E402
+import llm  # noqa: E402
+import persistence  # noqa: E402
+import providers  # noqa: E402
+from memory_dynamo import MemoryDynamo  # noqa: E402
+from models import Connector  # noqa: E402
+
+_table = os.environ['TABLE_NAME']
+_mix = {'connectors': 4, 'query': 3, 'chat': 1, 'message': 2}
+
+
+@dataclass
+class Result:
+    status: int = 0
+    latency: float = 0
+    ttft: float | None = None
+    failed: bool = False
+    body: bytes = b''
+
+
+@dataclass
+class Report:
+    results: list[Result] = field(default_factory=list)
+    elapsed: float = 0
+    peak_rss_mb: float = 0
+
+    def print(self, name: str) -> None:
+        ok = [each for each in self.results if not each.failed]
+        refused = sum(each.status == 429 for each in self.results)  # admission control, see backend/api/admission.py
+        errors = len(self.results) - len(ok) - refused
+        latencies = sorted(each.latency * 1000 for each in ok) or [0]
+        ttfts = sorted(each.ttft * 1000 for each in ok if each.ttft is not None)
+        print(
+            f'{name:>10}: {len(self.results) / self.elapsed:8.1f} req/s | '
+            f'p50 {_percentile(latencies, 50):7.1f} p95 {_percentile(latencies, 95):7.1f} '
+            f'p99 {_percentile(latencies, 99):7.1f} ms | '
+            + (f'ttft p50 {_percentile(ttfts, 50):7.1f} p99 {_percentile(ttfts, 99):7.1f} ms | ' if ttfts else '')
+            + f'errors {errors} | 429 {refused} | peak rss {self.peak_rss_mb:6.1f} MB'
+        )
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0
+    return statistics.quantiles(values, n=100, method='inclusive')[min(int(p), 99) - 1]
+
+
+class Memory:
+    """Samples the resident set size while a scenario runs."""
+
+    def __init__(self, interval: float = .02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._page = os.sysconf('SC_PAGE_SIZE')
+
+    def _rss(self) -> int:
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * self._page
+        except OSError:  # not Linux: the process-wide high-water mark is the best there is
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss())
+
+    def __enter__(self) -> 'Memory':
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def _measure(started: float, result: Result, chunk: bytes) -> None:
+    result.body += chunk
+    if result.ttft is None and b'event: token' in chunk:
+        result.ttft = time.perf_counter() - started
+    if b'event: error' in chunk:
+        result.failed = True
+
+
+async def through_asgi(method: str, path: str, user: str, body: dict | None) -> Result:
+    payload = json.dumps(body).encode() if body is not None else b''
+    received = asyncio.Event()
+    result = Result()
+    started = time.perf_counter()
+
+    async def receive() -> dict:
+        if not received.is_set():
+            received.set()
+            return {'type': 'http.request', 'body': payload, 'more_body': False}
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message: dict) -> None:
+        match message:
+            case {'type': 'http.response.start', 'status': status}:
+                result.status = status
+            case {'type': 'http.response.body', 'body': chunk} if chunk:
+                _measure(started, result, chunk)
+
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': b'',
+        'headers': [(b'x-user-uid', user.encode()), (b'content-type', b'application/json')],
+    }
+    await api.app(scope, receive, send)
+    result.latency = time.perf_counter() - started
+    result.failed |= result.status >= 400
+    return result
+
+
+class Server:
+    """Uvicorn serving the app on an ephemeral port, with its own event loop on a thread."""
+
+    def __init__(self):
+        import uvicorn
+        self.server = uvicorn.Server(uvicorn.Config(api.app, host='127.0.0.1', port=0, log_level='warning'))
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=lambda: self.loop.run_until_complete(self.server.serve()), daemon=True)
+
+    def __enter__(self) -> 'Server':
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(.01)
+        [listener] = self.server.servers
+        self.port = listener.sockets[0].getsockname()[1]
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+    def run(self, coroutine: Awaitable) -> None:
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def request(self, method: str, path: str, user: str, body: dict | None) -> Result:
+        payload = json.dumps(body).encode() if body is not None else b''
+        result = Result()
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        try:
+            writer.write(
+                f'{method} {path} HTTP/1.1\r\nhost: localhost\r\nx-user-uid: {user}\r\n'
+                f'content-type: application/json\r\ncontent-length: {len(payload)}\r\nconnection: close\r\n\r\n'
+                .encode() + payload
+            )
+            await writer.drain()
+            result.status = int((await reader.readline()).split()[1])
+            while chunk := await reader.read(65536):
+                _measure(started, result, chunk)
+        finally:
+            writer.close()
+        result.latency = time.perf_counter() - started
+        result.failed |= result.status >= 400
+        return result
+
+
+Client = Callable[[str, str, str, dict | None], Awaitable[Result]]
+
+
+@dataclass
+class Fixture:
+    users: list[str]
+    connectors: dict[str, str]  # user -> connector id
+    chats: dict[str, list[str]] = field(default_factory=dict)  # user -> chat ids
+    rows: int = 0
+    counter: itertools.count = field(default_factory=itertools.count)
+
+    def request(self, scenario: str) -> tuple[str, str, str, dict | None]:
+        n = next(self.counter)
+        user = self.users[n % len(self.users)]
+        connector = self.connectors[user]
+        match scenario:
+            case 'connectors':
+                return 'GET', '/connectors', user, None
+            case 'query':
+                customer = random.randrange(max(self.rows // 50, 1))
+                sql = f'SELECT id, amount, created FROM bench_orders WHERE customer_id = {customer} ORDER BY id'
+                return 'POST', f'/connectors/{connector}/query', user, {'query': sql}
+            case 'chat':
+                # distinct prompts, so that concurrent requests are not collapsed into a single flight
+                return 'POST', f'/connectors/{connector}/chats', user, {
+                    'query': 'SELECT customer_id, sum(amount) FROM bench_orders GROUP BY 1 ORDER BY 2 DESC LIMIT 50',
+                    'prompt': f'Who are the largest customers? ({n})',
+                }
+            case 'message':
+                chat = random.choice(self.chats[user])
+                return 'POST', f'/chats/{chat}/messages', user, {'message': f'And by month? ({n})'}
+            case 'mix':
+                return self.request(random.choices(list(_mix), weights=list(_mix.values()))[0])
+        raise ValueError(scenario)
+
+
+def seed_postgres(pg: dict, rows: int) -> None:
+    with contextlib.closing(psycopg2.connect(**pg)) as connection, connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_tables WHERE tablename = 'bench_orders'")
+        if cursor.fetchone()[0]:
+            cursor.execute('SELECT count(*) FROM bench_orders')
+            if cursor.fetchone()[0] == rows:
+                return
+            cursor.execute('DROP TABLE bench_orders')
+        cursor.execute(
+            """
+            CREATE TABLE bench_orders AS
+            SELECT i AS id,
+                   i %% greatest(%(rows)s / 50, 1) AS customer_id,
+                   round((random() * 500)::numeric, 2) AS amount,
+                   timestamp '2024-01-01' + (i %% 365) * interval '1 day' AS created,
+                   md5(i::text) AS note
+            FROM generate_series(1, %(rows)s) AS i
+            """,
+            {'rows': rows},
+        )
+        cursor.execute('ALTER TABLE bench_orders ADD PRIMARY KEY (id)')
+        cursor.execute('CREATE INDEX ON bench_orders (customer_id)')
+        cursor.execute('ANALYZE bench_orders')
+        connection.commit()
+
+
+def install_dynamo(kind: str) -> None:
+    match kind:
+        case 'memory':
+            store = MemoryDynamo()
+            original = dynamo.db
+            # models, chats and connectors import `db` by name, as may dynamo-utils' own modules
+            for module in list(sys.modules.values()):
+                if getattr(module, 'db', None) is original:
+                    module.db = lambda: store
+        case 'local':
+            if not os.environ.get('AWS_ENDPOINT_URL_DYNAMODB'):
+                raise SystemExit('--dynamo local needs AWS_ENDPOINT_URL_DYNAMODB, e.g. http://localhost:8000')
+            client = dynamo.db()
+            if _table not in client.list_tables()['TableNames']:
+                client.create_table(
+                    TableName=_table,
+                    KeySchema=[{'AttributeName': 'PK', 'KeyType': 'HASH'}, {'AttributeName': 'SK', 'KeyType': 'RANGE'}],
+                    AttributeDefinitions=[
+                        {'AttributeName': 'PK', 'AttributeType': 'S'},
+                        {'AttributeName': 'SK', 'AttributeType': 'S'},
+                    ],
+                    BillingMode='PAY_PER_REQUEST',
+                )
+
+
+async def seed(client: Client, pg: dict, users: int, chats: int, rows: int) -> Fixture:
+    fixture = Fixture(users=[f'load-{i}' for i in range(users)], connectors={}, rows=rows)
+    for user in fixture.users:
+        connector = Connector.from_dict(pg | {'name': 'load test'}, user)
+        dynamo.db().put_item(TableName=_table, Item=connector.to_item())
+        fixture.connectors[user] = f'{connector.id}'
+
+    async def open_chat(user: str) -> str:
+        method, path, _, body = fixture.request('chat')
+        result = await client(method, f'/connectors/{fixture.connectors[user]}/chats', user, body)
+        for line in result.body.decode().splitlines():
+            if line.startswith('data: ') and 'chat' in line:
+                data = json.loads(line.removeprefix('data: '))
+                if isinstance(data, dict) and (chat := data.get('chat_id') or data.get('chatId')):
+                    return chat
+        raise RuntimeError(f'No chat opened: {result.status} {result.body[:200]!r}')
+
+    for user in fixture.users:
+        fixture.chats[user] = list(await asyncio.gather(*(open_chat(user) for _ in range(chats))))
+    return fixture
+
+
+async def scenario(client: Client, fixture: Fixture, name: str, concurrency: int, requests: int) -> Report:
+    report = Report()
+    remaining = iter(range(requests))
+
+    async def worker() -> None:
+        for _ in remaining:
+            report.results.append(await client(*fixture.request(name)))
+
+    with Memory() as memory:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        report.elapsed = time.perf_counter() - started
+    report.peak_rss_mb = memory.peak / 2 ** 20
+    return report
+
+
+async def main(args: argparse.Namespace) -> None:
+    pg = {
+        'host': args.pg_host,
+        'port': args.pg_port,
+        'user': args.pg_user,
+        'password': args.pg_password,
+        'database': args.pg_database,
+    }
+    seed_postgres(pg, args.rows)
+    install_dynamo(args.dynamo)
+    llm.use(providers.Fake(ttft=args.ttft, tokens_per_second=args.tokens_per_second, tokens=args.tokens))
+
+    scenarios = ['connectors', 'query', 'chat', 'message', 'mix'] if args.scenario == 'all' else [args.scenario]
+    print(
+        f'{args.mode}, {args.dynamo} DynamoDB, {args.rows:,} rows, {args.users} users, '
+        f'concurrency {args.concurrency}, {args.requests} requests per scenario'
+    )
+    with contextlib.ExitStack() as stack:
+        devnull = stack.enter_context(open(os.devnull, 'w'))
+        quiet = lambda: contextlib.redirect_stdout(devnull)  # noqa: E731, the app logs every request
+        if args.mode == 'uvicorn':
+            with quiet():
+                server = stack.enter_context(Server())
+            client, drain = server.request, lambda: server.run(persistence.drain())
+        else:
+            client, drain = through_asgi, None
+
+        with quiet():
+            fixture = await seed(client, pg, args.users, args.chats, args.rows)
+        for name in scenarios:
+            with quiet():
+                report = await scenario(client, fixture, name, args.concurrency, args.requests)
+                if drain:
+                    await asyncio.to_thread(drain)
+                else:
+                    await persistence.drain()
+            report.print(name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['asgi', 'uvicorn'], default='asgi')
+    parser.add_argument('--scenario', choices=['connectors', 'query', 'chat', 'message', 'mix', 'all'], default='all')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=400, help='per scenario')
+    parser.add_argument('--users', type=int, default=4)
+    parser.add_argument('--chats', type=int, default=2, help='opened per user for the message scenario')
+    parser.add_argument('--dynamo', choices=['memory', 'local'], default='memory')
+    parser.add_argument('--rows', type=int, default=100_000, help='rows in bench_orders')
+    parser.add_argument('--pg-host', default=os.environ.get('PGHOST', 'localhost'))
+    parser.add_argument('--pg-port', type=int, default=int(os.environ.get('PGPORT', 5432)))
+    parser.add_argument('--pg-user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--pg-password', default=os.environ.get('PGPASSWORD', 'postgres'))
+    parser.add_argument('--pg-database', default=os.environ.get('PGDATABASE', 'postgres'))
+    parser.add_argument('--ttft', type=float, default=.3, help='fake LLM seconds to the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--tokens', type=int, default=40)
+    asyncio.run(main(parser.parse_args()))
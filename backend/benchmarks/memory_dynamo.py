@@ -0,0 +1,211 @@
+"""
+In-process stand-in for the DynamoDB client, for load tests that should not depend on a
+DynamoDB endpoint. It understands the subset of the API and expression language the API uses:
+get, put, delete, update (SET with `list_append` / `if_not_exists` / `+` / `-`, ADD, DELETE, REMOVE),
+query on the primary key with `begins_with`, equality filters and key projections, batch writes,
+and `attribute_exists` / `attribute_not_exists` conditions joined with AND.
+
+`unprocessed` is the share of batch writes it leaves in `UnprocessedItems`, as DynamoDB
+does when throttled.
+
+It is not a DynamoDB emulator: there are no capacity limits, no item size limits and no
+secondary indexes, and calls do not block like network requests do. Use DynamoDB Local
+(`AWS_ENDPOINT_URL_DYNAMODB`) where that matters.
+"""
+import copy
+import random
+import re
+import threading
+from decimal import Decimal
+from typing import Any
+
+_clause = re.compile(r'\b(SET|ADD|DELETE|REMOVE)\b')
+
+
+class ConditionalCheckFailed(Exception):
+    def __init__(self):
+        super().__init__('The conditional request failed')
+        self.response = {'Error': {'Code': 'ConditionalCheckFailedException'}}
+
+
+class MemoryDynamo:
+    def __init__(self, unprocessed: float = 0):
+        self._items: dict[tuple[str, str], dict] = {}
+        self._lock = threading.Lock()
+        self.unprocessed = unprocessed
+
+    @staticmethod
+    def _key(key: dict) -> tuple[str, str]:
+        return key['PK']['S'], key['SK']['S']
+
+    def get_item(self, *, Key: dict, **_) -> dict:
+        with self._lock:
+            item = self._items.get(self._key(Key))
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, *, Item: dict, ConditionExpression: str = None, ExpressionAttributeNames: dict = None, **_):
+        with self._lock:
+            key = self._key(Item)
+            _check(self._items.get(key), ConditionExpression, ExpressionAttributeNames)
+            self._items[key] = copy.deepcopy(Item)
+        return {}
+
+    def delete_item(self, *, Key: dict, **_) -> dict:
+        with self._lock:
+            self._items.pop(self._key(Key), None)
+        return {}
+
+    def batch_get_item(self, *, RequestItems: dict, **_) -> dict:
+        responses: dict[str, list] = {}
+        with self._lock:
+            for table, request in RequestItems.items():
+                if len(request['Keys']) > 100:
+                    raise ValueError('Too many items requested for the BatchGetItem call')
+                found = [self._items.get(self._key(key)) for key in request['Keys']]
+                responses[table] = [copy.deepcopy(item) for item in found if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, *, RequestItems: dict, **_) -> dict:
+        unprocessed: dict[str, list] = {}
+        with self._lock:
+            for table, requests in RequestItems.items():
+                if len(requests) > 25:
+                    raise ValueError('Too many items requested for the BatchWriteItem call')
+                for request in requests:
+                    if random.random() < self.unprocessed:
+                        unprocessed.setdefault(table, []).append(request)
+                        continue
+                    match request:
+                        case {'PutRequest': {'Item': item}}:
+                            self._items[self._key(item)] = copy.deepcopy(item)
+                        case {'DeleteRequest': {'Key': key}}:
+                            self._items.pop(self._key(key), None)
+        return {'UnprocessedItems': unprocessed}
+
+    def update_item(
+            self,
+            *,
+            Key: dict,
+            UpdateExpression: str,
+            ExpressionAttributeNames: dict = None,
+            ExpressionAttributeValues: dict = None,
+            ConditionExpression: str = None,
+            **_,
+    ) -> dict:
+        names, values = ExpressionAttributeNames or {}, ExpressionAttributeValues or {}
+        with self._lock:
+            key = self._key(Key)
+            current = self._items.get(key)
+            _check(current, ConditionExpression, names, values)
+            item = copy.deepcopy(current) if current is not None else copy.deepcopy(Key)
+            parts = _clause.split(UpdateExpression)
+            for verb, actions in zip(parts[1::2], parts[2::2]):
+                for action in _split(actions):
+                    _apply(item, verb, action, names, values)
+            self._items[key] = item
+        return {'Attributes': copy.deepcopy(item)}
+
+    def query(
+            self,
+            *,
+            KeyConditionExpression: str,
+            ExpressionAttributeNames: dict = None,
+            ExpressionAttributeValues: dict = None,
+            FilterExpression: str = None,
+            ProjectionExpression: str = None,
+            **_,
+    ) -> dict:
+        names, values = ExpressionAttributeNames or {}, ExpressionAttributeValues or {}
+        pk = next(values[name]['S'] for name in re.findall(r'=\s*(:\w+)', KeyConditionExpression))
+        prefix = re.search(r'begins_with\(\s*[#\w]+\s*,\s*(:\w+)\s*\)', KeyConditionExpression)
+        start = values[prefix.group(1)]['S'] if prefix else ''
+        filters = [
+            (_name(attribute, names), values[value])
+            for attribute, value in re.findall(r'([#\w]+)\s*=\s*(:\w+)', FilterExpression or '')
+        ]
+        with self._lock:
+            items = [
+                copy.deepcopy(item) for (p, s), item in sorted(self._items.items())
+                if p == pk and s.startswith(start) and all(item.get(k) == v for k, v in filters)
+            ]
+        if ProjectionExpression:
+            projected = [_name(each, names) for each in ProjectionExpression.split(',')]
+            items = [{k: item[k] for k in projected if k in item} for item in items]
+        return {'Items': items, 'Count': len(items)}
+
+
+def _name(path: str, names: dict) -> str:
+    return names.get(path.strip(), path.strip())
+
+
+def _check(item: dict | None, condition: str | None, names: dict | None, values: dict = None) -> None:
+    if not condition:
+        return
+    for term in re.split(r'\s+AND\s+', condition.strip()):
+        if found := re.fullmatch(r'(attribute_exists|attribute_not_exists)\(\s*([#\w]+)\s*\)', term.strip()):
+            exists = item is not None and _name(found.group(2), names or {}) in item
+            holds = exists == (found.group(1) == 'attribute_exists')
+        elif found := re.fullmatch(r'([#\w]+)\s*=\s*(:\w+)', term.strip()):
+            holds = item is not None and item.get(_name(found.group(1), names or {})) == (values or {})[found.group(2)]
+        else:
+            raise NotImplementedError(f'Condition not supported: {term}')
+        if not holds:
+            raise ConditionalCheckFailed
+
+
+def _split(actions: str) -> list[str]:
+    parts, depth, current = [], 0, ''
+    for char in actions:
+        depth += (char == '(') - (char == ')')
+        if char == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    return [each.strip() for each in [*parts, current] if each.strip()]
+
+
+def _number(value: dict) -> Decimal:
+    return Decimal(value['N'])
+
+
+def _value(item: dict, operand: str, names: dict, values: dict) -> Any:
+    operand = operand.strip()
+    if match := re.fullmatch(r'list_append\((.*)\)', operand):
+        first, second = _split(match.group(1))
+        return {'L': _value(item, first, names, values)['L'] + _value(item, second, names, values)['L']}
+    if match := re.fullmatch(r'if_not_exists\((.*)\)', operand):
+        path, fallback = _split(match.group(1))
+        return item.get(_name(path, names)) or _value(item, fallback, names, values)
+    if match := re.fullmatch(r'(.+?)\s*([+-])\s*(.+)', operand):
+        left, right = _value(item, match.group(1), names, values), _value(item, match.group(3), names, values)
+        result = _number(left) + _number(right) if match.group(2) == '+' else _number(left) - _number(right)
+        return {'N': f'{result}'}
+    if operand.startswith(':'):
+        return copy.deepcopy(values[operand])
+    return item.get(_name(operand, names))
+
+
+def _apply(item: dict, verb: str, action: str, names: dict, values: dict) -> None:
+    match verb:
+        case 'SET':
+            path, _, operand = action.partition('=')
+            item[_name(path, names)] = _value(item, operand, names, values)
+        case 'REMOVE':
+            item.pop(_name(action, names), None)
+        case 'ADD' | 'DELETE':
+            path, operand = action.split(None, 1)
+            attribute, given = _name(path, names), values[operand.strip()]
+            current = item.get(attribute)
+            match given:
+                case {'N': _} if verb == 'ADD':
+                    item[attribute] = {'N': f'{_number(current or {"N": "0"}) + _number(given)}'}
+                case {'SS': members}:
+                    existing = set((current or {}).get('SS', []))
+                    updated = existing | set(members) if verb == 'ADD' else existing - set(members)
+                    if updated:
+                        item[attribute] = {'SS': sorted(updated)}
+                    else:
+                        item.pop(attribute, None)
+                case _:
+                    raise NotImplementedError(f'{verb} not supported for {given}')
@@ -0,0 +1,87 @@
+"""
+Encode size and time of a query result as JSON (what `connectors.query` returns)
+versus Arrow IPC stream and Parquet (what `columnar.respond` streams).
+
+The rows are synthetic and shaped like psycopg2 output, so no database is needed.
+
+    python backend/benchmarks/result_formats.py --rows 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import columnar  # noqa: E402
+from utils import custom_serializer  # noqa: E402
+
+Column = namedtuple('Column', 'name type_code display_size internal_size precision scale null_ok')
+
+description = [
+    Column('id', 20, None, 8, None, None, None),
+    Column('customer', 25, None, None, None, None, None),
+    Column('amount', 1700, None, None, 12, 2, None),
+    Column('ratio', 701, None, 8, None, None, None),
+    Column('paid', 16, None, 1, None, None, None),
+    Column('created', 1184, None, 8, None, None, None),
+]
+
+
+def synthetic(count: int) -> list[tuple]:
+    start = datetime(2024, 1, 1)
+    return [
+        (
+            i,
+            f'customer-{i % 5000:05d}',
+            Decimal(i % 100_000) / 100,
+            (i % 997) / 997,
+            i % 3 == 0,
+            start + timedelta(seconds=i * 37),
+        )
+        for i in range(count)
+    ]
+
+
+def as_json(rows: list[tuple]) -> bytes:
+    columns = [each.name for each in description]
+    body = {
+        'query': '...',
+        'columns': columns,
+        'rows': [dict(zip(columns, row)) for row in rows],
+    }
+    return json.dumps(body, default=custom_serializer).encode()
+
+
+def as_columnar(rows: list[tuple], media_type: str) -> bytes:
+    batches = (rows[i:i + columnar._batch] for i in range(0, len(rows), columnar._batch))
+    return b''.join(columnar.encode(description, batches, media_type))
+
+
+def measure(name: str, encode, repeat: int) -> None:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = encode()
+        timings.append(time.perf_counter() - started)
+    print(f'{name:>8}: {min(timings) * 1000:8.1f} ms, {len(payload) / 1024 / 1024:8.2f} MiB')
+
+
+def main(count: int, repeat: int) -> None:
+    rows = synthetic(count)
+    print(f'{count} rows, best of {repeat}')
+    measure('json', lambda: as_json(rows), repeat)
+    measure('arrow', lambda: as_columnar(rows, columnar.arrow_stream), repeat)
+    measure('parquet', lambda: as_columnar(rows, columnar.parquet), repeat)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.rows, args.repeat)
@@ -0,0 +1,163 @@
+"""
+Throughput of large query responses as the API gets more cores: Uvicorn with `--workers`
+processes (`WEB_CONCURRENCY` in run.sh), with and without the process pool for CPU-heavy
+steps (`CPU_WORKERS`). Every request is `POST /connectors/{id}/query` returning `--rows`
+rows of the seeded `bench_orders` table, so most of the time goes to building and encoding
+the result, which a single process does under one GIL.
+
+Each configuration runs as a separate `uvicorn` command serving this module; every worker
+imports it, installs the in-memory DynamoDB of benchmarks/memory_dynamo.py and seeds the
+same connector. Postgres is a local server, as in load_test.py.
+
+    python backend/benchmarks/scaling.py --pg-host /var/run/postgresql --workers 1 2 4 --cpu-workers 0 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import load_test  # noqa: E402
+from load_test import Result, _measure, _percentile  # noqa: E402
+
+_connector = os.environ.get('SCALING_CONNECTOR')
+_user = 'scaling'
+
+if _connector:  # imported by a Uvicorn worker
+    load_test.install_dynamo('memory')
+    connector = load_test.Connector.from_dict(json.loads(os.environ['SCALING_PG']) | {'name': 'scaling'}, _user)
+    connector.id = _connector
+    load_test.dynamo.db().put_item(TableName=load_test._table, Item=connector.to_item())
+    app = load_test.api.app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _serve(workers: int, cpu_workers: int, connector_id: str, pg: dict) -> tuple[subprocess.Popen, int]:
+    port = _free_port()
+    env = os.environ | {
+        'SCALING_CONNECTOR': connector_id,
+        'SCALING_PG': json.dumps(pg),
+        'CPU_WORKERS': f'{cpu_workers}',
+        # measure the serving path, not admission control
+        'ADMISSION_DB_RATE': '0',
+        'ADMISSION_DB_USER_CONCURRENCY': '0',
+        'ADMISSION_DB_GLOBAL_CONCURRENCY': '0',
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable, '-m', 'uvicorn', 'scaling:app', '--app-dir', os.path.dirname(os.path.abspath(__file__)),
+            '--host', '127.0.0.1', '--port', f'{port}', '--workers', f'{workers}', '--log-level', 'warning',
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,  # the app prints every request
+    )
+    return server, port
+
+
+async def _request(port: int, path: str, body: dict) -> Result:
+    payload = json.dumps(body).encode()
+    result = Result()
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(
+            f'POST {path} HTTP/1.1\r\nhost: localhost\r\nx-user-uid: {_user}\r\n'
+            f'content-type: application/json\r\ncontent-length: {len(payload)}\r\nconnection: close\r\n\r\n'
+            .encode() + payload
+        )
+        await writer.drain()
+        result.status = int((await reader.readline()).split()[1])
+        while chunk := await reader.read(1 << 20):
+            _measure(started, result, chunk)
+    finally:
+        writer.close()
+    result.latency = time.perf_counter() - started
+    result.failed = result.status >= 400
+    return result
+
+
+async def _ready(port: int, server: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'uvicorn exited with {server.returncode}')
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(.1)
+    raise RuntimeError('uvicorn did not start')
+
+
+async def run(workers: int, cpu_workers: int, connector_id: str, pg: dict, rows: int, concurrency: int,
+              requests: int) -> None:
+    server, port = _serve(workers, cpu_workers, connector_id, pg)
+    try:
+        await _ready(port, server)
+        path = f'/connectors/{connector_id}/query'
+        body = {'query': f'SELECT * FROM bench_orders ORDER BY id LIMIT {rows}'}
+        for _ in range(workers * 2):  # warm up every worker's connections and process pool
+            await asyncio.gather(*(_request(port, path, body) for _ in range(concurrency)))
+
+        results: list[Result] = []
+        remaining = iter(range(requests))
+
+        async def client() -> None:
+            for _ in remaining:
+                results.append(await _request(port, path, body))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+    ok = [each for each in results if not each.failed]
+    latencies = sorted(each.latency * 1000 for each in ok) or [0]
+    megabytes = sum(len(each.body) for each in ok) / 2 ** 20
+    print(
+        f'workers {workers:2} cpu pool {cpu_workers:2}: {len(results) / elapsed:7.1f} req/s | '
+        f'p50 {_percentile(latencies, 50):7.1f} p99 {_percentile(latencies, 99):7.1f} ms | '
+        f'{megabytes / elapsed:6.1f} MB/s | errors {len(results) - len(ok)}'
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    pg = {
+        'host': args.pg_host, 'port': args.pg_port, 'user': args.pg_user,
+        'password': args.pg_password, 'database': args.pg_database,
+    }
+    load_test.seed_postgres(pg, max(args.rows, 100_000))
+    connector_id = f'{load_test.dynamo.Ksuid()}'
+    print(f'{os.cpu_count()} cores, {args.rows} rows per response, concurrency {args.concurrency}')
+    for cpu_workers in args.cpu_workers:
+        for workers in args.workers:
+            await run(workers, cpu_workers, connector_id, pg, args.rows, args.concurrency, args.requests)
+
+
+if __name__ == '__main__':
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, cores}))
+    parser.add_argument('--cpu-workers', type=int, nargs='+', default=[0])
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--pg-host', default=os.environ.get('PGHOST', 'localhost'))
+    parser.add_argument('--pg-port', type=int, default=int(os.environ.get('PGPORT', 5432)))
+    parser.add_argument('--pg-user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--pg-password', default=os.environ.get('PGPASSWORD', 'postgres'))
+    parser.add_argument('--pg-database', default=os.environ.get('PGDATABASE', 'postgres'))
+    asyncio.run(main(parser.parse_args()))
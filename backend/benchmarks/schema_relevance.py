@@ -0,0 +1,117 @@
+"""
+Size of the explain prompt's schema for a large database, whole and scoped to a question by the
+relevance index (backend/api/relevance.py), and the cost of keeping the index: building it, updating
+it after a few tables changed, storing it and selecting tables.
+
+The inspection is synthetic: `--tables` tables (default 500) named after business domains and
+entities, with a dozen columns each, indexes, and foreign keys to a few tables of the same domain.
+
+    python backend/benchmarks/schema_relevance.py --tables 500 --budget 12000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+
+import relevance  # noqa: E402
+from framework import etag_of  # noqa: E402
+
+_domains = [
+    'sales', 'billing', 'inventory', 'shipping', 'crm', 'hr', 'payroll', 'marketing', 'support', 'analytics',
+    'catalog', 'procurement', 'finance', 'auth', 'audit', 'content', 'search', 'notifications', 'forecast', 'risk',
+]
+_entities = [
+    'accounts', 'orders', 'order_items', 'invoices', 'payments', 'refunds', 'customers', 'suppliers', 'products',
+    'warehouses', 'shipments', 'carriers', 'employees', 'departments', 'campaigns', 'tickets', 'events',
+    'sessions', 'subscriptions', 'plans', 'regions', 'currencies', 'discounts', 'reviews', 'contracts',
+]
+_columns = ['status', 'amount', 'currency', 'created_at', 'updated_at', 'notes', 'code', 'quantity', 'region_id',
+            'owner_id', 'score', 'started_at', 'ended_at', 'email', 'name', 'priority', 'channel', 'reference']
+_questions = [
+    None,
+    'Why are refunds growing for some customers?',
+    'Which warehouses ship late?',
+    'How do campaigns affect subscriptions?',
+]
+
+
+def _inspection(tables: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    names = [(_domains[i % len(_domains)], _entities[i // len(_domains) % len(_entities)], i) for i in range(tables)]
+    schemata = {}
+    for domain, entity, i in names:
+        name = f'{domain}_{entity}' + (f'_{i // (len(_domains) * len(_entities))}' if i >= len(_domains) * len(_entities) else '')
+        peers = [n for n in names if n[0] == domain and n[2] != i]
+        references = rng.sample(peers, min(len(peers), rng.randint(0, 3)))
+        columns = ['id', *(f'{other[1].rstrip("s")}_id' for other in references), *rng.sample(_columns, 10)]
+        schemata.setdefault(domain, []).append({
+            'tableName': name,
+            'schema': domain,
+            'comment': f'{entity.replace("_", " ").capitalize()} of the {domain} domain',
+            'estimatedRows': rng.randint(10, 10_000_000),
+            'totalBytes': rng.randint(8192, 10 ** 10),
+            'size': '1 GB',
+            'indexes': [{'indexName': f'{name}_pkey', 'columns': ['id'], 'isUnique': True, 'isPrimary': True,
+                         'bytes': 8192, 'definition': f'CREATE UNIQUE INDEX {name}_pkey ON {domain}.{name} (id)'}],
+            'columns': [
+                {'columnName': column, 'dataType': 'bigint' if column.endswith('id') else 'text',
+                 'isPrimaryKey': column == 'id', 'isForeignKey': column.endswith('_id') and column != 'id',
+                 'isNullable': column != 'id', 'nullFraction': round(rng.random() / 10, 4),
+                 'distinctValues': rng.randint(1, 100_000)}
+                for column in columns
+            ],
+            'references': [
+                {'constraintName': f'{name}_{other[1]}_fkey', 'columns': [f'{other[1].rstrip("s")}_id'],
+                 'referencedSchema': domain, 'referencedTable': f'{domain}_{other[1]}', 'referencedColumns': ['id']}
+                for other in references
+            ] or None,
+            'triggers': None,
+        })
+    return {'databases': [{'databaseName': 'benchmark', 'schemata': [
+        {'schemaName': domain, 'comment': None, 'tables': tables, 'routines': None}
+        for domain, tables in schemata.items()
+    ]}]}
+
+
+def _timed(fn, repeat: int = 1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+def main(args: argparse.Namespace) -> None:
+    inspection = _inspection(args.tables, seed=1)
+    etag = etag_of(inspection)
+    index = relevance.Index()
+    indexed, built = _timed(lambda: index.update(inspection, etag))
+    stored = index.to_json()
+    _, loaded = _timed(lambda: relevance.Index.from_json(stored), repeat=10)
+
+    changed = _inspection(args.tables, seed=1)
+    for table in changed['databases'][0]['schemata'][0]['tables'][:args.changed]:
+        table['estimatedRows'] += 1
+    reindexed, updated = _timed(lambda: index.update(changed, etag_of(changed)))
+
+    print(f'{args.tables} tables, whole schema {relevance.tokens(inspection):,} tokens, budget {args.budget:,}')
+    print(f'index: built {indexed} tables in {built:.1f} ms | {len(stored) / 1024:.0f} KiB stored, '
+          f'loaded in {loaded:.1f} ms | {reindexed} changed tables updated in {updated:.1f} ms')
+    for question in _questions:
+        (schema, kept, total), selected = _timed(
+            lambda: relevance.scope(changed, index, 'benchmark', question, budget=args.budget), repeat=10,
+        )
+        tables = [table['tableName'] for _, _, table in relevance._tables(schema)]
+        print(f'\n{question or "(no question)"}: {kept} of {total} tables, {relevance.tokens(schema):,} tokens, '
+              f'selected in {selected:.1f} ms')
+        print(f'  {", ".join(tables[:8])}{", ..." if len(tables) > 8 else ""}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tables', type=int, default=500)
+    parser.add_argument('--budget', type=int, default=12_000)
+    parser.add_argument('--changed', type=int, default=5)
+    main(parser.parse_args())
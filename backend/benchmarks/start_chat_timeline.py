@@ -0,0 +1,181 @@
+"""
+Timeline of `chats.start_chat` with fake database and LLM latencies.
+
+Compares the pipelined handler against a replica of the former strictly sequential one
+(lookup, connect, query, prompt, stream, save, all blocking the event loop), for a single
+request and for a burst of concurrent ones. Nothing leaves the process: DynamoDB, Postgres
+and the LLM are replaced with stand-ins that sleep like the real clients block.
+
+    python backend/benchmarks/start_chat_timeline.py --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+os.environ.setdefault('TABLE_NAME', 'benchmark')
+os.environ.setdefault('GEMINI_API_KEY', 'benchmark')
+
+import chats  # noqa: E402
+import llm  # noqa: E402
+import models  # noqa: E402
+import persistence  # noqa: E402
+import providers  # noqa: E402
+import usage  # noqa: E402
+from dynamo import Ksuid  # noqa: E402
+
+_user = 'benchmark-user'
+_connector = Ksuid()
+
+
+class Latencies:
+    dynamo = .02
+    connect = .15
+    query = .4
+    ttft = .6
+    token = .02
+    tokens = 20
+
+
+fake_llm = providers.Fake(ttft=Latencies.ttft, tokens_per_second=1 / Latencies.token, tokens=Latencies.tokens)
+
+
+class FakeDynamo:
+    def get_item(self, **_):
+        time.sleep(Latencies.dynamo)
+        return {
+            'Item': {
+                'PK': {'S': f'{models.user_type}#{_user}'},
+                'SK': {'S': f'{models.connector_type}#{_connector}'},
+                'host': {'S': 'localhost'},
+                'port': {'N': '5432'},
+                'user': {'S': 'postgres'},
+                'password': {'S': 'postgres'},
+                'database': {'S': 'postgres'},
+            }
+        }
+
+    def put_item(self, **_):
+        time.sleep(Latencies.dynamo)
+
+    def update_item(self, **_):
+        time.sleep(Latencies.dynamo)
+
+
+class FakeConnection:
+    def close(self):
+        pass
+
+
+def fake_connect(_):
+    time.sleep(Latencies.connect)
+    return FakeConnection()
+
+
+def fake_run_query(*_):
+    time.sleep(Latencies.query)
+    return ['id', 'value'], [[i, i * 2] for i in range(250)]
+
+
+def install_fakes() -> None:
+    dynamo = FakeDynamo()
+    models.db = chats.db = usage.db = lambda: dynamo
+    chats.connect = fake_connect
+    chats.run_query = fake_run_query
+    llm.use(fake_llm)
+
+
+class Recorder:
+    """ASGI `send` that timestamps the SSE events it gets."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.marks: list[tuple[float, str]] = []
+
+    async def __call__(self, message: dict) -> None:
+        now = time.perf_counter() - self.started
+        match message:
+            case {'type': 'http.response.body', 'body': body} if body:
+                event = body.split(b'\n', 2)[0].decode().removeprefix('event: ')
+                if not self.marks or self.marks[-1][1] != event:
+                    self.marks.append((now, event))
+            case {'type': 'http.response.body'}:
+                self.marks.append((now, 'closed'))
+
+    def first(self, event: str) -> float:
+        return next(at for at, name in self.marks if name == event)
+
+
+async def sequential(send) -> None:
+    """The former `start_chat`, condensed: every stage blocks the loop in turn."""
+    connector = models._get_connector(f'{_connector}', _user)
+    await chats.start_stream(send)
+    chat = models.Chat.from_dict(_request(send), _user, f'{connector.id}')
+    await chats.send_event(send, event='stored', data={'chat_id': f'{chat.id}'})
+    chat.query_results = fake_run_query(fake_connect(connector), chat.limited_query())
+    for chunk in fake_llm.stream(llm.default_model, []):
+        await chats.send_event(send, event='token', data={'t': chunk})
+    FakeDynamo().put_item()
+    await chats.finish_stream(send)
+
+
+async def pipelined(send) -> None:
+    await chats.start_chat(
+        f'{_connector}', _user, send, _request(send), stream=True,
+    )
+
+
+def _request(send) -> dict:
+    # distinct prompts, so that concurrent requests are not collapsed into a single flight
+    return {'query': 'SELECT 1', 'prompt': f'analyze {id(send)}'}
+
+
+async def burst(handler, concurrency: int) -> list[Recorder]:
+    started = time.perf_counter()
+    recorders = [Recorder(started) for _ in range(concurrency)]
+    await asyncio.gather(*(handler(each) for each in recorders))
+    await persistence.drain()
+    return recorders
+
+
+def report(name: str, recorders: list[Recorder]) -> None:
+    ttft = [each.first('token') for each in recorders]
+    closed = [each.first('closed') for each in recorders]
+    print(
+        f'{name:>10}: '
+        f'ttft p50 {statistics.median(ttft) * 1000:7.0f} ms, max {max(ttft) * 1000:7.0f} ms | '
+        f'closed p50 {statistics.median(closed) * 1000:7.0f} ms, max {max(closed) * 1000:7.0f} ms'
+    )
+
+
+def timeline(name: str, recorder: Recorder) -> None:
+    print(f'\n{name} timeline')
+    for at, event in recorder.marks:
+        print(f'  {at * 1000:7.0f} ms  {event}')
+
+
+async def main(concurrency: int) -> None:
+    install_fakes()
+    chats._heartbeat = .25
+
+    for handler in (sequential, pipelined):
+        [single] = await burst(handler, 1)
+        timeline(handler.__name__, single)
+
+    print(f'\nsingle request')
+    for handler in (sequential, pipelined):
+        report(handler.__name__, await burst(handler, 1))
+
+    print(f'\n{concurrency} concurrent requests')
+    for handler in (sequential, pipelined):
+        report(handler.__name__, await burst(handler, concurrency))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))
@@ -0,0 +1,95 @@
+"""
+Backend overhead per streamed token, measured with the fake LLM provider answering instantly.
+
+Each stage adds one layer of the chat path on top of the previous one:
+
+- provider: `providers.Fake.stream` alone, the floor;
+- llm.stream: plus the resilience layer's worker thread and queue;
+- iterate_blocking: plus a thread-pool hop per token, as chats streamed before `llm.astream`;
+- llm.astream: the async resilience layer instead, no threads;
+- sse: `llm.astream` published to a generation and relayed as SSE frames to a no-op `send`.
+
+    python backend/benchmarks/token_overhead.py --tokens 20000
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'api'))
+os.environ.setdefault('TABLE_NAME', 'benchmark')
+
+import llm  # noqa: E402
+import providers  # noqa: E402
+import streams  # noqa: E402
+from framework import iterate_blocking  # noqa: E402
+
+
+async def provider(fake: providers.Fake) -> int:
+    return sum(1 for _ in fake.stream(llm.default_model, []))
+
+
+async def llm_stream(_) -> int:
+    return sum(1 for _ in llm.stream('benchmark'))
+
+
+async def blocking_hops(_) -> int:
+    count = 0
+    async for _ in iterate_blocking(llm.stream('benchmark')):
+        count += 1
+    return count
+
+
+async def llm_astream(_) -> int:
+    count = 0
+    async for _ in llm.astream('benchmark'):
+        count += 1
+    return count
+
+
+async def sse(_) -> int:
+    async def produce(generation: streams.Generation) -> None:
+        async for chunk in llm.astream('benchmark'):
+            await generation.publish('token', {'t': chunk})
+
+    frames = 0
+
+    async def send(message: dict) -> None:
+        nonlocal frames
+        frames += bool(message.get('body'))
+
+    generation = streams.launch(f'benchmark.{time.monotonic_ns()}', produce)
+    await streams.relay(send, generation)
+    return frames
+
+
+async def main(tokens: int, repeat: int) -> None:
+    fake = providers.Fake(ttft=0, tokens_per_second=0, tokens=tokens)
+    llm.use(fake)
+    print(f'{tokens} tokens, best of {repeat}')
+    for name, stage in (
+            ('provider', provider),
+            ('llm.stream', llm_stream),
+            ('iterate_blocking', blocking_hops),
+            ('llm.astream', llm_astream),
+            ('sse', sse),
+    ):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):  # llm.stream prints every chunk
+                count = await stage(fake)
+            best = min(best, time.perf_counter() - started)
+        assert count == tokens, (name, count)
+        print(f'{name:>16}: {best / tokens * 1e6:8.2f} µs/token  {tokens / best:12,.0f} tokens/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.tokens, args.repeat))